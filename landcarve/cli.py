@@ -1,16 +1,68 @@
+import os
+
 import click
 
+from landcarve.utils.io import set_geotiff_options
+
 
 @click.group()
-def main():
+@click.option(
+    "--tiled/--striped",
+    default=False,
+    envvar="LANDCARVE_TILED",
+    help="Write GeoTIFFs in 256x256 tiles rather than rows",
+)
+@click.option(
+    "--compress",
+    default="none",
+    type=click.Choice(["none", "deflate", "zstd", "lzw"]),
+    envvar="LANDCARVE_COMPRESS",
+    help="Compress GeoTIFFs written, with a predictor",
+)
+@click.option(
+    "--overviews/--no-overviews",
+    default=False,
+    envvar="LANDCARVE_OVERVIEWS",
+    help="Add internal overviews to GeoTIFFs written",
+)
+@click.option(
+    "--bigtiff",
+    default="if-safer",
+    type=click.Choice(["if-safer", "if-needed", "yes", "no"]),
+    envvar="LANDCARVE_BIGTIFF",
+    help="When to write BigTIFFs",
+)
+@click.option(
+    "--keep-dtype/--float32",
+    default=False,
+    envvar="LANDCARVE_KEEP_DTYPE",
+    help="Write rasters in their own data type rather than Float32",
+)
+def main(tiled, compress, overviews, bigtiff, keep_dtype):
     """
     Top-level command entrypoint
     """
-    pass
+    set_geotiff_options(
+        tiled=tiled,
+        compress=None if compress == "none" else compress,
+        overviews=overviews,
+        bigtiff=bigtiff,
+        keep_dtype=keep_dtype,
+    )
+    # Passed on to any landcarve commands run from this one, like pipeline
+    # steps
+    os.environ.update(
+        LANDCARVE_TILED=str(int(tiled)),
+        LANDCARVE_COMPRESS=compress,
+        LANDCARVE_OVERVIEWS=str(int(overviews)),
+        LANDCARVE_BIGTIFF=bigtiff,
+        LANDCARVE_KEEP_DTYPE=str(int(keep_dtype)),
+    )
 
 
 # Import all sub-commands
 import landcarve.commands.bulkget
+import landcarve.commands.catalog
 import landcarve.commands.contour_image
 import landcarve.commands.decifit
 import landcarve.commands.decimate
@@ -21,6 +73,7 @@ import landcarve.commands.flipy
 import landcarve.commands.lasdem
 import landcarve.commands.pipeline
 import landcarve.commands.merge
+import landcarve.commands.overviews
 import landcarve.commands.realise
 import landcarve.commands.smooth
 import landcarve.commands.stats
@@ -29,7 +82,6 @@ import landcarve.commands.tileimage
 import landcarve.commands.tilesplit
 import landcarve.commands.zfit
 
-
 if __name__ == "__main__":
     print(id(main))
     main()
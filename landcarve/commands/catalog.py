@@ -0,0 +1,129 @@
+import os
+
+import click
+from osgeo import gdal
+
+from landcarve.cli import main
+from landcarve.utils.catalog import Catalog
+from landcarve.utils.io import is_native
+from landcarve.utils.mosaic import write_mosaic
+
+
+@main.group()
+def catalog():
+    """
+    Indexes DEM files and extracts areas from them
+    """
+    pass
+
+
+@catalog.command()
+@click.option(
+    "--prune/--no-prune",
+    default=True,
+    help="Remove files that no longer exist from the index",
+)
+@click.argument("catalog_path")
+@click.argument("input_paths", nargs=-1)
+def index(catalog_path, input_paths, prune):
+    """
+    Adds DEM files, and the rasters in any directories, to a catalog
+    """
+    files = Catalog(catalog_path)
+    counts = {"added": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+    for path in raster_paths(input_paths):
+        result = files.add(path) or "skipped"
+        if result == "skipped":
+            click.echo(f"Skipped {path}: not a positioned raster")
+        elif result != "unchanged":
+            click.echo(f"{result.capitalize()} {path}")
+        counts[result] += 1
+    removed = files.prune() if prune else 0
+    click.echo(
+        f"{counts['added']} added, {counts['updated']} updated, "
+        f"{counts['unchanged']} unchanged, {counts['skipped']} skipped, "
+        f"{removed} removed"
+    )
+
+
+@catalog.command()
+@click.option(
+    "--bbox",
+    required=True,
+    nargs=4,
+    type=float,
+    help="Area to find, as min x, min y, max x, max y",
+)
+@click.option("--srs", help="Only find files in this projection (e.g. EPSG:27700)")
+@click.argument("catalog_path")
+def find(catalog_path, bbox, srs):
+    """
+    Lists the files in a catalog that cover an area
+    """
+    for row in Catalog(catalog_path).find(bbox, srs):
+        value_range = (
+            "no data"
+            if row["minimum"] is None
+            else f"{row['minimum']:.2f} to {row['maximum']:.2f}"
+        )
+        click.echo(
+            f"{row['path']} ({row['srs'] or 'no projection'}, "
+            f"{row['x_resolution']:g} x {row['y_resolution']:g}, {value_range})"
+        )
+
+
+@catalog.command()
+@click.option(
+    "--bbox",
+    required=True,
+    nargs=4,
+    type=float,
+    help="Area to extract, as min x, min y, max x, max y",
+)
+@click.option("--srs", help="Only use files in this projection (e.g. EPSG:27700)")
+@click.option(
+    "--blend",
+    default="last",
+    type=click.Choice(["last", "first", "max"]),
+    help="Which valid value wins where files overlap",
+)
+@click.argument("catalog_path")
+@click.argument("output_path")
+def extract(catalog_path, output_path, bbox, srs, blend):
+    """
+    Extracts an area from the files in a catalog that cover it
+    """
+    if is_native(output_path):
+        raise click.UsageError("extract only writes files GDAL can write")
+    rows = Catalog(catalog_path).find(bbox, srs)
+    if not rows:
+        raise click.UsageError("No files in the catalog cover that area")
+    projections = sorted({row["srs"] for row in rows})
+    if len(projections) > 1:
+        raise click.UsageError(
+            "Files covering that area are in several projections (%s); pick one "
+            "with --srs" % ", ".join(p or "none" for p in projections)
+        )
+    click.echo(f"Extracting from {len(rows)} file(s)")
+    # Only the windows of each file inside the area are ever read
+    write_mosaic([row["path"] for row in rows], output_path, blend, bounds=bbox)
+
+
+def raster_paths(paths):
+    """
+    Yields the given files, and every raster GDAL recognises in the given
+    directories and under them.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, _, filenames in os.walk(path):
+            for filename in sorted(filenames):
+                file_path = os.path.join(directory, filename)
+                # Overviews look like rasters, but aren't ones we want, and
+                # native rasters can't be mosaicked
+                if filename.endswith(".ovr") or is_native(file_path):
+                    continue
+                if gdal.IdentifyDriver(file_path):
+                    yield file_path
@@ -1,7 +1,16 @@
 import click
 
 from landcarve.cli import main
-from landcarve.utils.io import array_to_raster, raster_to_array
+from landcarve.utils.io import (
+    RESAMPLING,
+    array_to_raster,
+    ensure_overviews,
+    nearest_indexes,
+    raster_shape,
+    raster_to_array,
+    resample_array,
+)
+from landcarve.utils.steps import array_step, fusable_step
 
 
 @main.command()
@@ -12,33 +21,77 @@ from landcarve.utils.io import array_to_raster, raster_to_array
     type=int,
     help="The maximum number of steps on X and Y.",
 )
+@click.option(
+    "--resampling",
+    default="nearest",
+    type=click.Choice(list(RESAMPLING)),
+    help="How to pick the values of the new cells",
+)
+@click.option(
+    "--build-overviews/--no-build-overviews",
+    default=False,
+    help="Build an overview pyramid for the input first if it has none",
+)
 @click.argument("input_path")
 @click.argument("output_path")
-def decifit(input_path, output_path, xy_steps):
+def decifit(input_path, output_path, xy_steps, resampling, build_overviews):
     """
     Scales raster layers down to a certain number of cells in X/Y, maintaining
     aspect ratio.
     """
-    # Load the file using GDAL
-    arr = raster_to_array(input_path)
-    # Downsample it
-    arr = downsample_array(arr, xy_steps)
+    if build_overviews and input_path != "-":
+        ensure_overviews(input_path)
+    # Load the file using GDAL, downsampling it as it's read
+    size = downsample_size(raster_shape(input_path), xy_steps)
+    arr = raster_to_array(input_path, size=size, resampling=resampling)
     click.echo("Downsampled to {} x {}".format(arr.shape[0], arr.shape[1]), err=True)
     # Write out the array
     array_to_raster(arr, output_path)
 
 
-def downsample_array(arr, max_dimension):
+@array_step("decifit", sized=True)
+def decifit_array(arr, xy_steps, resampling, build_overviews):
+    """
+    Runs decifit on an array.
+    """
+    arr = resample_array(arr, downsample_size(arr.shape, xy_steps), resampling)
+    click.echo("Downsampled to {} x {}".format(arr.shape[0], arr.shape[1]), err=True)
+    return arr
+
+
+@fusable_step("decifit", when=lambda resampling, **params: resampling == "nearest")
+def decifit_fused(shape, scan, xy_steps, resampling, build_overviews):
+    """
+    Describes decifit for pipeline fusion.
+    """
+    size = downsample_size(shape, xy_steps)
+    click.echo("Downsampled to {} x {}".format(*size), err=True)
+    return (
+        nearest_indexes(shape[0], size[0]),
+        nearest_indexes(shape[1], size[1]),
+        None,
+    )
+
+
+def downsample_size(shape, max_dimension):
+    """
+    Works out the (rows, columns) size to downsample an array of the given
+    shape to so its longest dimension is less than or equal to max_dimension,
+    keeping every step'th cell in each direction.
+    """
+    factor = downsample_factor(shape, max_dimension)
+    return -(-shape[0] // factor), -(-shape[1] // factor)
+
+
+def downsample_factor(shape, max_dimension):
     """
-    Takes an array and downsamples it so its longest dimension is less than
-    or equal to max_dimension.
+    Works out the step that brings the longest dimension of an array of the
+    given shape down to max_dimension or less.
     """
-    # Work out the downsampling factors for that array
-    width, height = arr.shape
+    width, height = shape
     current_steps = max(width, height)
     downsample_factor = 1
     while (current_steps // downsample_factor) > max_dimension:
         downsample_factor += 1
-    # Downsample the array
     print("Decimate factor: %s" % downsample_factor)
-    return arr[::downsample_factor, ::downsample_factor]
+    return downsample_factor
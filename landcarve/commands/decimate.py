@@ -1,7 +1,9 @@
 import click
+import numpy
 
 from landcarve.cli import main
 from landcarve.utils.io import array_to_raster, raster_to_array
+from landcarve.utils.steps import array_step, fusable_step
 
 
 @main.command()
@@ -22,7 +24,27 @@ def decimate(input_path, output_path, divisor):
     # Load the file using GDAL
     arr = raster_to_array(input_path)
     # Downsample it
-    arr = arr[::divisor, ::divisor]
-    click.echo("Downsampled to {} x {}".format(arr.shape[0], arr.shape[1]), err=True)
+    arr = decimate_array(arr, divisor)
     # Write out the array
     array_to_raster(arr, output_path)
+
+
+@array_step("decimate")
+def decimate_array(arr, divisor):
+    """
+    Runs decimate on an array.
+    """
+    arr = arr[::divisor, ::divisor]
+    click.echo("Downsampled to {} x {}".format(arr.shape[0], arr.shape[1]), err=True)
+    return arr
+
+
+@fusable_step("decimate")
+def decimate_fused(shape, scan, divisor):
+    """
+    Describes decimate for pipeline fusion.
+    """
+    rows = numpy.arange(shape[0])[::divisor]
+    cols = numpy.arange(shape[1])[::divisor]
+    click.echo("Downsampled to {} x {}".format(len(rows), len(cols)), err=True)
+    return rows, cols, None
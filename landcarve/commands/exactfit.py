@@ -1,8 +1,15 @@
 import click
-import numpy
 
 from landcarve.cli import main
-from landcarve.utils.io import array_to_raster, raster_to_array
+from landcarve.utils.io import (
+    RESAMPLING,
+    array_to_raster,
+    ensure_overviews,
+    nearest_indexes,
+    raster_to_array,
+    resample_array,
+)
+from landcarve.utils.steps import array_step, fusable_step
 
 
 @main.command()
@@ -20,33 +27,46 @@ from landcarve.utils.io import array_to_raster, raster_to_array
     type=int,
     help="The exact number of steps on Y",
 )
+@click.option(
+    "--resampling",
+    default="nearest",
+    type=click.Choice(list(RESAMPLING)),
+    help="How to pick the values of the new cells",
+)
+@click.option(
+    "--build-overviews/--no-build-overviews",
+    default=False,
+    help="Build an overview pyramid for the input first if it has none",
+)
 @click.argument("input_path")
 @click.argument("output_path")
-def exactfit(input_path, output_path, x_steps, y_steps):
+def exactfit(input_path, output_path, x_steps, y_steps, resampling, build_overviews):
     """
     Scales raster layers down to a certain number of cells in X/Y exactly.
     """
-    # Load the file using GDAL
-    arr = raster_to_array(input_path)
-    # Downsample it
-    arr = downsample_array(arr, x_steps, y_steps)
+    if build_overviews and input_path != "-":
+        ensure_overviews(input_path)
+    # Load the file using GDAL, resampling it as it's read
+    arr = raster_to_array(input_path, size=(y_steps, x_steps), resampling=resampling)
     click.echo("Downsampled to {} x {}".format(arr.shape[0], arr.shape[1]), err=True)
     # Write out the array
     array_to_raster(arr, output_path)
 
 
-def downsample_array(arr, x_dimension, y_dimension):
+@array_step("exactfit", sized=True)
+def exactfit_array(arr, x_steps, y_steps, resampling, build_overviews):
+    """
+    Runs exactfit on an array.
+    """
+    arr = resample_array(arr, (y_steps, x_steps), resampling)
+    click.echo("Downsampled to {} x {}".format(arr.shape[0], arr.shape[1]), err=True)
+    return arr
+
+
+@fusable_step("exactfit", when=lambda resampling, **params: resampling == "nearest")
+def exactfit_fused(shape, scan, x_steps, y_steps, resampling, build_overviews):
     """
-    Takes an array and downsamples it so its longest dimension is less than
-    or equal to max_dimension.
+    Describes exactfit for pipeline fusion.
     """
-    # Work out the downsampling factors for that array
-    current_y, current_x = arr.shape
-    x_step = current_x / x_dimension
-    y_step = current_y / y_dimension
-    # Create a new array and populate it
-    new_arr = numpy.ndarray((y_dimension, x_dimension))
-    for dx in range(x_dimension):
-        for dy in range(y_dimension):
-            new_arr[dy][dx] = arr[int(dy * y_step)][int(dx * x_step)]
-    return new_arr
+    click.echo("Downsampled to {} x {}".format(y_steps, x_steps), err=True)
+    return nearest_indexes(shape[0], y_steps), nearest_indexes(shape[1], x_steps), None
@@ -3,12 +3,16 @@ import numpy
 
 from landcarve.cli import main
 from landcarve.constants import NODATA
-from landcarve.utils.io import array_to_raster, raster_to_array
+from landcarve.utils.io import map_raster
+from landcarve.utils.steps import array_step, fusable_step
 
 
 @main.command()
 @click.option(
-    "--nodata", default=0.0, type=float, help="NODATA boundary for input",
+    "--nodata",
+    default=0.0,
+    type=float,
+    help="NODATA boundary for input",
 )
 @click.argument("input_path")
 @click.argument("output_path")
@@ -17,11 +21,33 @@ def fixnodata(ctx, input_path, output_path, nodata):
     """
     Fixes NODATA ranges on files to pin them to -1000.
     """
-    # Load the file using GDAL
-    arr = raster_to_array(input_path)
-    # Fix NODATA
-    scaler = lambda x: x if x > nodata else NODATA
-    arr = numpy.vectorize(scaler, otypes="f")(arr)
+    # Fix NODATA a block at a time
+    map_raster(input_path, output_path, lambda arr: fixnodata_values(arr, nodata))
     click.echo("NODATA values set to {}".format(NODATA), err=True)
-    # Write out the array
-    array_to_raster(arr, output_path)
+
+
+@array_step("fixnodata")
+def fixnodata_array(arr, nodata):
+    """
+    Runs fixnodata on an array.
+    """
+    arr = fixnodata_values(arr, nodata)
+    click.echo("NODATA values set to {}".format(NODATA), err=True)
+    return arr
+
+
+@fusable_step("fixnodata")
+def fixnodata_fused(shape, scan, nodata):
+    """
+    Describes fixnodata for pipeline fusion.
+    """
+    click.echo("NODATA values set to {}".format(NODATA), err=True)
+    return None, None, lambda values: fixnodata_values(values, nodata)
+
+
+def fixnodata_values(arr, nodata):
+    """
+    Sets everything at or below nodata to NODATA.
+    """
+    above = numpy.asarray(arr, dtype=numpy.float64) > nodata
+    return numpy.where(above, arr, NODATA).astype(numpy.float32)
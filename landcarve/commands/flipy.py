@@ -4,6 +4,7 @@ import numpy
 from landcarve.cli import main
 from landcarve.constants import NODATA
 from landcarve.utils.io import array_to_raster, raster_to_array
+from landcarve.utils.steps import array_step, fusable_step
 
 
 @main.command()
@@ -16,7 +17,25 @@ def flipy(input_path, output_path):
     # Load the file using GDAL
     arr = raster_to_array(input_path)
     # Run stepper
-    arr = numpy.flipud(arr)
-    click.echo("Array flipped up/down")
+    arr = flipy_array(arr)
     # Write out the array
     array_to_raster(arr, output_path)
+
+
+@array_step("flipy")
+def flipy_array(arr):
+    """
+    Runs flipy on an array.
+    """
+    arr = numpy.flipud(arr)
+    click.echo("Array flipped up/down")
+    return arr
+
+
+@fusable_step("flipy")
+def flipy_fused(shape, scan):
+    """
+    Describes flipy for pipeline fusion.
+    """
+    click.echo("Array flipped up/down")
+    return numpy.arange(shape[0])[::-1], None, None
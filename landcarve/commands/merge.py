@@ -1,17 +1,26 @@
 import click
-import subprocess
 
 from landcarve.cli import main
+from landcarve.utils.io import is_native
+from landcarve.utils.mosaic import write_mosaic
 
 
 @main.command()
+@click.option(
+    "--blend",
+    default="last",
+    type=click.Choice(["last", "first", "max"]),
+    help="Which valid value wins where inputs overlap",
+)
 @click.argument("input_paths", nargs=-1)
 @click.argument("output_path")
-def merge(
-    input_paths, output_path,
-):
+def merge(blend, input_paths, output_path):
     """
-    Merges DEMs together
+    Merges DEMs together. A .vrt output is a virtual mosaic that reads from
+    the inputs as it's used, rather than a copy of them all.
     """
-
-    subprocess.call(["gdal_merge.py", "-o", output_path] + list(input_paths))
+    if not input_paths:
+        raise click.UsageError("Give at least one input to merge")
+    if any(is_native(path) for path in (*input_paths, output_path)):
+        raise click.UsageError("merge only works on files GDAL can read and write")
+    write_mosaic(input_paths, output_path, blend)
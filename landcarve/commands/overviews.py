@@ -0,0 +1,27 @@
+import click
+
+from landcarve.cli import main
+from landcarve.utils.io import ensure_overviews
+
+
+@main.command()
+@click.option(
+    "--internal/--external",
+    default=False,
+    help="Store overviews inside the file rather than in a .ovr file next to it",
+)
+@click.option(
+    "--rebuild/--no-rebuild",
+    default=False,
+    help="Rebuild overviews for files that already have them",
+)
+@click.argument("input_paths", nargs=-1)
+def overviews(input_paths, internal, rebuild):
+    """
+    Builds overview pyramids for DEMs, so they can be read downsampled quickly
+    """
+    for input_path in input_paths:
+        if ensure_overviews(input_path, internal=internal, rebuild=rebuild):
+            click.echo(f"Built overviews for {input_path}")
+        else:
+            click.echo(f"{input_path} already has overviews, or can't have them")
@@ -1,21 +1,134 @@
+import concurrent.futures
+import contextlib
+import io
 import os
-import shutil
 import shlex
-import subprocess
 import sys
 import tempfile
+import time
+import traceback
 
 import click
+import numpy
 
 from landcarve.cli import main
-from landcarve.utils.io import array_to_raster, raster_to_array
+from landcarve.utils.cache import StepCache
+from landcarve.utils.io import (
+    NATIVE_SUFFIX,
+    Raster,
+    array_to_raster,
+    link_raster,
+    raster_to_array_and_projection,
+    remove_raster,
+)
+from landcarve.utils.jobqueue import JobQueue
+from landcarve.utils.manifest import Manifest
+from landcarve.utils.profile import (
+    array_details,
+    file_details,
+    profile_step,
+    run_command,
+    summary_table,
+    write_records,
+)
+from landcarve.utils.steps import array_steps, fusable_steps, sized_steps
 
 
 @main.command()
 @click.option("--extension", default=".stl")
+@click.option(
+    "--in-process/--subprocess",
+    default=False,
+    help="Run every step in this process, passing arrays between them",
+)
+@click.option(
+    "--intermediates",
+    default="native",
+    type=click.Choice(["native", "geotiff"]),
+    help="Format of the files passed between steps",
+)
+@click.option(
+    "--jobs",
+    default=1,
+    type=int,
+    help="How many inputs to run at once (0 for one per CPU)",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Reuse intermediate results from earlier runs",
+)
+@click.option(
+    "--cache-dir",
+    default=os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "landcarve",
+    ),
+    help="Where to keep cached intermediate results",
+)
+@click.option(
+    "--cache-size",
+    default=1024,
+    type=int,
+    help="Maximum size of the cache (in MB)",
+)
+@click.option(
+    "--profile/--no-profile",
+    default=False,
+    help="Print how long each step took and how much memory and I/O it used",
+)
+@click.option(
+    "--profile-json",
+    default=None,
+    help="Write per-step, per-input profiling records to this file as JSON lines",
+)
+@click.option(
+    "--queue",
+    default=None,
+    help="Directory of a shared job queue to add the inputs to",
+)
+@click.option(
+    "--worker/--no-worker",
+    default=False,
+    help="Run inputs claimed from the --queue until it's empty",
+)
+@click.option(
+    "--retries",
+    default=2,
+    type=int,
+    help="How many times a worker retries a failed queued input",
+)
+@click.option(
+    "--stale-after",
+    default=600,
+    type=int,
+    help="Seconds before a queued input whose worker went quiet is retried",
+)
+@click.option(
+    "--manifest",
+    default=None,
+    help="File recording each input's run, so re-runs skip up-to-date outputs",
+)
 @click.argument("pipeline_file")
 @click.argument("input_paths", nargs=-1)
-def pipeline(input_paths, extension, pipeline_file):
+def pipeline(
+    input_paths,
+    extension,
+    in_process,
+    intermediates,
+    jobs,
+    cache,
+    cache_dir,
+    cache_size,
+    profile,
+    profile_json,
+    queue,
+    worker,
+    retries,
+    stale_after,
+    manifest,
+    pipeline_file,
+):
     """
     Runs a series of commands from a predefined pipeline, handling file passing.
     """
@@ -30,33 +143,646 @@ def pipeline(input_paths, extension, pipeline_file):
         if not line or line.startswith("#"):
             continue
         pipeline.append(line)
-    # For each input...
+    if cache:
+        cache = StepCache(cache_dir, cache_size * 1024 * 1024)
+    else:
+        cache = None
+    records = [] if profile or profile_json else None
+    run = dict(
+        jobs=jobs,
+        in_process=in_process,
+        intermediates=NATIVE_SUFFIX if intermediates == "native" else ".tmp",
+        cache=cache,
+        records=records,
+    )
+    if worker and not queue:
+        raise click.UsageError("--worker needs a --queue to work from")
+    if manifest and queue:
+        raise click.UsageError("Queues keep their own record; don't use --manifest")
+    if queue:
+        job_queue = JobQueue(queue)
+        added = sum(job_queue.add(input_path) for input_path in input_paths)
+        click.echo(f"Queued {added} new inputs in {queue}")
+        if not worker:
+            return
+        input_paths, failed = run_worker(
+            job_queue, pipeline, extension, run, retries, stale_after
+        )
+    elif manifest:
+        _, fanout, _, fanin = split_pipeline(pipeline)
+        if fanout and not fanin:
+            raise click.UsageError("--manifest needs one output per input; add a fanin")
+        manifest = Manifest(manifest, pipeline)
+        # Only run inputs whose outputs are missing or out of date
+        stale = [
+            input_path
+            for input_path in input_paths
+            if not manifest.up_to_date(input_path, input_path + extension)
+        ]
+        skipped = len(input_paths) - len(stale)
+        if skipped:
+            click.echo(click.style(f"Skipping {skipped} up-to-date inputs", fg="blue"))
+        failed = run_inputs(
+            stale,
+            pipeline,
+            extension,
+            run,
+            lambda input_path, succeeded: manifest.record(
+                input_path, input_path + extension, succeeded
+            ),
+        )
+    else:
+        failed = run_inputs(input_paths, pipeline, extension, run)
+    # Summarise
+    if profile:
+        for line in summary_table(records):
+            click.echo(line)
+    if profile_json:
+        write_records(records, profile_json)
+    click.echo(
+        click.style(
+            f"{len(input_paths) - len(failed)} succeeded, {len(failed)} failed",
+            fg="red" if failed else "blue",
+            bold=True,
+        )
+    )
+    for input_path in failed:
+        click.echo(f"Failed: {input_path}")
+    if failed:
+        sys.exit(1)
+
+
+def run_inputs(input_paths, pipeline, extension, run, finished=None):
+    """
+    Runs the pipeline on each input, returning the ones that failed. If
+    given, finished is called with each input and whether it succeeded as
+    soon as it's done.
+    """
+    head, fanout, tail, fanin = split_pipeline(pipeline)
+    if fanout is None:
+        # Run each input, spread across processes if asked
+        tasks = [
+            (pipeline, input_path, input_path + extension, input_path)
+            for input_path in input_paths
+        ]
+
+        def task_finished(index, succeeded):
+            if finished:
+                finished(input_paths[index], succeeded)
+
+        failed = run_tasks(tasks, **run, finished=task_finished)
+        return [input_paths[index] for index in failed]
+    with tempfile.TemporaryDirectory(prefix="landcarve-") as tile_dir:
+        failed = run_fanned(
+            input_paths, head, fanout, tail, fanin, extension, tile_dir, run
+        )
+    if finished:
+        for input_path in input_paths:
+            finished(input_path, input_path not in failed)
+    return failed
+
+
+def run_worker(queue, pipeline, extension, run, retries, stale_after):
+    """
+    Claims inputs from a job queue and runs them one at a time until there
+    are none left, including any running elsewhere that might yet need a
+    retry. Returns the inputs this worker finished, and the ones of those
+    that failed for good.
+    """
+    finished = []
+    failed = []
+    while True:
+        queue.reclaim(stale_after, retries)
+        claimed = queue.claim()
+        if claimed is None:
+            if not queue.ids("running"):
+                break
+            # Wait to see if other workers finish or go quiet
+            time.sleep(min(stale_after / 4, 10))
+            continue
+        claim, job = claimed
+        input_path = job["input"]
+        with queue.heartbeat(claim, stale_after / 4):
+            succeeded = not run_inputs([input_path], pipeline, extension, run)
+        state = queue.finish(claim, job, succeeded, retries)
+        if state == "pending":
+            click.echo(click.style(f"Will retry {input_path}", fg="red", bold=True))
+            continue
+        finished.append(input_path)
+        if state == "failed":
+            failed.append(input_path)
+    counts = queue.counts()
+    click.echo(", ".join(f"{count} {state}" for state, count in counts.items()))
+    return finished, failed
+
+
+def split_pipeline(pipeline):
+    """
+    Splits a pipeline at its fan-out step, if it has one. Returns the steps
+    before it, the fan-out step (or None), the steps to run on each of its
+    outputs, and the fan-in step (or None).
+    """
+    fanouts = [i for i, line in enumerate(pipeline) if shlex.split(line)[0] == "fanout"]
+    fanins = [i for i, line in enumerate(pipeline) if shlex.split(line)[0] == "fanin"]
+    if not fanouts:
+        if fanins:
+            raise click.UsageError("fanin needs a fanout before it")
+        return pipeline, None, [], None
+    if len(fanouts) > 1:
+        raise click.UsageError("Only one fanout is allowed per pipeline")
+    if fanins and fanins != [len(pipeline) - 1]:
+        raise click.UsageError("fanin must be the last step, and only appear once")
+    if any(len(shlex.split(pipeline[i])) < 2 for i in fanouts + fanins):
+        raise click.UsageError("fanout and fanin need a command after them")
+    split = fanouts[0]
+    tail = pipeline[split + 1 : fanins[0] if fanins else None]
+    if not tail and not fanins:
+        raise click.UsageError("fanout needs steps or a fanin after it")
+    return (
+        pipeline[:split],
+        pipeline[split].split(None, 1)[1],
+        tail,
+        pipeline[fanins[0]].split(None, 1)[1] if fanins else None,
+    )
+
+
+def run_tasks(tasks, jobs, in_process, intermediates, cache, records, finished=None):
+    """
+    Runs a list of (pipeline, input path, output path, label) tasks, spread
+    across processes if jobs isn't 1. Returns the indexes of the ones that
+    failed. If given, finished is called with each task's index and whether
+    it succeeded as soon as it's done.
+    """
+    failed = []
+    if jobs == 1:
+        for index, (pipeline, input_path, output_path, label) in enumerate(tasks):
+            click.echo(click.style(f"Running on {label}", fg="blue", bold=True))
+            succeeded = run_input(
+                pipeline,
+                input_path,
+                output_path,
+                in_process,
+                intermediates,
+                cache,
+                records,
+            )
+            if not succeeded:
+                failed.append(index)
+            if finished:
+                finished(index, succeeded)
+        return failed
+    with concurrent.futures.ProcessPoolExecutor(jobs or None) as executor:
+        futures = {
+            executor.submit(
+                run_input_logged,
+                pipeline,
+                input_path,
+                output_path,
+                in_process,
+                intermediates,
+                cache,
+                records is not None,
+            ): index
+            for index, (pipeline, input_path, output_path, _) in enumerate(tasks)
+        }
+        # Print each task's log in one go, as it finishes
+        for future in concurrent.futures.as_completed(futures):
+            index = futures[future]
+            succeeded, log, task_records = future.result()
+            for line in log.splitlines():
+                click.echo(f"[{tasks[index][3]}] {line}")
+            if records is not None:
+                records.extend(task_records)
+            if not succeeded:
+                failed.append(index)
+            if finished:
+                finished(index, succeeded)
+    return sorted(failed)
+
+
+def run_fanned(input_paths, head, fanout, tail, fanin, extension, tile_dir, run):
+    """
+    Runs a pipeline with a fan-out step: each input is run up to and through
+    the fan-out step, every file that writes becomes a stream of its own that
+    the following steps are run on, and then the fan-in step (if there is
+    one) brings each input's streams back together. Returns the inputs that
+    failed.
+    """
+    failed = []
+    # Run each input up to and through the fan-out
+    split_dirs = [os.path.join(tile_dir, str(n)) for n in range(len(input_paths))]
+    tasks = []
+    for input_path, split_dir in zip(input_paths, split_dirs):
+        os.mkdir(split_dir)
+        name = os.path.splitext(os.path.basename(input_path))[0]
+        split_path = os.path.join(split_dir, name + ".tif")
+        tasks.append((head + [fanout], input_path, split_path, input_path))
+    split_failed = set(run_tasks(tasks, **run))
+    # Then the rest of the steps on every stream
+    streams = []
+    for n, (input_path, split_dir) in enumerate(zip(input_paths, split_dirs)):
+        if n in split_failed:
+            failed.append(input_path)
+            continue
+        for stream in sorted(os.listdir(split_dir)):
+            # Streams being fanned back in stay in the temporary directory
+            if fanin:
+                os.makedirs(split_dir + "-out", exist_ok=True)
+                output_path = os.path.join(split_dir + "-out", stream)
+            else:
+                output_path = os.path.join(os.path.dirname(input_path), stream)
+                output_path += extension
+            streams.append((input_path, os.path.join(split_dir, stream), output_path))
+    if tail:
+        tasks = [
+            (
+                tail,
+                stream_path,
+                output_path,
+                f"{input_path}: {os.path.basename(stream_path)}",
+            )
+            for input_path, stream_path, output_path in streams
+        ]
+        for index in run_tasks(tasks, **run):
+            if streams[index][0] not in failed:
+                failed.append(streams[index][0])
+    else:
+        streams = [(input_path, path, path) for input_path, path, _ in streams]
+    if fanin is None:
+        return failed
+    # And bring each input's streams back together
     for input_path in input_paths:
-        click.echo(click.style(f"Running on {input_path}", fg="blue", bold=True))
-        # Run through the pipeline
-        current_path = input_path
-        temporary_file_counter = 1
-        input_is_temporary = False
+        if input_path in failed:
+            continue
+        paths = [
+            output_path for owner, _, output_path in streams if owner == input_path
+        ]
+        if not run_fanin(fanin, paths, input_path + extension, run["in_process"]):
+            failed.append(input_path)
+    return [input_path for input_path in input_paths if input_path in failed]
+
+
+def run_fanin(line, input_paths, output_path, in_process):
+    """
+    Runs a fan-in step, which takes all of an input's streams as its inputs.
+    Returns True if it succeeded.
+    """
+    click.echo(click.style("Running: fanin %s" % line, fg="green", bold=True))
+    name, *args = shlex.split(line)
+    if in_process:
+        command = main.commands.get(name)
+        try:
+            if command is None:
+                raise click.UsageError(f"No such command '{name}'")
+            with command.make_context(name, [*args, *input_paths, output_path]) as ctx:
+                command.invoke(ctx)
+        except click.ClickException as error:
+            error.show()
+        except Exception:
+            traceback.print_exc()
+        else:
+            return True
+    else:
+        command = ["landcarve", name, *args, *input_paths, output_path]
+        if not run_command(command, False)[0]:
+            return True
+    click.echo(click.style("Subcommand failed", fg="red", bold=True))
+    return False
+
+
+def run_input(
+    pipeline,
+    input_path,
+    output_path,
+    in_process,
+    intermediates,
+    cache,
+    records=None,
+    capture=False,
+):
+    """
+    Runs the pipeline on one input, returning True if every step succeeded.
+    Files passed between steps get the intermediates suffix. If records is a
+    list, a profiling record for each step run is added to it. If capture is
+    set, subcommand output is echoed through this process rather than going
+    straight to the terminal.
+    """
+    if in_process:
+        return run_in_process(pipeline, input_path, output_path, cache, records)
+    # Run through the pipeline
+    current_path = input_path
+    temporary_file_counter = 1
+    input_is_temporary = False
+    with tempfile.TemporaryDirectory(prefix="landcarve-") as tmpdir:
+        # Pick up from the last step we have a cached output for
+        input_hash, start, cached_path = find_cached(
+            pipeline, input_path, cache, intermediates
+        )
+        if start:
+            current_path = os.path.join(tmpdir, "cached" + intermediates)
+            link_raster(cached_path, current_path)
+            input_is_temporary = True
+        for i, line in enumerate(pipeline[start:], start):
+            # Work out input/output filenames
+            if i == len(pipeline) - 1:
+                next_path = output_path
+            else:
+                next_path = os.path.join(
+                    tmpdir, "output-%i%s" % (temporary_file_counter, intermediates)
+                )
+                temporary_file_counter += 1
+            # Run the command
+            command = ["landcarve", *shlex.split(line), current_path, next_path]
+            click.echo(click.style("Running: %s" % command, fg="green", bold=True))
+            wall_start = time.perf_counter()
+            returncode, output, cpu_time, rss = run_command(command, capture)
+            wall_time = time.perf_counter() - wall_start
+            if capture:
+                click.echo(output.decode("utf8", "replace"), nl=False)
+            if returncode:
+                click.echo(click.style("Subcommand failed", fg="red", bold=True))
+                return False
+            if records is not None:
+                records.append(
+                    {
+                        "input": input_path,
+                        "step": line,
+                        "wall_time": wall_time,
+                        "cpu_time": cpu_time,
+                        "peak_rss": rss,
+                        **file_details("input", current_path),
+                        **file_details("output", next_path),
+                    }
+                )
+            if input_hash and i < len(pipeline) - 1:
+                # The intermediate file is cached as it is, linked if it can be
+                cache.put(
+                    cache.key(input_hash, pipeline[: i + 1]),
+                    intermediates,
+                    lambda path: link_raster(next_path, path),
+                    os.path.getsize(next_path),
+                )
+            # Delete any old temporary file
+            if input_is_temporary:
+                remove_raster(current_path)
+            current_path = next_path
+            input_is_temporary = True
+    return True
+
+
+def run_input_logged(
+    pipeline, input_path, output_path, in_process, intermediates, cache, profile
+):
+    """
+    Runs the pipeline on one input in a worker process, collecting everything
+    it prints. Returns (succeeded, log, profiling records).
+    """
+    log = io.StringIO()
+    records = [] if profile else None
+    with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        succeeded = run_input(
+            pipeline,
+            input_path,
+            output_path,
+            in_process,
+            intermediates,
+            cache,
+            records,
+            capture=True,
+        )
+    return succeeded, log.getvalue(), records
+
+
+def run_in_process(pipeline, input_path, output_path, cache, records=None):
+    """
+    Runs the pipeline steps on one input inside this process. Commands that
+    have an array version get the previous step's array directly; any others
+    are still run here, but through temporary files. Runs of two or more
+    fusable steps are done together in a single pass. A first step that reads
+    its input at a smaller size is given the input file rather than all of
+    it. Returns True if every step succeeded.
+    """
+    try:
+        # Pick up from the last step we have a cached output for
+        input_hash, start, cached_path = find_cached(
+            pipeline, input_path, cache, ".npz"
+        )
+        if start:
+            with numpy.load(cached_path) as cached:
+                arr, projection = cached["arr"], str(cached["projection"])
+        elif shlex.split(pipeline[0])[0] in sized_steps:
+            # Left for the first step to read itself
+            arr, projection = None, Raster(input_path).projection
+        else:
+            arr, projection = raster_to_array_and_projection(input_path)
         with tempfile.TemporaryDirectory(prefix="landcarve-") as tmpdir:
-            for i, line in enumerate(pipeline):
-                # Work out input/output filenames
-                if i == len(pipeline) - 1:
-                    next_path = input_path + extension
-                else:
-                    next_path = os.path.join(
-                        tmpdir, "output-%i.tmp" % temporary_file_counter
+            i = start
+            while i < len(pipeline):
+                # Find the run of fusable steps starting here, if any
+                end = i
+                while (
+                    arr is not None
+                    and end < len(pipeline)
+                    and is_fusable(pipeline[end])
+                ):
+                    end += 1
+                last = max(end, i + 1) == len(pipeline)
+                step = " | ".join(pipeline[i : max(end, i + 1)])
+                with profile_step(records, input_path, step) as record:
+                    if arr is None:
+                        record.update(file_details("input", input_path))
+                    else:
+                        record.update(array_details("input", arr))
+                    if end - i > 1:
+                        arr = run_fused(
+                            pipeline[i:end], arr, projection, output_path, last
+                        )
+                        i = end - 1
+                    else:
+                        arr, projection = run_step(
+                            pipeline[i],
+                            arr,
+                            projection,
+                            tmpdir,
+                            output_path,
+                            last,
+                            input_path,
+                        )
+                    if last:
+                        record.update(file_details("output", output_path))
+                    else:
+                        record.update(array_details("output", arr))
+                if input_hash and not last:
+                    cache.put(
+                        cache.key(input_hash, pipeline[: i + 1]),
+                        ".npz",
+                        lambda path: numpy.savez(path, arr=arr, projection=projection),
+                        arr.nbytes,
                     )
-                    temporary_file_counter += 1
-                # Run the command
-                command = ["landcarve", *shlex.split(line), current_path, next_path]
-                click.echo(click.style("Running: %s" % command, fg="green", bold=True))
-                try:
-                    subprocess.check_call(command)
-                except subprocess.CalledProcessError:
-                    click.echo(click.style("Subcommand failed", fg="red", bold=True))
-                    sys.exit(1)
-                # Delete any old temporary file
-                if input_is_temporary:
-                    os.unlink(current_path)
-                current_path = next_path
-                input_is_temporary = True
+                i += 1
+    except click.ClickException as error:
+        error.show()
+    except Exception:
+        traceback.print_exc()
+    else:
+        return True
+    click.echo(click.style("Subcommand failed", fg="red", bold=True))
+    return False
+
+
+def find_cached(pipeline, input_path, cache, suffix):
+    """
+    Looks for the latest intermediate output of the pipeline on an input in
+    the cache. Returns the input's hash (None if it can't be cached), how
+    many steps the cached output covers, and its path.
+    """
+    if cache is None:
+        return None, 0, None
+    try:
+        input_hash = cache.file_hash(input_path)
+    except OSError:
+        return None, 0, None
+    for done in range(len(pipeline) - 1, 0, -1):
+        path = cache.get(cache.key(input_hash, pipeline[:done]), suffix)
+        if path:
+            click.echo(
+                click.style(
+                    "Using cached output of: %s" % pipeline[done - 1],
+                    fg="green",
+                    bold=True,
+                )
+            )
+            return input_hash, done, path
+    return input_hash, 0, None
+
+
+def run_step(line, arr, projection, tmpdir, output_path, last, input_path=None):
+    """
+    Runs one pipeline step in-process, returning the array and projection
+    the next step should get. If arr is None, the step reads input_path
+    itself.
+    """
+    next_path = output_path if last else temporary_path(tmpdir)
+    click.echo(click.style("Running: %s" % line, fg="green", bold=True))
+    name, command, ctx, params = parse_step(line, next_path)
+    function, sink = array_steps.get(name, (None, False))
+    if arr is None or function is None:
+        if arr is None:
+            current_path = input_path
+        else:
+            # Hand over through a file, written so it reads back as the array
+            # we have
+            current_path = temporary_path(tmpdir)
+            array_to_raster(numpy.flipud(arr), current_path, projection=projection)
+        ctx.params["input_path"] = current_path
+        with ctx:
+            command.invoke(ctx)
+        if not last:
+            arr, read_projection = raster_to_array_and_projection(next_path)
+            # Steps with an array version keep the projection, as they
+            # would if they were run on the array
+            if function is None:
+                projection = read_projection
+    elif sink:
+        if not last:
+            raise click.UsageError(f"'{name}' must be the last step")
+        function(arr, next_path, **params)
+    else:
+        arr = function(arr, **params)
+        if last:
+            array_to_raster(arr, next_path, projection=projection)
+        else:
+            # Steps write their output flipped up/down and read it back
+            # as-is, so do the same here
+            arr = numpy.flipud(arr)
+    return arr, projection
+
+
+def temporary_path(tmpdir):
+    """
+    Returns a new path in tmpdir for a native raster, so arrays still mapped
+    from earlier files are never overwritten.
+    """
+    fd, path = tempfile.mkstemp(dir=tmpdir, suffix=NATIVE_SUFFIX)
+    os.close(fd)
+    return path
+
+
+def parse_step(line, output_path):
+    """
+    Parses a pipeline step's options just as a separate run would. Returns
+    the command name, the command, its context and its options other than
+    the input and output paths.
+    """
+    name, *args = shlex.split(line)
+    command = main.commands.get(name)
+    if command is None:
+        raise click.UsageError(f"No such command '{name}'")
+    ctx = command.make_context(name, [*args, "-", output_path])
+    params = dict(ctx.params)
+    params.pop("input_path", None)
+    params.pop("output_path", None)
+    return name, command, ctx, params
+
+
+def is_fusable(line):
+    """
+    Says if a pipeline step can be fused with its neighbours.
+    """
+    name = shlex.split(line)[0]
+    if name not in fusable_steps:
+        return False
+    _, when = fusable_steps[name]
+    return when is None or when(**parse_step(line, "-")[3])
+
+
+def run_fused(lines, arr, projection, output_path, last, block_cells=1 << 20):
+    """
+    Runs a series of fusable steps in a single pass. The steps' row and column
+    picks are composed into one set of indexes into the original array, and
+    the values they pick out are then read a block of rows at a time and run
+    through every step's kernel in turn, so there are no full-size
+    intermediate arrays. Gives exactly what running the steps one at a time
+    would, including the flip up/down between each.
+    """
+    rows = numpy.arange(arr.shape[0])
+    cols = numpy.arange(arr.shape[1])
+    kernels = []
+
+    def blocks():
+        # The current input, a block of rows at a time
+        step = max(1, block_cells // max(1, len(cols)))
+        for start in range(0, len(rows), step):
+            values = arr[numpy.ix_(rows[start : start + step], cols)]
+            for kernel in kernels:
+                values = kernel(values)
+            yield start, values
+
+    def scan(function):
+        return [function(values) for _, values in blocks()]
+
+    for i, line in enumerate(lines):
+        click.echo(click.style("Running: %s" % line, fg="green", bold=True))
+        name, _, _, params = parse_step(line, output_path)
+        if i:
+            # Each step's output is read by the next flipped up/down
+            rows = rows[::-1]
+        step_rows, step_cols, kernel = fusable_steps[name][0](
+            (len(rows), len(cols)), scan, **params
+        )
+        if step_rows is not None:
+            rows = rows[step_rows]
+        if step_cols is not None:
+            cols = cols[step_cols]
+        if kernel is not None:
+            kernels.append(kernel)
+    # Do the pass
+    output = numpy.empty(
+        (len(rows), len(cols)), dtype=numpy.float32 if kernels else arr.dtype
+    )
+    for start, values in blocks():
+        output[start : start + len(values)] = values
+    if last:
+        array_to_raster(output, output_path, projection=projection)
+        return output
+    return numpy.flipud(output)
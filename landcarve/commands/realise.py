@@ -1,15 +1,18 @@
-from asyncio import base_events
-import collections
+import concurrent.futures
+import sys
+import time
 
 import click
 import numpy
-import struct
-import trimesh.base
-import trimesh.creation
+import scipy.ndimage
 
 from landcarve.cli import main
 from landcarve.constants import NODATA
-from landcarve.utils.io import raster_to_array
+from landcarve.utils.io import raster_row_bands, raster_shape, raster_to_array
+from landcarve.utils.mesh import Mesh
+from landcarve.utils.steps import array_step
+from landcarve.utils.stl import StlWriter
+from landcarve.utils.terraces import terrace_triangles
 
 
 @main.command()
@@ -36,6 +39,31 @@ from landcarve.utils.io import raster_to_array
 )
 @click.option("--solid/--not-solid", default=False, help="Force a solid, square base")
 @click.option("--flipy/--no-flipy", default=False, help="Flip model Y axis")
+@click.option(
+    "--engine",
+    type=click.Choice(["grid", "reference", "terraces"]),
+    default="grid",
+    help="Meshing engine; reference is the slow per-cell original, terraces "
+    "meshes stepped DEMs as flat terraces and risers",
+)
+@click.option(
+    "--max-error",
+    default=0.0,
+    type=float,
+    help="Use an adaptive mesh within this vertical error (in mm) of the DEM",
+)
+@click.option(
+    "--target-faces",
+    default=0,
+    type=int,
+    help="Decimate the surface down to about this many faces",
+)
+@click.option(
+    "--max-deviation",
+    default=0.0,
+    type=float,
+    help="Decimate the surface as far as it can within this distance (in mm)",
+)
 @click.option(
     "--thin/--not-thin",
     default=False,
@@ -44,6 +72,12 @@ from landcarve.utils.io import raster_to_array
 @click.option(
     "--slices", default="", help="Slice points (in elevation units) for multiple STLs"
 )
+@click.option(
+    "--band-rows",
+    default=0,
+    type=int,
+    help="Mesh and write the model this many rows at a time, to save memory",
+)
 @click.pass_context
 def realise(
     ctx,
@@ -59,40 +93,353 @@ def realise(
     solid,
     thin,
     flipy,
+    engine,
+    max_error,
+    target_faces,
+    max_deviation,
     slices,
+    band_rows,
 ):
     """
     Turns a DEM array into a 3D model.
     """
+    # Big inputs can be meshed and written out a band of rows at a time
+    if band_rows:
+        if engine != "grid" or slices or max_error or target_faces or input_path == "-":
+            raise click.UsageError(
+                "--band-rows needs an input file, the grid engine, "
+                "and no --slices, --max-error or --target-faces"
+            )
+        realise_bands(
+            input_path,
+            output_path,
+            band_rows,
+            Mesh(scale=(xy_scale, xy_scale, z_scale), z_reduction=z_scale_reduction),
+            minimum=minimum,
+            maximum=maximum,
+            bottom=base / z_scale if thin else 0 - (base / z_scale),
+            simplify=simplify,
+            solid=solid,
+            thin=thin,
+            flipy=flipy,
+            max_deviation=max_deviation,
+        )
+        return
     # Load the file using GDAL
     arr = raster_to_array(input_path)
+    realise_array(
+        arr,
+        output_path,
+        xy_scale=xy_scale,
+        z_scale=z_scale,
+        z_scale_reduction=z_scale_reduction,
+        minimum=minimum,
+        maximum=maximum,
+        base=base,
+        simplify=simplify,
+        solid=solid,
+        thin=thin,
+        flipy=flipy,
+        engine=engine,
+        max_error=max_error,
+        target_faces=target_faces,
+        max_deviation=max_deviation,
+        slices=slices,
+    )
+
+
+@array_step("realise", sink=True)
+def realise_array(
+    arr,
+    output_path,
+    xy_scale,
+    z_scale,
+    z_scale_reduction,
+    minimum,
+    maximum,
+    base,
+    simplify,
+    solid,
+    thin,
+    flipy,
+    engine,
+    max_error,
+    target_faces,
+    max_deviation,
+    slices,
+    band_rows=0,
+):
+    """
+    Turns a DEM array into a 3D model, written to output_path.
+    """
+    if band_rows:
+        raise click.UsageError("--band-rows needs an input file")
+    bottom = 0 - (base / z_scale)
+    if thin:
+        bottom = base / z_scale
+    if max_error and engine != "grid":
+        raise click.UsageError("--max-error only works with the grid engine")
+    if thin and engine == "terraces":
+        raise click.UsageError("--thin does not work with the terraces engine")
     if flipy:
         arr = numpy.flipud(arr)
     # Open the target STL file
     mesh = Mesh(scale=(xy_scale, xy_scale, z_scale), z_reduction=z_scale_reduction)
+    heights = prepare_heights(arr, minimum, maximum, solid)
+    # Work out bounds and print them
+    max_value = heights[~numpy.isnan(heights)].max(initial=0)
+    click.echo(
+        f"X size: {(arr.shape[1]-1)*xy_scale:.2f}  Y size: {(arr.shape[0]-1)*xy_scale:.2f}  Z size: {max_value*z_scale:.2f}",
+        err=True,
+    )
+    # For each value in the array, output appropriate polygons
+    if engine == "reference":
+        reference_mesh(mesh, heights, bottom, thin)
+    elif engine == "terraces":
+        click.echo("Calculating terrace mesh...", err=True)
+        mesh.add_triangles(*terrace_triangles(heights, bottom))
+    elif max_error:
+        click.echo("Calculating adaptive mesh...", err=True)
+        mesh.add_grid(heights, bottom, thin=thin, max_error=max_error / z_scale)
+    else:
+        click.echo("Calculating mesh...", err=True)
+        mesh.add_grid(heights, bottom, thin=thin)
+    # Simplify
+    if simplify:
+        click.echo("Simplifying mesh...", err=True)
+        start = time.time()
+        removed = mesh.simplify()
+        click.echo(
+            "%i vertices removed in %.2fs" % (removed, time.time() - start), err=True
+        )
+    # Decimate
+    if target_faces or max_deviation:
+        click.echo("Decimating mesh...", err=True)
+        start = time.time()
+        removed = mesh.decimate(
+            target_faces=target_faces or None, max_deviation=max_deviation or None
+        )
+        click.echo(
+            "%i vertices removed in %.2fs, %i faces left"
+            % (removed, time.time() - start, mesh.num_faces),
+            err=True,
+        )
+        if target_faces and mesh.num_faces > target_faces:
+            click.echo(
+                "Warning: could not get down to %i faces without moving the "
+                "base or outline" % target_faces,
+                err=True,
+            )
+    # Slice
+    if slices:
+        levels = [float(val.strip()) for val in slices.strip().split(",")] + [9999]
+        click.echo("Slicing mesh  [", err=True, nl=False)
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            futures = []
+            for level, (slice_heights, slice_bottom) in zip(
+                levels,
+                slice_layers(
+                    heights,
+                    [level - minimum for level in levels],
+                    bottom,
+                    thin=thin,
+                    terraces=engine == "terraces",
+                    # A micron, in output units
+                    lift=0.001 / z_scale,
+                ),
+            ):
+                futures.append(
+                    executor.submit(
+                        realise_slice,
+                        slice_heights,
+                        output_path.replace(".stl", f".{level}.stl"),
+                        mesh.scale,
+                        mesh.z_reduction,
+                        bottom=slice_bottom,
+                        thin=thin,
+                        simplify=simplify,
+                        max_error=max_error / z_scale if max_error else None,
+                        terraces=engine == "terraces",
+                        target_faces=target_faces,
+                        max_deviation=max_deviation,
+                    )
+                )
+            over_target = []
+            for level, future in zip(levels, futures):
+                if target_faces and future.result() > target_faces:
+                    over_target.append(level)
+                click.echo(f"{level} ", err=True, nl=False)
+        click.echo("]", err=True)
+        if over_target:
+            click.echo(
+                "Warning: could not get slices %s down to %i faces without "
+                "moving the base or outline"
+                % (", ".join(str(level) for level in over_target), target_faces),
+                err=True,
+            )
+    # All done!
+    click.echo("Writing STL...", err=True)
+    mesh.save(output_path)
+
+
+def slice_layers(heights, uppers, bottom, thin=False, terraces=False, lift=0):
+    """
+    Yields the heights and bottom to mesh each layer of a model with, for
+    layers up to each of the given heights in turn.
+
+    Layers above the first sit on the one below (thin models keep their
+    thickness instead), so solid ones stack back into the whole model: the
+    grid points around any above the layer's bottom are kept, just `lift`
+    above it, so the surface between them is the same as in the whole model
+    bar that sliver. Exactly on the bottom, the layer would pinch to nothing
+    wherever a valley crosses it, which can't be written out as a closed
+    mesh.
+    """
+    lower = None
+    for upper in uppers:
+        layer_heights = numpy.minimum(heights, upper)
+        layer_bottom = bottom
+        if lower is not None:
+            above = heights > lower
+            if thin or terraces:
+                # Terrace columns stand on their own and thin layers are
+                # just a skin, so leave out anything that doesn't reach
+                # above the last layer
+                layer_heights[~above] = numpy.nan
+            else:
+                # Every triangle with a corner above the last layer keeps
+                # its other corners, lying on top of it
+                around = scipy.ndimage.binary_dilation(
+                    above, structure=numpy.ones((3, 3), dtype=bool)
+                )
+                layer_heights = numpy.maximum(layer_heights, lower + lift)
+                layer_heights[~around] = numpy.nan
+            if not thin:
+                layer_bottom = lower
+        yield layer_heights, layer_bottom
+        lower = upper
+
+
+def realise_slice(
+    heights,
+    output_path,
+    scale,
+    z_reduction,
+    bottom,
+    thin,
+    simplify,
+    max_error,
+    terraces=False,
+    target_faces=0,
+    max_deviation=0,
+):
+    """
+    Meshes and writes out one slice of a model, from heights already clamped
+    to the slice, and returns how many faces it has. Runs in a worker process.
+    """
+    mesh = Mesh(scale=scale, z_reduction=z_reduction)
+    if terraces:
+        mesh.add_triangles(*terrace_triangles(heights, bottom))
+    else:
+        mesh.add_grid(heights, bottom, thin=thin, max_error=max_error)
+    if simplify:
+        mesh.simplify()
+    if target_faces or max_deviation:
+        mesh.decimate(
+            target_faces=target_faces or None, max_deviation=max_deviation or None
+        )
+    mesh.save(output_path)
+    return mesh.num_faces
+
+
+def realise_bands(
+    input_path,
+    output_path,
+    band_rows,
+    mesh,
+    minimum,
+    maximum,
+    bottom,
+    simplify,
+    solid,
+    thin,
+    flipy,
+    max_deviation=0,
+):
+    """
+    Meshes a DEM one band of rows at a time, streaming each band's facets out
+    to the STL file so only one band is ever held in memory.
+
+    Bands are read with two rows of overlap either side so the edges see the
+    same neighbours as a whole-grid mesh would. Vertices on the rows shared
+    with neighbouring bands are kept out of simplification so the bands still
+    join up.
+    """
+    rows, cols = raster_shape(input_path)
+    max_value = 0
+    removed = 0
+    with StlWriter(output_path) as writer:
+        with click.progressbar(
+            length=rows, label="Meshing bands", file=sys.stderr
+        ) as bar:
+            for start, first_row, arr in raster_row_bands(
+                input_path, band_rows, overlap=2, flip=flipy
+            ):
+                end = min(start + band_rows, rows)
+                heights = prepare_heights(arr, minimum, maximum, solid)
+                max_value = max(
+                    max_value, heights[~numpy.isnan(heights)].max(initial=0)
+                )
+                band_mesh = Mesh(scale=mesh.scale, z_reduction=mesh.z_reduction)
+                band_mesh.add_grid(
+                    heights, bottom, thin=thin, first_row=first_row, rows=(start, end)
+                )
+                if simplify:
+                    vertex_rows = band_mesh.vertices[:, 0]
+                    removed += band_mesh.simplify(
+                        locked=(vertex_rows <= start) | (vertex_rows >= end)
+                    )
+                if max_deviation:
+                    vertex_rows = band_mesh.vertices[:, 0]
+                    removed += band_mesh.decimate(
+                        max_deviation=max_deviation,
+                        locked=(vertex_rows <= start) | (vertex_rows >= end),
+                    )
+                writer.write(band_mesh.scaled_vertices(), band_mesh.faces)
+                bar.update(end - start)
+    if simplify or max_deviation:
+        click.echo("%i vertices removed" % removed, err=True)
+    click.echo(
+        f"X size: {(cols-1)*mesh.scale[0]:.2f}  Y size: {(rows-1)*mesh.scale[1]:.2f}  Z size: {max_value*mesh.scale[2]:.2f}",
+        err=True,
+    )
+
+
+def prepare_heights(arr, minimum, maximum, solid):
+    """
+    Applies the maximum and minimum constraints to a DEM array, returning
+    float heights above the minimum with NaN where there is no model.
+    """
+    heights = numpy.array(arr, dtype=numpy.float64)
     # Apply the maximum constraint if there is one
     if maximum < 9999:
-        arr = numpy.vectorize(lambda x: min(maximum, x), otypes=[object])(arr)
+        heights = numpy.minimum(heights, maximum)
     # Apply the minimum constraint
     if solid:
-        arr = numpy.vectorize(
-            lambda x: max(0, x - minimum) if x > NODATA else 0, otypes=[object]
-        )(arr)
+        return numpy.where(heights > NODATA, numpy.maximum(heights - minimum, 0), 0)
     else:
-        arr = numpy.vectorize(
-            lambda x: max(0, x - minimum) if x > minimum else None, otypes=[object]
-        )(arr)
-    # Work out bounds and print them
-    max_value = 0
-    for index, value in numpy.ndenumerate(arr):
-        if value and value > max_value:
-            max_value = value
-    print(
-        f"X size: {(arr.shape[1]-1)*xy_scale:.2f}  Y size: {(arr.shape[0]-1)*xy_scale:.2f}  Z size: {max_value*z_scale:.2f}"
-    )
-    # For each value in the array, output appropriate polygons
-    bottom = 0 - (base / z_scale)
-    with click.progressbar(length=arr.shape[0], label="Calculating mesh") as bar:
+        return numpy.where(heights > minimum, heights - minimum, numpy.nan)
+
+
+def reference_mesh(mesh, heights, bottom, thin):
+    """
+    Builds the mesh one cell at a time. This is slow, but is kept as the
+    reference for the vectorised engine's output.
+    """
+    arr = numpy.where(numpy.isnan(heights), None, heights).astype(object)
+    with click.progressbar(
+        length=arr.shape[0], label="Calculating mesh", file=sys.stderr
+    ) as bar:
         for index, value in numpy.ndenumerate(arr):
             if index[1] == 0:
                 bar.update(1)
@@ -111,8 +458,6 @@ def realise(
                 bl = get_neighbour_value((index[0] - 1, index[1] + 1), arr)
                 b = get_neighbour_value((index[0], index[1] + 1), arr)
                 br = get_neighbour_value((index[0] + 1, index[1] + 1), arr)
-                if thin:
-                    bottom = base / z_scale
                 # Centre-Right-Bottom triangle
                 if r[2] is not None and b[2] is not None:
                     mesh.add_surface(c, r, b, bottom, thin=thin)
@@ -159,38 +504,6 @@ def realise(
                     # And a top edge
                     if t[2] is None and tr[2] is None:
                         mesh.add_edge(c, l, bottom, thin=thin)
-    # Simplify
-    if simplify:
-        click.echo("Simplifying mesh  [", err=True, nl=False)
-        total_removed = 0
-        while True:
-            removed = mesh.simplify()
-            click.echo(".", nl=False)
-            if not removed:
-                break
-            total_removed += removed
-        click.echo("] %i vertices removed" % total_removed)
-    tmesh = mesh.to_trimesh()
-    # Slice
-    if slices:
-        click.echo("Slicing mesh  [", err=True, nl=False)
-        bounds = [
-            [tmesh.bounds[0][0] - 1, tmesh.bounds[0][2] - 1, -1],
-            [tmesh.bounds[1][0] + 1, tmesh.bounds[1][1] + 1, -1],
-        ]
-        slices = [float(val.strip()) for val in slices.strip().split(",")] + [9999]
-        for slice in slices:
-            click.echo(f"{slice} ", nl=False)
-            # Create a box to slice by
-            bounds[0][2] = bounds[1][2]
-            bounds[1][2] = (slice - minimum) * z_scale
-            box = trimesh.creation.box(bounds=bounds)
-            slice_mesh = trimesh.boolean.intersection([tmesh, box])
-            slice_mesh.export(output_path.replace(".stl", f".{slice}.stl"))
-        click.echo("]")
-    # All done!
-    click.echo("Writing STL...", err=True)
-    tmesh.export(output_path)
 
 
 def get_neighbour_value(index, arr):
@@ -207,239 +520,3 @@ def get_neighbour_value(index, arr):
     else:
         value = arr[index]
         return (index[0], index[1], value)
-
-
-class Mesh:
-    """
-    Represents a mesh of the geography.
-    """
-
-    def __init__(self, scale, z_reduction=1):
-        self.scale = scale or (1, 1, 1)
-        self.z_reduction = z_reduction
-        # Dict of (x, y, z): index
-        self.vertices = collections.OrderedDict()
-        # List of (v1, v2, v3, normal)
-        self.faces: list[tuple[tuple[float, float, float], float, float, float]] = []
-
-    def vertex_index(self, vertex):
-        """
-        Returns the vertex's index, adding it if needed
-        """
-        assert len(vertex) == 3
-        z_units = vertex[2] / 100.0
-        z_scale = self.scale[2] * (self.z_reduction**z_units)
-        vertex = (
-            vertex[0] * self.scale[0],
-            vertex[1] * self.scale[1],
-            vertex[2] * z_scale,
-        )
-        if vertex not in self.vertices:
-            self.vertices[vertex] = len(self.vertices)
-        return self.vertices[vertex]
-
-    def add_triangle(self, point1, point2, point3):
-        """
-        Adds a single triangle
-        """
-        # Get vertex indices
-        i1 = self.vertex_index(point1)
-        i2 = self.vertex_index(point2)
-        i3 = self.vertex_index(point3)
-        # Calculate normal (clockwise)
-        u = (point2[0] - point1[0], point2[1] - point1[1], point2[2] - point1[2])
-        v = (point3[0] - point1[0], point3[1] - point1[1], point3[2] - point1[2])
-        normal = (
-            (u[1] * v[2]) - (u[2] * v[1]),
-            (u[2] * v[0]) - (u[0] * v[2]),
-            (u[0] * v[1]) - (u[1] * v[0]),
-        )
-        normal_magnitude = (
-            (normal[0] ** 2) + (normal[1] ** 2) + (normal[2] ** 2)
-        ) ** 0.5
-        normal = (
-            normal[0] / normal_magnitude,
-            normal[1] / normal_magnitude,
-            normal[2] / normal_magnitude,
-        )
-        # Add face
-        self.faces.append((normal, i1, i2, i3))
-
-    def add_quad(self, point1, point2, point3, point4):
-        """
-        Adds a quad to the file, made out of two facets. Pass vertices in
-        clockwise order.
-        """
-        self.add_triangle(point1, point2, point4)
-        self.add_triangle(point2, point3, point4)
-
-    def add_surface(self, point1, point2, point3, bottom, thin=False):
-        """
-        Adds a facet with a matching flat bottom polygon.
-        Points should be clockwise looking from the top.
-        """
-        self.add_triangle(
-            (point1[0], point1[1], point1[2]),
-            (point2[0], point2[1], point2[2]),
-            (point3[0], point3[1], point3[2]),
-        )
-        if thin:
-            self.add_triangle(
-                (point1[0], point1[1], point1[2] - bottom),
-                (point3[0], point3[1], point3[2] - bottom),
-                (point2[0], point2[1], point2[2] - bottom),
-            )
-        else:
-            self.add_triangle(
-                (point1[0], point1[1], bottom),
-                (point2[0], point2[1], bottom),
-                (point3[0], point3[1], bottom),
-            )
-
-    def add_edge(self, point1, point2, bottom, thin=False):
-        """
-        Adds a quad to form an edge between the two vertices.
-        Vertices should be left, right looking from the outside of the model.
-        """
-        if thin:
-            self.add_quad(
-                (point1[0], point1[1], point1[2]),
-                (point2[0], point2[1], point2[2]),
-                (point2[0], point2[1], point2[2] - bottom),
-                (point1[0], point1[1], point1[2] - bottom),
-            )
-        else:
-            self.add_quad(
-                (point1[0], point1[1], point1[2]),
-                (point2[0], point2[1], point2[2]),
-                (point2[0], point2[1], bottom),
-                (point1[0], point1[1], bottom),
-            )
-
-    def to_trimesh(self):
-        """
-        Returns a PyMesh representation of us
-        """
-        # Sort vertices by their index
-        vertices_by_index = [(i, v) for v, i in self.vertices.items()]
-        vertices_by_index.sort()
-        vertices = numpy.array([v for i, v in vertices_by_index])
-        # Extract faces into triples
-        faces = numpy.array([[v1, v2, v3] for n, v1, v2, v3 in self.faces])
-
-        return trimesh.base.Trimesh(vertices, faces)
-
-    def simplify(self):
-        """
-        Simplifies the mesh via edge-merging. Goes through all edges, and sees
-        if all faces attached to that edge have the same normal. If so, collapses
-        it.
-        """
-        # Create a map of vertex indexes to the normals of the faces attached to them,
-        # and vertices to their neighbours
-        non_flat_vertices = set()
-        vertex_face_normals = {}
-        vertex_neighbours = {v: [] for v in self.vertices.values()}
-        for normal, v1, v2, v3 in self.faces:
-            # Work out if it has flat normals
-            for v in (v1, v2, v3):
-                if v not in non_flat_vertices:
-                    if v in vertex_face_normals:
-                        if vertex_face_normals[v] != normal:
-                            non_flat_vertices.add(v)
-                            del vertex_face_normals[v]
-                    else:
-                        vertex_face_normals[v] = normal
-            # Add it to the neighbour graph
-            vertex_neighbours[v1].extend([v2, v3])
-            vertex_neighbours[v2].extend([v1, v3])
-            vertex_neighbours[v3].extend([v1, v2])
-        # Go through edges, and remove those whose normals match.
-        # Keep track of tainted vertices that we can't touch this iteration.
-        tainted_vertices = set()
-        merged_vertices = {}
-        for index, vertex in enumerate(self.vertices):
-            # Skip non-flat vertices
-            if index not in vertex_face_normals:
-                continue
-            # Skip vertices whose neighbours were already touched
-            if index in tainted_vertices:
-                continue
-            # Skip vertices which have non-flat neighbours
-            if not all(
-                neighbour in vertex_face_normals
-                for neighbour in vertex_neighbours[index]
-            ):
-                continue
-            # See if there's a neighbour we can merge with
-            for neighbour in vertex_neighbours[index]:
-                if (
-                    neighbour in vertex_face_normals
-                    and vertex_face_normals[neighbour] == vertex_face_normals[index]
-                ):
-                    # Mark them for merge
-                    merged_vertices[index] = neighbour
-                    # Mark them as tainted so we don't revisit them
-                    tainted_vertices.add(index)
-                    tainted_vertices.add(neighbour)
-                    break
-        # Rewrite mesh with the new vertices and faces
-        new_vertices = collections.OrderedDict()
-        new_faces = []
-        vertex_map = {}  # Maps old index to new one
-        # First, write all unmerged vertices out
-        for index, vertex in enumerate(self.vertices):
-            if index not in merged_vertices:
-                vertex_map[index] = len(new_vertices)
-                new_vertices[vertex] = len(new_vertices)
-        # Then, add mappings for the merged vertices
-        for vertex, merged_to in merged_vertices.items():
-            vertex_map[vertex] = vertex_map[merged_to]
-        # Finally, rewrite all the faces, removing those that are now zero sized
-        for normal, v1, v2, v3 in self.faces:
-            new1 = vertex_map[v1]
-            new2 = vertex_map[v2]
-            new3 = vertex_map[v3]
-            # Skip face if it's now zero size
-            if new1 == new2 or new2 == new3 or new3 == new1:
-                continue
-            new_faces.append((normal, new1, new2, new3))
-        self.vertices = new_vertices
-        self.faces = new_faces
-        return len(merged_vertices)
-
-    def save(self, path):
-        """
-        Saves the mesh as an STL file
-        """
-        # Invert vertices to be mapped by index (well, a list)
-        vertex_list = list(self.vertices.keys())
-        # Write STL file
-        with open(path, "wb") as fh:
-            # Write STL header
-            fh.write(b" " * 80)  # Textual header
-            fh.write(struct.pack(b"<L", len(self.faces)))  # The number of facets
-            # Write facets
-            for normal, i1, i2, i3 in self.faces:
-                vertex1 = vertex_list[i1]
-                vertex2 = vertex_list[i2]
-                vertex3 = vertex_list[i3]
-                # Write out entry
-                fh.write(
-                    struct.pack(
-                        b"<ffffffffffffH",
-                        normal[0],
-                        normal[1],
-                        normal[2],
-                        vertex1[0],
-                        vertex1[1],
-                        vertex1[2],
-                        vertex2[0],
-                        vertex2[1],
-                        vertex2[2],
-                        vertex3[0],
-                        vertex3[1],
-                        vertex3[2],
-                        0,
-                    )
-                )
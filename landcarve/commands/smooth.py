@@ -4,6 +4,7 @@ from skimage.morphology import area_closing, area_opening
 
 from landcarve.cli import main
 from landcarve.utils.io import array_to_raster, raster_to_array
+from landcarve.utils.steps import array_step
 
 
 @main.command()
@@ -19,9 +20,18 @@ def smooth(input_path, output_path, factor):
     # Load the file using GDAL
     arr = raster_to_array(input_path)
 
-    arr = area_closing(arr, area_threshold=32)
-    arr = area_opening(arr, area_threshold=32)
+    arr = smooth_array(arr, factor)
 
     # Write out the array
-    click.echo("Smooth2ed with factor %s" % factor, err=True)
     array_to_raster(arr, output_path)
+
+
+@array_step("smooth")
+def smooth_array(arr, factor):
+    """
+    Runs smooth on an array.
+    """
+    arr = area_closing(arr, area_threshold=32)
+    arr = area_opening(arr, area_threshold=32)
+    click.echo("Smooth2ed with factor %s" % factor, err=True)
+    return arr
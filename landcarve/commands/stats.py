@@ -1,9 +1,8 @@
 import click
-import numpy
 
 from landcarve.cli import main
 from landcarve.constants import NODATA
-from landcarve.utils.io import array_to_raster, raster_to_array
+from landcarve.utils.io import Raster
 
 
 @main.command()
@@ -14,10 +13,18 @@ def stats(input_paths):
     """
     for input_path in input_paths:
         click.echo(click.style(f"{input_path}", fg="blue", bold=True))
-        # Load the file using GDAL
-        arr = raster_to_array(input_path)
-        # Work out what the range of Z values is, ignoring NODATA
-        min_value, max_value = value_range(arr, NODATA)
+        raster = Raster(input_path)
+        rows, cols = raster.shape
+        click.echo(f"Size: {rows} x {cols} ({raster.dtype}, NODATA {raster.nodata})")
+        # Work out what the range of Z values is, ignoring NODATA, a block at
+        # a time
+        ranges = [value_range(arr, NODATA) for _, _, _, _, arr in raster.blocks()]
+        ranges = [(low, high) for low, high in ranges if low is not None]
+        if not ranges:
+            click.echo("Z Value range: no data")
+            continue
+        min_value = min(low for low, high in ranges)
+        max_value = max(high for low, high in ranges)
         value_delta = max_value - min_value
         click.echo(
             f"Z Value range: {min_value:.2f} to {max_value:.2f} ({value_delta:.2f})"
@@ -28,12 +35,7 @@ def value_range(arr, NODATA=NODATA):
     """
     Given an array and a NODATA limit, returns the range of values in the array.
     """
-    min_value = max_value = None
-    for value in numpy.nditer(arr):
-        value = value.item()
-        if value > NODATA:
-            if min_value is None or value < min_value:
-                min_value = value
-            if max_value is None or value > max_value:
-                max_value = value
-    return min_value, max_value
+    values = arr[arr > NODATA]
+    if not values.size:
+        return None, None
+    return values.min().item(), values.max().item()
@@ -2,16 +2,22 @@ import click
 import numpy
 
 from landcarve.cli import main
-from landcarve.constants import NODATA
-from landcarve.utils.io import array_to_raster, raster_to_array
+from landcarve.utils.io import map_raster
+from landcarve.utils.steps import array_step, fusable_step
 
 
 @main.command()
 @click.option(
-    "--interval", default=10, type=float, help="Stepping interval",
+    "--interval",
+    default=10,
+    type=float,
+    help="Stepping interval",
 )
 @click.option(
-    "--base", default=0, type=float, help="Offset for start of step",
+    "--base",
+    default=0,
+    type=float,
+    help="Offset for start of step",
 )
 @click.argument("input_path")
 @click.argument("output_path")
@@ -19,13 +25,39 @@ def step(input_path, output_path, interval, base):
     """
     Snaps layer values to boundaries
     """
-    # Load the file using GDAL
-    arr = raster_to_array(input_path)
-    # Run stepper
-    scaler = lambda x: round(x / interval) * interval
-    arr = numpy.vectorize(scaler, otypes="f")(arr)
+    # Run stepper a block at a time
+    map_raster(input_path, output_path, lambda arr: step_values(arr, interval))
     click.echo(
         "Array stepped with interval {}, base {}".format(interval, base), err=True
     )
-    # Write out the array
-    array_to_raster(arr, output_path)
+
+
+@array_step("step")
+def step_array(arr, interval, base):
+    """
+    Runs step on an array.
+    """
+    arr = step_values(arr, interval)
+    click.echo(
+        "Array stepped with interval {}, base {}".format(interval, base), err=True
+    )
+    return arr
+
+
+@fusable_step("step")
+def step_fused(shape, scan, interval, base):
+    """
+    Describes step for pipeline fusion.
+    """
+    click.echo(
+        "Array stepped with interval {}, base {}".format(interval, base), err=True
+    )
+    return None, None, lambda values: step_values(values, interval)
+
+
+def step_values(arr, interval):
+    """
+    Rounds values to the nearest multiple of interval (halves go to even).
+    """
+    arr = numpy.asarray(arr, dtype=numpy.float64)
+    return (numpy.rint(arr / interval) * interval).astype(numpy.float32)
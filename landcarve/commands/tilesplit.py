@@ -3,7 +3,7 @@ import numpy
 
 from landcarve.cli import main
 from landcarve.constants import NODATA
-from landcarve.utils.io import array_to_raster, raster_to_array_and_projection
+from landcarve.utils.io import Raster, array_to_raster
 
 
 @main.command()
@@ -42,27 +42,29 @@ def tilesplit(
     """
     Splits a single big DEM into smaller ones
     """
-    # Load the file using GDAL
-    arr, proj = raster_to_array_and_projection(input_path)
+    # Open the file using GDAL; tiles are read from it one at a time
+    raster = Raster(input_path)
+    height, width = raster.shape
+    proj = raster.projection
     # Prep output path
     if output_path.endswith(".tif"):
         output_path = output_path[:-4]
     # Work out Y slice sizes
     y_slices = [0]
-    while y_slices[-1] + y_size < arr.shape[0]:
+    while y_slices[-1] + y_size < height:
         y_slices.append(y_slices[-1] + y_size)
-    if y_slices[-1] < arr.shape[0]:
-        y_slices.append(arr.shape[0])
+    if y_slices[-1] < height:
+        y_slices.append(height)
     # Work out X slice sizes
     x_slices = [0]
-    while x_slices[-1] + x_size < arr.shape[1]:
+    while x_slices[-1] + x_size < width:
         x_slices.append(x_slices[-1] + x_size)
-    if x_slices[-1] < arr.shape[1]:
-        x_slices.append(arr.shape[1])
+    if x_slices[-1] < width:
+        x_slices.append(width)
     # Slice and dice
     for j, (y, y_next) in enumerate(zip(y_slices, y_slices[1:])):
         for i, (x, x_next) in enumerate(zip(x_slices, x_slices[1:])):
-            tile = arr[y:y_next, x:x_next]
+            tile = raster.read(y, x, y_next - y, x_next - x)
             # Write out the tile
             if naming_scheme == "letter":
                 letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
@@ -4,6 +4,7 @@ import numpy
 from landcarve.cli import main
 from landcarve.constants import NODATA
 from landcarve.utils.io import array_to_raster, raster_to_array
+from landcarve.utils.steps import array_step, fusable_step
 
 
 @main.command()
@@ -22,28 +23,63 @@ def zfit(input_path, output_path, fit):
     """
     # Load the file using GDAL
     arr = raster_to_array(input_path)
+    # Scale it
+    arr = zfit_array(arr, fit)
+    # Write out the array
+    array_to_raster(arr, output_path)
+
+
+@array_step("zfit")
+def zfit_array(arr, fit):
+    """
+    Runs zfit on an array.
+    """
     # Work out what the range of Z values is, ignoring NODATA
     min_value, max_value = value_range(arr, NODATA)
     value_delta = max_value - min_value
     click.echo("Value range: {} to {} ({})".format(min_value, max_value, value_delta))
     # Scale the array to be more normalised
-    scaler = lambda x: (((x - min_value) / value_delta) * fit) if x > NODATA else NODATA
-    arr = numpy.vectorize(scaler, otypes="f")(arr)
+    arr = zfit_values(arr, min_value, value_delta, fit)
     click.echo("Array scaled to range {} to {}".format(0, fit), err=True)
-    # Write out the array
-    array_to_raster(arr, output_path)
+    return arr
+
+
+@fusable_step("zfit")
+def zfit_fused(shape, scan, fit):
+    """
+    Describes zfit for pipeline fusion.
+    """
+    # Work out what the range of Z values is, ignoring NODATA
+    ranges = [
+        value_range for value_range in scan(value_range) if value_range[0] is not None
+    ]
+    min_value = min((low for low, high in ranges), default=None)
+    max_value = max((high for low, high in ranges), default=None)
+    value_delta = max_value - min_value
+    click.echo("Value range: {} to {} ({})".format(min_value, max_value, value_delta))
+    click.echo("Array scaled to range {} to {}".format(0, fit), err=True)
+    return (
+        None,
+        None,
+        lambda values: zfit_values(values, min_value, value_delta, fit),
+    )
+
+
+def zfit_values(arr, min_value, value_delta, fit):
+    """
+    Scales values linearly so min_value goes to 0 and min_value + value_delta
+    goes to fit, leaving NODATA alone.
+    """
+    arr = numpy.asarray(arr, dtype=numpy.float64)
+    scaled = ((arr - min_value) / value_delta) * fit
+    return numpy.where(arr > NODATA, scaled, NODATA).astype(numpy.float32)
 
 
 def value_range(arr, NODATA=NODATA):
     """
     Given an array and a NODATA limit, returns the range of values in the array.
     """
-    min_value = max_value = None
-    for value in numpy.nditer(arr):
-        value = value.item()
-        if value > NODATA:
-            if min_value is None or value < min_value:
-                min_value = value
-            if max_value is None or value > max_value:
-                max_value = value
-    return min_value, max_value
+    values = arr[arr > NODATA]
+    if not values.size:
+        return None, None
+    return values.min().item(), values.max().item()
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import tempfile
+
+import landcarve
+from landcarve.utils.io import GEOTIFF_OPTIONS
+
+
+class StepCache:
+    """
+    An on-disk cache of pipeline intermediates.
+
+    Entries are keyed by a hash of the input file's contents and every step's
+    command line up to that point, so changing a step only misses for it and
+    the steps after it. Once the cache is bigger than max_bytes, the least
+    recently used entries are removed; entries bigger than that on their own
+    aren't kept at all.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def file_hash(path):
+        """
+        Returns a hash of a file's contents
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(input_hash, steps):
+        """
+        Returns the key for the output of the last of steps, run on an input
+        with the given hash. Command lines are normalised first, so spacing
+        and quoting don't matter. How rasters are being written out is part
+        of the key too, as it changes what steps output.
+        """
+        digest = hashlib.sha256()
+        digest.update(landcarve.__version__.encode("utf8"))
+        digest.update(json.dumps(GEOTIFF_OPTIONS, sort_keys=True).encode("utf8"))
+        digest.update(input_hash.encode("utf8"))
+        for step in steps:
+            digest.update(b"\0" + shlex.join(shlex.split(step)).encode("utf8"))
+        return digest.hexdigest()
+
+    def get(self, key, suffix):
+        """
+        Returns the path of a cached entry, or None if there isn't one.
+        """
+        path = os.path.join(self.directory, key + suffix)
+        try:
+            # Mark it as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, suffix, write, size):
+        """
+        Adds an entry of about size bytes, calling write with a path to save
+        it to, then trims the cache back down to size. Any files written
+        alongside that path and named after it, like sidecars, are kept with
+        it.
+        """
+        if size > self.max_bytes:
+            return
+        temporary_directory = tempfile.mkdtemp(dir=self.directory, prefix=".")
+        name = key + suffix
+        try:
+            write(os.path.join(temporary_directory, name))
+            # The entry itself goes in last, so it's never there without its
+            # other files
+            for other in sorted(os.listdir(temporary_directory), key=name.__eq__):
+                os.replace(
+                    os.path.join(temporary_directory, other),
+                    os.path.join(self.directory, other),
+                )
+        finally:
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+        self.trim()
+
+    def trim(self):
+        """
+        Removes the least recently used entries until the cache fits.
+        """
+        # Files are grouped into entries by key, so sidecars go with them
+        entries = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                key = entry.name.split(".")[0]
+                mtime, size, paths = entries.get(key, (0, 0, []))
+                entries[key] = (
+                    max(mtime, stat.st_mtime),
+                    size + stat.st_size,
+                    paths + [entry.path],
+                )
+        total = sum(size for _, size, _ in entries.values())
+        for _, size, paths in sorted(entries.values()):
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
@@ -0,0 +1,195 @@
+import os
+import sqlite3
+
+from osgeo import osr
+
+from landcarve.constants import NODATA
+from landcarve.utils.io import Raster, is_native
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    srs TEXT NOT NULL,
+    projection TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    x_resolution REAL NOT NULL,
+    y_resolution REAL NOT NULL,
+    min_x REAL NOT NULL,
+    min_y REAL NOT NULL,
+    max_x REAL NOT NULL,
+    max_y REAL NOT NULL,
+    minimum REAL,
+    maximum REAL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS footprints USING rtree(
+    id, min_x, max_x, min_y, max_y
+);
+"""
+
+
+class Catalog:
+    """
+    An index of DEM files in a SQLite database: each file's bounds,
+    projection, resolution and range of values, with an R-tree on the bounds
+    so the files covering an area can be found without opening any of them.
+
+    Bounds are in each file's own projection, so a search only makes sense
+    among files with the same one; srs_key gives the name they're grouped
+    under.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def add(self, path):
+        """
+        Indexes a file, or re-indexes it if it's changed since it last was.
+        Returns "added", "updated" or "unchanged", or None if it isn't a
+        raster with a known position (or has gone).
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        existing = self.connection.execute(
+            "SELECT id, size, mtime_ns FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if existing and [existing["size"], existing["mtime_ns"]] == [
+            stat.st_size,
+            stat.st_mtime_ns,
+        ]:
+            return "unchanged"
+        try:
+            details = self.file_details(path)
+        except (ValueError, OSError):
+            return None
+        if details is None:
+            return None
+        with self.connection:
+            if existing:
+                self.remove(existing["id"])
+            cursor = self.connection.execute(
+                "INSERT INTO files (path, size, mtime_ns, %s) VALUES (?, ?, ?, %s)"
+                % (", ".join(details), ", ".join("?" * len(details))),
+                (path, stat.st_size, stat.st_mtime_ns, *details.values()),
+            )
+            self.connection.execute(
+                "INSERT INTO footprints VALUES (?, ?, ?, ?, ?)",
+                (
+                    cursor.lastrowid,
+                    details["min_x"],
+                    details["max_x"],
+                    details["min_y"],
+                    details["max_y"],
+                ),
+            )
+        return "updated" if existing else "added"
+
+    @staticmethod
+    def file_details(path):
+        """
+        Works out the details indexed for a file, reading through it a block
+        at a time for its range of values. Returns None if it has no
+        geotransform, or is a native raster (which can't be mosaicked).
+        """
+        if is_native(path):
+            return None
+        raster = Raster(path)
+        # GDAL makes up a geotransform for files without one unless asked not to
+        geotransform = raster.dataset.GetGeoTransform(can_return_null=True)
+        if not geotransform:
+            return None
+        height, width = raster.shape
+        xs = [geotransform[0], geotransform[0] + geotransform[1] * width]
+        ys = [geotransform[3], geotransform[3] + geotransform[5] * height]
+        # Work out the range of values, ignoring NODATA and the file's own
+        # NODATA value if it has one
+        minimum = maximum = None
+        for _, _, _, _, arr in raster.blocks():
+            values = arr[arr > NODATA]
+            if raster.nodata is not None:
+                values = values[values != raster.nodata]
+            if values.size:
+                low, high = values.min().item(), values.max().item()
+                minimum = low if minimum is None else min(minimum, low)
+                maximum = high if maximum is None else max(maximum, high)
+        return {
+            "srs": srs_key(raster.projection),
+            "projection": raster.projection or "",
+            "width": width,
+            "height": height,
+            "x_resolution": abs(geotransform[1]),
+            "y_resolution": abs(geotransform[5]),
+            "min_x": min(xs),
+            "min_y": min(ys),
+            "max_x": max(xs),
+            "max_y": max(ys),
+            "minimum": minimum,
+            "maximum": maximum,
+        }
+
+    def remove(self, file_id):
+        self.connection.execute("DELETE FROM files WHERE id = ?", (file_id,))
+        self.connection.execute("DELETE FROM footprints WHERE id = ?", (file_id,))
+
+    def prune(self):
+        """
+        Removes files that no longer exist from the index, returning how
+        many there were.
+        """
+        removed = 0
+        with self.connection:
+            for row in self.connection.execute("SELECT id, path FROM files").fetchall():
+                if not os.path.exists(row["path"]):
+                    self.remove(row["id"])
+                    removed += 1
+        return removed
+
+    def find(self, bounds, srs=None):
+        """
+        Returns the indexed files whose bounds overlap (min x, min y, max x,
+        max y) bounds, optionally only those in one projection, by path.
+        """
+        min_x, min_y, max_x, max_y = bounds
+        query = """
+            SELECT files.* FROM footprints JOIN files ON files.id = footprints.id
+            WHERE footprints.max_x >= ? AND footprints.min_x <= ?
+            AND footprints.max_y >= ? AND footprints.min_y <= ?
+            AND files.max_x > ? AND files.min_x < ?
+            AND files.max_y > ? AND files.min_y < ?
+        """
+        # The R-tree rounds outwards, so narrow it down with the exact bounds
+        args = [min_x, max_x, min_y, max_y] * 2
+        if srs is not None:
+            query += " AND files.srs = ?"
+            args.append(srs_key(srs))
+        return self.connection.execute(query + " ORDER BY path", args).fetchall()
+
+
+def srs_key(projection):
+    """
+    Returns a short name for a projection (WKT, or anything else GDAL
+    understands, like EPSG:27700): its EPSG code if it has one, otherwise
+    its PROJ string. Empty for no projection.
+    """
+    if not projection:
+        return ""
+    srs = osr.SpatialReference()
+    if srs.SetFromUserInput(projection) != 0:
+        raise ValueError("Unknown projection %s" % projection)
+    try:
+        srs.AutoIdentifyEPSG()
+    except RuntimeError:
+        pass
+    name = srs.GetAuthorityName(None)
+    code = srs.GetAuthorityCode(None)
+    if name and code:
+        return "%s:%s" % (name, code)
+    return srs.ExportToProj4()
@@ -0,0 +1,322 @@
+import heapq
+import operator
+
+import numpy
+import scipy.sparse
+
+
+def qem_collapses(points, faces, target_faces=None, max_deviation=None, locked=None):
+    """
+    Decimates a heightmap mesh with quadric error metrics, collapsing one
+    edge at a time (cheapest first, from a heap) until there are only
+    target_faces faces left or the next collapse would move the surface more
+    than max_deviation away from where it was.
+
+    Only vertices inside the top surface move; anything on the base, walls,
+    open or shared edges, or in locked stays put, so boundaries are kept
+    exactly. If that runs out before target_faces is reached, vertices along
+    the top of straight walls are then also slid along them, onto the next
+    one, so the outline keeps its shape. Vertices are always moved onto a
+    neighbour, never to a new position, and collapses that would fold the
+    surface over are skipped.
+
+    points should be scaled, so the deviation is in output units. Returns
+    arrays of the vertices to remove and the vertex each one is merged into,
+    ready for Mesh.collapse.
+    """
+    num_vertices = len(points)
+    faces = numpy.asarray(faces, dtype=numpy.int64)
+    num_faces = len(faces)
+    free = _free_vertices(points, faces, locked)
+    sliding = _sliding_vertices(points, faces, free, locked)
+    # Each vertex's quadric is the sum of its faces' plane quadrics, kept as
+    # the ten distinct coefficients, so a quadric's error at a point is its
+    # dot product with that point's monomials
+    corners = points[faces]
+    normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = numpy.linalg.norm(normals, axis=1)
+    lengths[lengths == 0] = 1
+    normals /= lengths[:, None]
+    a, b, c = normals.T
+    d = -numpy.einsum("ij,ij->i", normals, corners[:, 0])
+    face_quadrics = numpy.stack(
+        [a * a, a * b, a * c, a * d, b * b, b * c, b * d, c * c, c * d, d * d], axis=1
+    )
+    quadrics = numpy.zeros((num_vertices, 10))
+    for corner in range(3):
+        numpy.add.at(quadrics, faces[:, corner], face_quadrics)
+    x, y, z = points.T
+    monomials = numpy.stack(
+        [x * x, 2 * x * y, 2 * x * z, 2 * x, y * y, 2 * y * z, 2 * y, z * z, 2 * z]
+        + [numpy.ones(num_vertices)],
+        axis=1,
+    )
+    # The collapse loop works on plain lists, which are much quicker to poke
+    # at one item at a time than arrays
+    face_list = faces.tolist()
+    xs = x.tolist()
+    ys = y.tolist()
+    zs = z.tolist()
+    incidence = scipy.sparse.csr_matrix(
+        (
+            numpy.ones(num_faces * 3),
+            (faces.reshape(-1), numpy.repeat(numpy.arange(num_faces), 3)),
+        ),
+        shape=(num_vertices, num_faces),
+    )
+    vertex_faces = [
+        around.tolist()
+        for around in numpy.split(incidence.indices, incidence.indptr[1:-1])
+    ]
+    face_alive = [True] * num_faces
+    vertex_alive = [True] * num_vertices
+    # Bumped whenever a vertex's quadric changes, to spot stale heap entries
+    stamps = [0] * num_vertices
+
+    # Start with the cheaper allowed way of collapsing each edge
+    edges, _ = _edges(faces, num_vertices)
+    starts, ends = edges.T
+    sums = quadrics[starts] + quadrics[ends]
+    forward = numpy.where(free[starts], (sums * monomials[ends]).sum(axis=1), numpy.inf)
+    backward = numpy.where(
+        free[ends], (sums * monomials[starts]).sum(axis=1), numpy.inf
+    )
+    flip = backward < forward
+    costs = numpy.minimum(forward, backward)
+    usable = costs < numpy.inf
+    heap = [
+        (cost, mover, target, 0, 0)
+        for cost, mover, target in zip(
+            costs[usable].tolist(),
+            numpy.where(flip, ends, starts)[usable].tolist(),
+            numpy.where(flip, starts, ends)[usable].tolist(),
+        )
+    ]
+    heapq.heapify(heap)
+    quadrics = quadrics.tolist()
+    monomials = monomials.tolist()
+    free = free.tolist()
+    sliding = sliding.tolist()
+    movable = free
+    limit = numpy.inf if max_deviation is None else max_deviation**2
+    merge_from = []
+    merge_to = []
+    while True:
+        if target_faces is not None and num_faces <= target_faces:
+            break
+        if not heap:
+            if target_faces is None or movable is not free:
+                break
+            # Nothing inside the surface is left to collapse, so start sliding
+            # vertices along the tops of the walls too
+            movable = [
+                vertex_free or vertex_sliding
+                for vertex_free, vertex_sliding in zip(free, sliding)
+            ]
+            heap = _edge_costs(
+                face_list, face_alive, quadrics, monomials, movable, stamps
+            )
+            heapq.heapify(heap)
+            continue
+        cost, mover, target, mover_stamp, target_stamp = heapq.heappop(heap)
+        if cost > limit:
+            break
+        if (
+            not vertex_alive[mover]
+            or not vertex_alive[target]
+            or stamps[mover] != mover_stamp
+            or stamps[target] != target_stamp
+        ):
+            continue
+        around = [face for face in vertex_faces[mover] if face_alive[face]]
+        shared = [face for face in around if target in face_list[face]]
+        moved = [face for face in around if target not in face_list[face]]
+        # Only collapse edges with a face either side whose ends have no other
+        # neighbours in common, so the surface stays a simple sheet
+        if len(shared) != 2:
+            continue
+        target_around = [face for face in vertex_faces[target] if face_alive[face]]
+        mover_neighbours = {vertex for face in around for vertex in face_list[face]}
+        target_neighbours = {
+            vertex for face in target_around for vertex in face_list[face]
+        }
+        if len(mover_neighbours & target_neighbours) != 4:
+            continue
+        # Vertices on a wall can only slide along its top edge
+        if not free[mover] and all(
+            _upwards(xs, ys, *face_list[face]) for face in shared
+        ):
+            continue
+        # Every moved face must still face the same way, so nothing folds over
+        new_faces = [
+            [target if vertex == mover else vertex for vertex in face_list[face]]
+            for face in moved
+        ]
+        if not all(
+            _same_facing(xs, ys, zs, face_list[face], new_face)
+            for face, new_face in zip(moved, new_faces)
+        ):
+            continue
+        # Do the collapse
+        for face, new_face in zip(moved, new_faces):
+            face_list[face] = new_face
+        for face in shared:
+            face_alive[face] = False
+        num_faces -= 2
+        vertex_faces[target] = target_around + moved
+        vertex_alive[mover] = False
+        quadric = quadrics[target] = [
+            first + second for first, second in zip(quadrics[target], quadrics[mover])
+        ]
+        stamps[target] += 1
+        merge_from.append(mover)
+        merge_to.append(target)
+        # Re-cost the edges around the merged vertex
+        target_stamp = stamps[target]
+        target_free = movable[target]
+        target_monomials = monomials[target]
+        for neighbour in (mover_neighbours | target_neighbours) - {mover, target}:
+            sums = [
+                first + second for first, second in zip(quadric, quadrics[neighbour])
+            ]
+            entries = []
+            if movable[neighbour]:
+                cost = sum(map(operator.mul, sums, target_monomials))
+                entries.append(
+                    (cost, neighbour, target, stamps[neighbour], target_stamp)
+                )
+            if target_free:
+                cost = sum(map(operator.mul, sums, monomials[neighbour]))
+                entries.append(
+                    (cost, target, neighbour, target_stamp, stamps[neighbour])
+                )
+            # Wall vertices can't always go the cheaper way, so they keep both
+            if movable is not free:
+                for entry in entries:
+                    heapq.heappush(heap, entry)
+            elif entries:
+                heapq.heappush(heap, min(entries))
+    return (
+        numpy.array(merge_from, dtype=numpy.int64),
+        numpy.array(merge_to, dtype=numpy.int64),
+    )
+
+
+def _edge_costs(face_list, face_alive, quadrics, monomials, movable, stamps):
+    """
+    Returns heap entries for collapsing every live edge either way round,
+    wherever the vertex that would move is movable.
+    """
+    edges = {
+        (min(start, end), max(start, end))
+        for face, alive in zip(face_list, face_alive)
+        if alive
+        for start, end in zip(face, face[1:] + face[:1])
+    }
+    heap = []
+    for start, end in edges:
+        sums = [first + second for first, second in zip(quadrics[start], quadrics[end])]
+        for mover, target in ((start, end), (end, start)):
+            if movable[mover]:
+                cost = sum(map(operator.mul, sums, monomials[target]))
+                heap.append((cost, mover, target, stamps[mover], stamps[target]))
+    return heap
+
+
+def _upwards(xs, ys, v0, v1, v2):
+    """
+    Returns whether a triangle faces upwards, rather than being a wall or
+    facing down
+    """
+    return (xs[v1] - xs[v0]) * (ys[v2] - ys[v0]) - (ys[v1] - ys[v0]) * (
+        xs[v2] - xs[v0]
+    ) > 1e-12
+
+
+def _same_facing(xs, ys, zs, old, new):
+    """
+    Returns whether a face moved from old to new corners still faces the
+    same way: upwards if it did, or otherwise within 90 degrees of before.
+    """
+    if _upwards(xs, ys, *old):
+        return _upwards(xs, ys, *new)
+    normals = []
+    for v0, v1, v2 in (old, new):
+        first = (xs[v1] - xs[v0], ys[v1] - ys[v0], zs[v1] - zs[v0])
+        second = (xs[v2] - xs[v0], ys[v2] - ys[v0], zs[v2] - zs[v0])
+        normals.append(numpy.cross(first, second))
+    return numpy.dot(*normals) > 1e-12 and numpy.linalg.norm(normals[1]) > 1e-12
+
+
+def _free_vertices(points, faces, locked=None):
+    """
+    Works out which vertices decimation may move: those whose faces all face
+    upwards and that aren't on any edge without exactly two faces.
+    """
+    num_vertices = len(points)
+    corners = points[faces]
+    first = corners[:, 1] - corners[:, 0]
+    second = corners[:, 2] - corners[:, 0]
+    up = first[:, 0] * second[:, 1] - first[:, 1] * second[:, 0]
+    free = numpy.ones(num_vertices, dtype=bool)
+    free[faces[up <= 1e-12].reshape(-1)] = False
+    edges, counts = _edges(faces, num_vertices)
+    free[edges[counts != 2].reshape(-1)] = False
+    if locked is not None:
+        free &= ~locked
+    return free
+
+
+def _sliding_vertices(points, faces, free, locked=None):
+    """
+    Works out which vertices that can't move freely could still slide along
+    the top of a wall: those on the top surface, with all their other faces
+    in one vertical plane, and only on edges with exactly two faces.
+    """
+    num_vertices = len(points)
+    corners = points[faces]
+    normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    up = normals[:, 2] > 1e-12
+    wall = (numpy.abs(normals[:, 2]) <= 1e-12) & (
+        numpy.abs(normals[:, :2]).max(axis=1) > 1e-12
+    )
+    sliding = ~free
+    # Each vertex needs a face on top, and no faces other than walls
+    on_top = numpy.zeros(num_vertices, dtype=bool)
+    on_top[faces[up].reshape(-1)] = True
+    sliding &= on_top
+    sliding[faces[~up & ~wall].reshape(-1)] = False
+    # All its walls must face the same way as each other
+    directions = normals[wall, :2]
+    directions /= numpy.linalg.norm(directions, axis=1)[:, None]
+    wall_vertices = faces[wall].reshape(-1)
+    directions = numpy.repeat(directions, 3, axis=0)
+    first = numpy.zeros((num_vertices, 2))
+    first[wall_vertices] = directions
+    agreement = numpy.ones(num_vertices)
+    numpy.minimum.at(
+        agreement,
+        wall_vertices,
+        numpy.einsum("ij,ij->i", directions, first[wall_vertices]),
+    )
+    sliding &= agreement > 1 - 1e-9
+    edges, counts = _edges(faces, num_vertices)
+    sliding[edges[counts != 2].reshape(-1)] = False
+    if locked is not None:
+        sliding &= ~locked
+    return sliding
+
+
+def _edges(faces, num_vertices):
+    """
+    Returns the unique undirected edges of some faces, as an (N, 2) array with
+    the lower vertex first, along with how many faces each edge is part of.
+    """
+    edges = faces[:, [0, 1, 1, 2, 2, 0]].reshape((-1, 2))
+    edge_ids, counts = numpy.unique(
+        edges.min(axis=1) * num_vertices + edges.max(axis=1), return_counts=True
+    )
+    return (
+        numpy.stack([edge_ids // num_vertices, edge_ids % num_vertices], axis=1),
+        counts,
+    )
@@ -1,22 +1,63 @@
+import contextlib
 import io
+import json
 import PIL.Image
 import numpy
 import os
+import shutil
 import subprocess
 import requests
 from osgeo import gdal
 
+# Ways of resampling rasters when reading them at a smaller size, and the
+# GDAL algorithm for each
+RESAMPLING = {
+    "nearest": "GRIORA_NearestNeighbour",
+    "average": "GRIORA_Average",
+    "bilinear": "GRIORA_Bilinear",
+    "cubic": "GRIORA_Cubic",
+    "mode": "GRIORA_Mode",
+}
 
-def raster_to_array(input_path):
+# Suffix of landcarve's native raster format: a .npy array, memory-mapped when
+# read, with a .json sidecar holding its geotransform, projection and NODATA
+NATIVE_SUFFIX = ".npy"
+
+# How rasters are written out; set from the top-level command's options
+GEOTIFF_OPTIONS = {
+    "tiled": False,
+    "compress": None,
+    "overviews": False,
+    "bigtiff": "if-safer",
+    "keep_dtype": False,
+}
+
+
+def raster_to_array(input_path, size=None, resampling="nearest"):
     """
     Takes an input raster file and turns it into a NumPy array.
     Only takes band 1 for now.
+
+    If size is given as (rows, columns), the raster is resampled to that
+    size as it's read (using its overviews, if it has any), so the
+    full-resolution array is never loaded.
     """
+    if is_native(input_path):
+        arr, _ = read_native(input_path)
+        return arr if size is None else resample_array(arr, size, resampling)
     if input_path == "-":
         input_path = "/dev/stdin"
     raster = gdal.Open(input_path)
     band = raster.GetRasterBand(1)
-    arr = band.ReadAsArray()
+    with mosaic_pixel_functions():
+        if size is None:
+            arr = band.ReadAsArray()
+        else:
+            arr = band.ReadAsArray(
+                buf_xsize=size[1],
+                buf_ysize=size[0],
+                resample_alg=getattr(gdal, RESAMPLING[resampling]),
+            )
     # If it's a negative-pixel thing, flip it
     # if raster.GetGeoTransform()[5] < 0:
     #    arr = numpy.flipud(arr)
@@ -28,50 +69,515 @@ def raster_to_array_and_projection(input_path):
     Takes an input raster file and turns it into a NumPy array.
     Only takes band 1 for now.
     """
+    if is_native(input_path):
+        arr, metadata = read_native(input_path)
+        return arr, metadata["projection"]
     if input_path == "-":
         input_path = "/dev/stdin"
     raster = gdal.Open(input_path)
     band = raster.GetRasterBand(1)
-    arr = band.ReadAsArray()
+    with mosaic_pixel_functions():
+        arr = band.ReadAsArray()
     return arr, raster.GetProjection()
 
 
+@contextlib.contextmanager
+def mosaic_pixel_functions():
+    """
+    Lets GDAL run our pixel functions, and only ours, while reading VRTs made
+    by merge in this thread.
+    """
+    name = "GDAL_VRT_PYTHON_TRUSTED_MODULES"
+    previous = gdal.GetThreadLocalConfigOption(name, None)
+    gdal.SetThreadLocalConfigOption(name, "landcarve.utils.mosaic")
+    try:
+        yield
+    finally:
+        gdal.SetThreadLocalConfigOption(name, previous)
+
+
+def is_native(path):
+    """
+    Says if a path is in landcarve's native raster format.
+    """
+    return path.endswith(NATIVE_SUFFIX)
+
+
+def read_native(path):
+    """
+    Opens a native raster, returning its array and its sidecar's metadata.
+    The array is memory-mapped copy-on-write, so only the parts that are used
+    are read, and changing it doesn't change the file.
+    """
+    with open(path + ".json") as fh:
+        metadata = json.load(fh)
+    arr = numpy.load(path, mmap_mode="c")
+    # Rows are kept in the order they're written, like GeoTIFFs
+    if metadata["flipped"]:
+        arr = numpy.flipud(arr)
+    return arr, metadata
+
+
+def write_native_metadata(path, geotransform=None, projection=None):
+    """
+    Writes a native raster's sidecar.
+    """
+    with open(path + ".json", "w") as fh:
+        json.dump(
+            {
+                "geotransform": geotransform,
+                "projection": projection or "",
+                "nodata": -1000,
+                "flipped": True,
+            },
+            fh,
+        )
+
+
+def remove_raster(path):
+    """
+    Deletes a raster, along with its sidecar if it's a native one.
+    """
+    os.unlink(path)
+    if is_native(path):
+        os.unlink(path + ".json")
+
+
+def link_raster(input_path, output_path):
+    """
+    Hard-links a raster to a new path, along with its sidecar if it's a native
+    one, or copies it where it can't be linked (like across filesystems).
+    """
+    paths = [(input_path, output_path)]
+    if is_native(input_path):
+        paths.append((input_path + ".json", output_path + ".json"))
+    for source, destination in paths:
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+
+class Raster:
+    """
+    A raster file, opened lazily. Gives band 1's shape, data type, NODATA
+    value and block size, and the file's projection and geotransform,
+    without reading any data; data is read a window or a block at a time, so
+    rasters larger than memory can be worked through.
+    """
+
+    def __init__(self, path):
+        self.path = "/dev/stdin" if path == "-" else path
+        self._dataset = None
+        self._native = None
+
+    @property
+    def native(self):
+        """
+        The (array, metadata) of a native raster, or None for GDAL ones.
+        """
+        if self._native is None and is_native(self.path):
+            self._native = read_native(self.path)
+        return self._native
+
+    @property
+    def dataset(self):
+        if self._dataset is None:
+            self._dataset = gdal.Open(self.path)
+            if self._dataset is None:
+                raise ValueError("Cannot open raster %s" % self.path)
+        return self._dataset
+
+    @property
+    def band(self):
+        return self.dataset.GetRasterBand(1)
+
+    @property
+    def shape(self):
+        if self.native:
+            return self.native[0].shape
+        return self.dataset.RasterYSize, self.dataset.RasterXSize
+
+    @property
+    def dtype(self):
+        return self.read(0, 0, 1, 1).dtype
+
+    @property
+    def nodata(self):
+        if self.native:
+            return self.native[1]["nodata"]
+        return self.band.GetNoDataValue()
+
+    @property
+    def projection(self):
+        if self.native:
+            return self.native[1]["projection"]
+        return self.dataset.GetProjection()
+
+    @property
+    def geotransform(self):
+        if self.native:
+            return self.native[1]["geotransform"]
+        # None for files without one, as for native rasters, rather than the
+        # one GDAL makes up
+        return self.dataset.GetGeoTransform(can_return_null=True)
+
+    @property
+    def block_shape(self):
+        """
+        The (rows, columns) size of the file's native blocks.
+        """
+        if self.native:
+            return 1, self.shape[1]
+        cols, rows = self.band.GetBlockSize()
+        return rows, cols
+
+    def read(self, row=0, col=0, rows=None, cols=None):
+        """
+        Reads a window of the raster as an array; by default, from the given
+        corner to the far edges.
+        """
+        if rows is None:
+            rows = self.shape[0] - row
+        if cols is None:
+            cols = self.shape[1] - col
+        if self.native:
+            return numpy.array(self.native[0][row : row + rows, col : col + cols])
+        with mosaic_pixel_functions():
+            return self.band.ReadAsArray(col, row, cols, rows)
+
+    def blocks(self, halo=0, min_cells=1 << 20):
+        """
+        Reads the raster a block at a time, yielding (row, col, first row,
+        first col, array) for each. Blocks are made of whole native blocks,
+        stacked up until they have at least min_cells cells, and each array
+        also includes up to halo cells either side, so its first row and
+        column may come before the block's.
+        """
+        height, width = self.shape
+        block_rows, block_cols = self.block_shape
+        block_rows *= max(1, -(-min_cells // (block_rows * block_cols)))
+        block_rows = min(block_rows, height)
+        for row in range(0, height, block_rows):
+            for col in range(0, width, block_cols):
+                first_row = max(0, row - halo)
+                first_col = max(0, col - halo)
+                last_row = min(height, row + block_rows + halo)
+                last_col = min(width, col + block_cols + halo)
+                yield row, col, first_row, first_col, self.read(
+                    first_row, first_col, last_row - first_row, last_col - first_col
+                )
+
+
+def map_raster(input_path, output_path, function, min_cells=1 << 20):
+    """
+    Runs function on each block of an input raster in turn, and writes what
+    it returns out just as array_to_raster would (flipped up/down, with the
+    input's projection and geotransform), so rasters larger than memory can
+    be processed. The function must give back an array the same shape as it
+    gets.
+    """
+    raster = Raster(input_path)
+    height, width = raster.shape
+    geotransform = flipped_geotransform(raster.geotransform, height)
+    native = is_native(output_path)
+    out = None
+    for row, col, _, _, arr in raster.blocks(min_cells=min_cells):
+        arr = function(arr)
+        # Created once we know what type the output is
+        if out is None:
+            dtype = output_dtype(arr.dtype)
+            if native:
+                out = numpy.lib.format.open_memmap(
+                    output_path, mode="w+", dtype=dtype, shape=(height, width)
+                )
+            else:
+                out = create_geotiff(
+                    output_path,
+                    width,
+                    height,
+                    dtype,
+                    geotransform=geotransform,
+                    projection=raster.projection,
+                )
+        if native:
+            # Kept in the order it's written, so no need to flip each block
+            out[row : row + arr.shape[0], col : col + arr.shape[1]] = arr
+        else:
+            out.GetRasterBand(1).WriteArray(
+                numpy.flipud(arr), col, height - row - arr.shape[0]
+            )
+    if native:
+        out.flush()
+        write_native_metadata(
+            output_path, geotransform=geotransform, projection=raster.projection
+        )
+    else:
+        finish_geotiff(out, dtype)
+
+
+def flipped_geotransform(geotransform, height):
+    """
+    Returns the geotransform for a raster flipped up/down, so the same cells
+    stay in the same places, or None if there isn't one.
+    """
+    if not geotransform:
+        return None
+    x, x_col, x_row, y, y_col, y_row = geotransform
+    return [x + x_row * height, x_col, -x_row, y + y_row * height, y_col, -y_row]
+
+
+def resample_array(arr, size, resampling="nearest"):
+    """
+    Resamples an array to (rows, columns) size exactly as raster_to_array
+    would if it were read from a file.
+    """
+    if resampling == "nearest":
+        return arr[
+            numpy.ix_(
+                nearest_indexes(arr.shape[0], size[0]),
+                nearest_indexes(arr.shape[1], size[1]),
+            )
+        ]
+    from osgeo import gdal_array
+
+    band = gdal_array.OpenArray(numpy.ascontiguousarray(arr)).GetRasterBand(1)
+    return band.ReadAsArray(
+        buf_xsize=size[1],
+        buf_ysize=size[0],
+        resample_alg=getattr(gdal, RESAMPLING[resampling]),
+    )
+
+
+def nearest_indexes(length, new_length):
+    """
+    Returns which of length cells GDAL's nearest neighbour resampling picks
+    for each of new_length cells: the one under each new cell's centre.
+    """
+    places = (numpy.arange(new_length) + 0.5) * (length / new_length) + 1e-10
+    return numpy.minimum(numpy.floor(places), length - 1).astype(numpy.int64)
+
+
+def raster_row_bands(input_path, band_rows, overlap=0, flip=False):
+    """
+    Reads band 1 of a raster a few rows at a time, yielding
+    (band start row, first row, array) for each band of band_rows rows.
+    Each array also includes up to `overlap` rows either side, so first row
+    is the row index of the array's first row.
+
+    If flip is set, rows are read as if the raster were flipped up/down.
+    """
+    raster = Raster(input_path)
+    height = raster.shape[0]
+    for start in range(0, height, band_rows):
+        first = max(0, start - overlap)
+        last = min(height, start + band_rows + overlap)
+        if flip:
+            arr = numpy.flipud(raster.read(height - last, 0, last - first))
+        else:
+            arr = raster.read(first, 0, last - first)
+        yield start, first, arr
+
+
+def raster_shape(input_path):
+    """
+    Returns the (rows, columns) shape of a raster without reading it.
+    """
+    return Raster(input_path).shape
+
+
+def raster_shape_and_type(input_path):
+    """
+    Returns the (rows, columns) shape of a raster and the name of band 1's
+    data type, without reading it. Returns (None, None) for files that aren't
+    rasters, like meshes.
+    """
+    if is_native(input_path):
+        raster = Raster(input_path)
+        return raster.shape, raster.dtype.name
+    if gdal.IdentifyDriver(input_path) is None:
+        return None, None
+    raster = gdal.Open(input_path)
+    band = raster.GetRasterBand(1)
+    data_type = gdal.GetDataTypeName(band.DataType).lower()
+    return (raster.RasterYSize, raster.RasterXSize), data_type
+
+
 def array_to_raster(arr, output_path, offset_and_pixel=None, projection=None):
     """
     Takes a NumPy array and outputs it to a GDAL file.
 
     offset_and_pixel is (x offset, y offset, pixel width, pixel height)
+
+    Paths ending in NATIVE_SUFFIX are written in landcarve's native format,
+    which is quicker to write and read back for intermediate files.
+    """
+    geotransform = None
+    if offset_and_pixel:
+        geotransform = [
+            offset_and_pixel[0],  # X offset
+            offset_and_pixel[2],  # Pixel width
+            0,  # Rotation coefficient 1
+            offset_and_pixel[1] + arr.shape[0],  # Y offset
+            0,  # Rotation coefficient 2
+            -offset_and_pixel[3],  # Pixel height
+        ]
+    if is_native(output_path):
+        # Stored as given, and flipped when read, which is free
+        numpy.save(output_path, arr.astype(output_dtype(arr.dtype), copy=False))
+        write_native_metadata(output_path, geotransform, projection)
+        return
+    dtype = output_dtype(arr.dtype)
+    outdata = create_geotiff(
+        output_path, arr.shape[1], arr.shape[0], dtype, geotransform, projection
+    )
+    outdata.GetRasterBand(1).WriteArray(numpy.flipud(arr))
+    finish_geotiff(outdata, dtype)
+
+
+def copy_to_geotiff(input_path, output_path):
+    """
+    Copies a raster GDAL can read (like a VRT) into a GeoTIFF written as
+    GEOTIFF_OPTIONS say, a block at a time and without flipping it.
+    """
+    raster = Raster(input_path)
+    dtype = output_dtype(raster.dtype)
+    with mosaic_pixel_functions():
+        outdata = gdal.Translate(
+            output_path,
+            raster.dataset,
+            format="GTiff",
+            outputType=gdal_type(dtype),
+            creationOptions=creation_options(dtype),
+        )
+    finish_geotiff(outdata, dtype)
+
+
+def set_geotiff_options(**options):
+    """
+    Changes how rasters are written out from now on; see GEOTIFF_OPTIONS.
+    """
+    unknown = set(options) - set(GEOTIFF_OPTIONS)
+    if unknown:
+        raise ValueError("Unknown GeoTIFF options: %s" % ", ".join(sorted(unknown)))
+    GEOTIFF_OPTIONS.update(options)
+
+
+def output_dtype(dtype):
+    """
+    Returns the data type data of a given type is written out as: Float32,
+    unless we're keeping data types and it's an integer or float type GDAL
+    has.
+    """
+    keep = GEOTIFF_OPTIONS["keep_dtype"] and dtype.kind in "iuf"
+    if keep and gdal_type(dtype) is not None:
+        return dtype
+    return numpy.dtype(numpy.float32)
+
+
+def gdal_type(dtype):
+    """
+    Returns the GDAL data type for a NumPy one, or None if there isn't one.
+    """
+    from osgeo import gdal_array
+
+    return gdal_array.NumericTypeCodeToGDALTypeCode(dtype)
+
+
+def creation_options(dtype):
+    """
+    Returns the GTiff creation options for a raster of the given data type.
+    """
+    options = ["BIGTIFF=%s" % GEOTIFF_OPTIONS["bigtiff"].replace("-", "_").upper()]
+    if GEOTIFF_OPTIONS["tiled"]:
+        options += ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256"]
+    if GEOTIFF_OPTIONS["compress"]:
+        options.append("COMPRESS=%s" % GEOTIFF_OPTIONS["compress"].upper())
+        # Floating point prediction for floats, horizontal differencing for
+        # everything else
+        options.append("PREDICTOR=%i" % (3 if dtype.kind == "f" else 2))
+    return options
+
+
+def create_geotiff(
+    output_path, width, height, dtype, geotransform=None, projection=None
+):
+    """
+    Creates a single-band GeoTIFF to write a raster into, laid out and
+    compressed as GEOTIFF_OPTIONS say.
     """
     if output_path == "-":
         output_path = "/dev/stdout"
     driver = gdal.GetDriverByName("GTiff")
-    arr = numpy.flipud(arr)
     outdata = driver.Create(
         output_path,
-        xsize=arr.shape[1],
-        ysize=arr.shape[0],
+        xsize=width,
+        ysize=height,
         bands=1,
-        eType=gdal.GDT_Float32,
+        eType=gdal_type(dtype),
+        options=creation_options(dtype),
     )
     # Set projection and transform if we have them
-    if offset_and_pixel:
-        outdata.SetGeoTransform(
-            [
-                offset_and_pixel[0],  # X offset
-                offset_and_pixel[2],  # Pixel width
-                0,  # Rotation coefficient 1
-                offset_and_pixel[1] + arr.shape[0],  # Y offset
-                0,  # Rotation coefficient 2
-                -offset_and_pixel[3],  # Pixel height
-            ]
-        )
+    if geotransform:
+        outdata.SetGeoTransform(geotransform)
     if projection:
         outdata.SetProjection(projection)
-    outband = outdata.GetRasterBand(1)
     # TODO: Use global nodata value?
-    outband.SetNoDataValue(-1000)
-    outband.WriteArray(arr)
-    outband.FlushCache()
+    if dtype.kind == "f" or numpy.iinfo(dtype).min <= -1000:
+        outdata.GetRasterBand(1).SetNoDataValue(-1000)
+    return outdata
+
+
+def finish_geotiff(outdata, dtype):
+    """
+    Flushes a GeoTIFF made by create_geotiff out, adding internal overviews
+    if GEOTIFF_OPTIONS asks for them.
+    """
+    if GEOTIFF_OPTIONS["overviews"]:
+        build_overviews(outdata, dtype)
+    outdata.FlushCache()
+
+
+def ensure_overviews(input_path, internal=False, rebuild=False):
+    """
+    Builds an overview pyramid for a raster file, unless it has one already
+    (or rebuild is set): inside the file if internal is set, otherwise in a
+    .ovr file next to it. Reads of it at a smaller size come from the
+    closest overview from then on, rather than the full-size data. Returns
+    True if it built one.
+    """
+    raster = Raster(input_path)
+    if raster.native:
+        return False
+    if raster.band.GetOverviewCount() and not rebuild:
+        return False
+    dataset = gdal.Open(input_path, gdal.GA_Update if internal else gdal.GA_ReadOnly)
+    build_overviews(dataset, raster.dtype)
+    # Closing it writes them out
+    dataset = None
+    return True
+
+
+def build_overviews(dataset, dtype):
+    """
+    Adds overviews to a dataset, halving its size each level until it would
+    fit in a single 256x256 block. Float rasters with a NODATA value use the
+    average of the cells that aren't NODATA; everything else (like land
+    cover classes, or rasters GDAL can't tell NODATA in) uses the nearest
+    value, so NODATA is never averaged into valid cells.
+    """
+    factors = []
+    factor = 2
+    while max(dataset.RasterXSize, dataset.RasterYSize) // factor >= 256:
+        factors.append(factor)
+        factor *= 2
+    if not factors:
+        return
+    has_nodata = dataset.GetRasterBand(1).GetNoDataValue() is not None
+    if dtype.kind == "f" and has_nodata:
+        dataset.BuildOverviews("AVERAGE", factors)
+    else:
+        dataset.BuildOverviews("NEAREST", factors)
 
 
 def download_image(url):
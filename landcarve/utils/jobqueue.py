@@ -0,0 +1,208 @@
+import contextlib
+import hashlib
+import json
+import os
+import secrets
+import socket
+import tempfile
+import threading
+import time
+
+STATES = ("pending", "running", "done", "failed")
+
+
+class JobQueue:
+    """
+    A queue of pipeline inputs kept as one small JSON file per job in a
+    shared directory, so any number of workers on any number of hosts can
+    drain it without a server.
+
+    A job's state is the subdirectory its file is in (pending, running, done
+    or failed), and it only moves between them by atomic renames, so exactly
+    one worker can claim each job. A running job's file is named with a
+    token only the worker that claimed it knows, and it's always moved on by
+    renaming from that name, so a worker that has lost a job can't move it
+    once someone else has it. Running jobs are touched regularly by their
+    worker; ones that haven't been for a while are assumed to have lost it,
+    and go back to pending.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        for state in STATES:
+            os.makedirs(os.path.join(directory, state), exist_ok=True)
+
+    def path(self, state, job_id):
+        return os.path.join(self.directory, state, job_id + ".json")
+
+    def add(self, input_path):
+        """
+        Adds a job for an input, unless there's already one. Returns True if
+        it was added.
+        """
+        input_path = os.path.abspath(input_path)
+        job_id = hashlib.sha256(input_path.encode("utf8")).hexdigest()[:16]
+        if any(
+            os.path.exists(self.path(state, job_id))
+            for state in STATES
+            if state != "running"
+        ) or any(claim.split(".")[0] == job_id for claim in self.ids("running")):
+            return False
+        self.write(job_id, "pending", {"input": input_path, "attempts": 0})
+        return True
+
+    def write(self, job_id, state, job):
+        """
+        Atomically writes a job's file into a state's directory.
+        """
+        fd, temporary_path = tempfile.mkstemp(
+            dir=os.path.join(self.directory, state), prefix=".", suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as fh:
+            json.dump(job, fh)
+        os.replace(temporary_path, self.path(state, job_id))
+
+    def move(self, claim, job, state):
+        """
+        Moves a claimed job to a new state with new contents. Raises
+        FileNotFoundError if it isn't still running under that claim, so a job
+        someone else has moved on is never brought back.
+        """
+        # Taking it under a fresh token is what checks it's still ours; once
+        # it's under that, nobody else can know its name (and as it's just
+        # been touched, nobody will think it's stale) while it's rewritten
+        job_id = claim.split(".")[0]
+        moving = "%s.%s" % (job_id, secrets.token_hex(8))
+        os.rename(self.path("running", claim), self.path("running", moving))
+        os.utime(self.path("running", moving))
+        self.write(moving, "running", job)
+        os.rename(self.path("running", moving), self.path(state, job_id))
+
+    def discard(self, claim):
+        """
+        Moves a running job whose file can't be read to failed, so it isn't
+        left running forever.
+        """
+        try:
+            os.rename(
+                self.path("running", claim), self.path("failed", claim.split(".")[0])
+            )
+        except FileNotFoundError:
+            pass
+
+    def read(self, state, job_id):
+        with open(self.path(state, job_id)) as fh:
+            return json.load(fh)
+
+    def ids(self, state):
+        return sorted(
+            name[:-5]
+            for name in os.listdir(os.path.join(self.directory, state))
+            if name.endswith(".json") and not name.startswith(".")
+        )
+
+    def claim(self):
+        """
+        Claims the next pending job, returning (claim, job), or None if
+        there's nothing left to claim. The claim is the job's ID and a token
+        only this worker knows, and is what the job is handled by from then
+        on.
+        """
+        for job_id in self.ids("pending"):
+            claim = "%s.%s" % (job_id, secrets.token_hex(8))
+            try:
+                os.rename(self.path("pending", job_id), self.path("running", claim))
+            except FileNotFoundError:
+                # Someone else got it first
+                continue
+            try:
+                # Renaming keeps the pending file's age, which would make it
+                # look stale to other workers
+                os.utime(self.path("running", claim))
+                job = self.read("running", claim)
+            except FileNotFoundError:
+                # Reclaimed from under us before we could mark it as ours
+                continue
+            except ValueError:
+                self.discard(claim)
+                continue
+            job["worker"] = "%s:%s" % (socket.gethostname(), os.getpid())
+            self.write(claim, "running", job)
+            return claim, job
+        return None
+
+    def finish(self, claim, job, succeeded, retries):
+        """
+        Moves a claimed job to done, or back to pending if it failed and has
+        retries left, or to failed if not.
+        """
+        if succeeded:
+            state = "done"
+        else:
+            job["attempts"] += 1
+            state = "pending" if job["attempts"] <= retries else "failed"
+        job.pop("worker", None)
+        try:
+            self.move(claim, job, state)
+        except FileNotFoundError:
+            # It was reclaimed from under us; whoever has it now will finish it
+            pass
+        return state
+
+    def reclaim(self, stale_after, retries):
+        """
+        Gives up on running jobs that haven't been touched for stale_after
+        seconds, counting it as a failed attempt, and moves any whose files
+        can't be read to failed. Returns how many there were.
+        """
+        reclaimed = 0
+        for claim in self.ids("running"):
+            try:
+                age = time.time() - os.path.getmtime(self.path("running", claim))
+                if age < stale_after:
+                    continue
+                job = self.read("running", claim)
+            except FileNotFoundError:
+                continue
+            except ValueError:
+                self.discard(claim)
+                reclaimed += 1
+                continue
+            job["attempts"] += 1
+            job.pop("worker", None)
+            state = "pending" if job["attempts"] <= retries else "failed"
+            try:
+                self.move(claim, job, state)
+            except FileNotFoundError:
+                continue
+            reclaimed += 1
+        return reclaimed
+
+    @contextlib.contextmanager
+    def heartbeat(self, claim, interval):
+        """
+        Keeps touching a claimed job's file every interval seconds, so other
+        workers know it's still being worked on.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    os.utime(self.path("running", claim))
+                except FileNotFoundError:
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def counts(self):
+        """
+        Returns how many jobs are in each state.
+        """
+        return {state: len(self.ids(state)) for state in STATES}
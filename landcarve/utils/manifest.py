@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import shlex
+import tempfile
+
+import landcarve
+from landcarve.utils.cache import StepCache
+
+
+class Manifest:
+    """
+    A record of a batch pipeline run, kept in a JSON file: for each input, the
+    hash of its contents and of the pipeline it was run through, its output
+    path, and whether it succeeded. Re-running with the same manifest skips
+    inputs whose output is still up to date.
+    """
+
+    def __init__(self, path, pipeline):
+        self.path = path
+        self.pipeline_hash = self.hash_pipeline(pipeline)
+        self.input_hashes = {}
+        self.inputs = {}
+        if os.path.exists(path):
+            with open(path) as fh:
+                self.inputs = json.load(fh)["inputs"]
+
+    @staticmethod
+    def hash_pipeline(pipeline):
+        """
+        Returns a hash of a pipeline's steps (normalised, so spacing and
+        quoting don't matter) and the landcarve version running them.
+        """
+        digest = hashlib.sha256(landcarve.__version__.encode("utf8"))
+        for line in pipeline:
+            digest.update(b"\0" + shlex.join(shlex.split(line)).encode("utf8"))
+        return digest.hexdigest()
+
+    def input_hash(self, input_path):
+        if input_path not in self.input_hashes:
+            try:
+                self.input_hashes[input_path] = StepCache.file_hash(input_path)
+            except OSError:
+                self.input_hashes[input_path] = None
+        return self.input_hashes[input_path]
+
+    def up_to_date(self, input_path, output_path):
+        """
+        Says if an input was last run successfully, with the same contents
+        and pipeline, and its output hasn't been changed or removed since.
+        """
+        entry = self.inputs.get(os.path.abspath(input_path))
+        if not entry or entry["status"] != "done":
+            return False
+        if entry["pipeline_hash"] != self.pipeline_hash:
+            return False
+        if entry["output"] != os.path.abspath(output_path):
+            return False
+        if entry["input_hash"] != self.input_hash(input_path):
+            return False
+        try:
+            stat = os.stat(output_path)
+        except OSError:
+            return False
+        return [stat.st_size, stat.st_mtime_ns] == entry["output_stat"]
+
+    def record(self, input_path, output_path, succeeded):
+        """
+        Records how an input's run went, and saves the manifest.
+        """
+        output_stat = None
+        if succeeded:
+            try:
+                stat = os.stat(output_path)
+            except OSError:
+                # The last step wrote something else (like tilesplit's
+                # tiles), so there's nothing to check later; it'll be re-run
+                pass
+            else:
+                output_stat = [stat.st_size, stat.st_mtime_ns]
+        self.inputs[os.path.abspath(input_path)] = {
+            "input_hash": self.input_hash(input_path),
+            "pipeline_hash": self.pipeline_hash,
+            "output": os.path.abspath(output_path),
+            "output_stat": output_stat,
+            "status": "done" if succeeded else "failed",
+        }
+        self.save()
+
+    def save(self):
+        """
+        Writes the manifest out, atomically so a crash can't leave it broken.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump({"inputs": self.inputs}, fh, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.path)
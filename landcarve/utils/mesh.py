@@ -0,0 +1,1129 @@
+import numpy
+import scipy.sparse
+
+from landcarve.utils.decimate import qem_collapses
+from landcarve.utils.rtin import rtin_triangles
+from landcarve.utils.stl import write_stl
+
+# Neighbour offsets (row, column) from a centre cell, arranged like so:
+#   tl  t   tr
+#   l   c---r
+#   bl  b   br
+C = (0, 0)
+T = (0, -1)
+TR = (1, -1)
+TL = (-1, -1)
+L = (-1, 0)
+R = (1, 0)
+BL = (-1, 1)
+B = (0, 1)
+BR = (1, 1)
+
+# Layers a grid vertex can sit on
+TOP = 0
+BOTTOM = 1
+
+# The triangulation rules, applied to every present cell. Each is:
+#   (surface corners, neighbours that must exist, neighbours that must not,
+#    [(edge start, edge end, neighbours that must not exist), ...])
+# These mirror the corner and diagonal rules in realise's reference mesher.
+RULES = [
+    # Centre-Right-Bottom triangle
+    (
+        (C, R, B),
+        (R, B),
+        (),
+        [(B, R, (BR,)), (R, C, (T, TR)), (C, B, (L, BL))],
+    ),
+    # Top-centre-left triangle
+    (
+        (T, C, L),
+        (T, L),
+        (),
+        [(T, L, (TL,)), (C, T, (R, TR)), (L, C, (B, BL))],
+    ),
+    # Top-right-center triangle (if tr doesn't exist)
+    (
+        (T, R, C),
+        (T, R),
+        (TR,),
+        [(R, T, ()), (T, C, (L, TL)), (C, R, (B, BR))],
+    ),
+    # Left-center-bottom triangle (if bl doesn't exist)
+    (
+        (L, C, B),
+        (L, B),
+        (BL,),
+        [(L, B, ()), (B, C, (R, BR)), (C, L, (T, TR))],
+    ),
+]
+
+
+def grid_triangles(heights, thin=False, closed=True):
+    """
+    Triangulates a grid of heights (NaN for no data) into a closed model,
+    working on the whole array at once. If closed is False, only the top
+    surface is made.
+
+    Returns an (N, 3, 3) integer array of triangles, each corner given as
+    (row, column, layer), where the layer is TOP or BOTTOM.
+    """
+    present = ~numpy.isnan(heights)
+    rows, cols = present.shape
+    padded = numpy.pad(present, 1, mode="constant", constant_values=False)
+
+    def shifted(offset):
+        return padded[
+            1 + offset[0] : 1 + offset[0] + rows, 1 + offset[1] : 1 + offset[1] + cols
+        ]
+
+    triangles = []
+    for corners, required, missing, edges in RULES:
+        mask = present.copy()
+        for offset in required:
+            mask &= shifted(offset)
+        for offset in missing:
+            mask &= ~shifted(offset)
+        centres = numpy.argwhere(mask)
+        # Top surface and its matching bottom polygon
+        triangles.append(_corners(centres, corners, TOP))
+        if not closed:
+            continue
+        if thin:
+            flipped = (corners[0], corners[2], corners[1])
+            triangles.append(_corners(centres, flipped, BOTTOM))
+        else:
+            triangles.append(_corners(centres, corners, BOTTOM))
+        # Edges, where the neighbours say we're at the boundary
+        for start, end, edge_missing in edges:
+            edge_mask = mask.copy()
+            for offset in edge_missing:
+                edge_mask &= ~shifted(offset)
+            triangles.append(_edge(numpy.argwhere(edge_mask), start, end))
+    return numpy.concatenate(triangles)
+
+
+def _corners(centres, offsets, layer):
+    """
+    Makes triangles for each centre out of three offsets on a single layer.
+    """
+    result = numpy.empty((len(centres), 3, 3), dtype=numpy.int64)
+    for i, offset in enumerate(offsets):
+        result[:, i, 0] = centres[:, 0] + offset[0]
+        result[:, i, 1] = centres[:, 1] + offset[1]
+        result[:, i, 2] = layer
+    return result
+
+
+def _edge(centres, start, end):
+    """
+    Makes the two wall triangles joining the top edge start-end down to the
+    bottom, as a quad of (start, end, end bottom, start bottom).
+    """
+    result = numpy.empty((2, len(centres), 3, 3), dtype=numpy.int64)
+    for t, corners in enumerate(
+        [
+            ((start, TOP), (end, TOP), (start, BOTTOM)),
+            ((end, TOP), (end, BOTTOM), (start, BOTTOM)),
+        ]
+    ):
+        for i, (offset, layer) in enumerate(corners):
+            result[t, :, i, 0] = centres[:, 0] + offset[0]
+            result[t, :, i, 1] = centres[:, 1] + offset[1]
+            result[t, :, i, 2] = layer
+    return result.reshape((-1, 3, 3))
+
+
+def closed_triangles(surface):
+    """
+    Turns an (N, 3, 2) array of anticlockwise (row, column) top surface
+    triangles into a closed model, adding a matching base underneath and
+    walls down from every open edge.
+
+    Returns triangles in the same (row, column, layer) form as grid_triangles.
+    """
+    layer = numpy.full(surface.shape[:2] + (1,), TOP, dtype=numpy.int64)
+    top = numpy.concatenate([surface, layer], axis=2)
+    # The base is the top again, wound the other way so it faces down
+    base = top[:, [0, 2, 1]].copy()
+    base[..., 2] = BOTTOM
+    # Find the edges that only one triangle uses
+    open_edges = _open_edges(surface)
+    start_points = top.reshape((-1, 3))[open_edges]
+    end_points = top[:, [1, 2, 0]].reshape((-1, 3))[open_edges]
+    # Each open edge gets a wall quad, facing outwards
+    start_bottoms = start_points.copy()
+    start_bottoms[:, 2] = BOTTOM
+    end_bottoms = end_points.copy()
+    end_bottoms[:, 2] = BOTTOM
+    walls = numpy.concatenate(
+        [
+            numpy.stack([end_points, start_points, start_bottoms], axis=1),
+            numpy.stack([end_points, start_bottoms, end_bottoms], axis=1),
+        ]
+    )
+    return numpy.concatenate([top, base, walls])
+
+
+def _open_edges(surface):
+    """
+    Returns which edges of an (N, 3, 2) array of (row, column) triangles are
+    not shared with another triangle, as a flat array of N * 3 booleans for
+    the edges from each corner to the next.
+    """
+    width = surface[..., 1].max(initial=0) + 1
+    ids = surface[..., 0] * width + surface[..., 1]
+    count = ids.max(initial=0) + 1
+    starts = ids.reshape(-1)
+    ends = ids[:, [1, 2, 0]].reshape(-1)
+    # Look for each edge's reverse amongst all the edges
+    edges = numpy.sort(starts * count + ends)
+    reverses = ends * count + starts
+    found = numpy.searchsorted(edges, reverses).clip(0, max(len(edges) - 1, 0))
+    return edges[found] != reverses if len(edges) else found.astype(bool)
+
+
+def compact_triangles(surface, heights, bottom, strips=None):
+    """
+    Closes a grid top surface - an (N, 3, 2) array of anticlockwise
+    (row, column) triangles from grid_triangles - with a flat base made of as
+    few triangles as possible, and walls made from whole straight runs of its
+    outline.
+
+    The base is built from the surface's footprint in each strip between two
+    rows, merging strips that stack on top of each other with straight sides
+    into one trapezoid. If strips is given as (start, end), only surface
+    triangles with their lowest row in that range are closed, and trapezoids
+    are not merged past its ends, so neighbouring bands join up.
+
+    Returns triangles in the same (row, column, layer) form as grid_triangles,
+    including the top surface, all wound to face outwards.
+    """
+    surface = numpy.asarray(surface, dtype=numpy.int64).reshape((-1, 3, 2))
+    if not len(surface):
+        return numpy.empty((0, 3, 3), dtype=numpy.int64)
+    strip = surface[..., 0].min(axis=1)
+    if strips is None:
+        strips = (strip.min(initial=0), strip.max(initial=-1) + 1)
+    owned = (strip >= strips[0]) & (strip < strips[1])
+    top = surface[owned]
+    trapezoids, neighbours = _trapezoids(surface, strip, strips)
+    corners = _corner_points(numpy.concatenate([trapezoids, neighbours]))
+    # Tag everything with its layer
+    base = _base_triangles(trapezoids, corners)
+    walls = _wall_triangles(surface, owned, corners, heights, bottom)
+    layer = numpy.full(top.shape[:2] + (1,), TOP, dtype=numpy.int64)
+    return numpy.concatenate([numpy.concatenate([top, layer], axis=2), base, walls])
+
+
+def _trapezoids(surface, strip, strips):
+    """
+    Works out the footprint of a grid surface as trapezoids spanning one or
+    more strips, each given as (top row, left, right, bottom row, left,
+    right). Returns those for the strips in range, and the single-strip ones
+    just either side of it.
+    """
+    rows = surface[..., 0]
+    cols = surface[..., 1]
+    # Every triangle has one corner alone on one row, and two on the other
+    on_top = rows == strip[:, None]
+    lone_top = on_top.sum(axis=1) == 1
+    lone = numpy.where(lone_top, on_top.argmax(axis=1), (~on_top).argmax(axis=1))
+    lone_col = cols[numpy.arange(len(cols)), lone]
+    pair = cols[numpy.arange(3)[None, :] != lone[:, None]].reshape((-1, 2))
+    pair_min = pair.min(axis=1)
+    pair_max = pair.max(axis=1)
+    # The edges crossing the strip on each side of the triangle, as the
+    # columns they cross the top and bottom row at
+    left_top = numpy.where(lone_top, lone_col, pair_min)
+    left_bottom = numpy.where(lone_top, pair_min, lone_col)
+    right_top = numpy.where(lone_top, lone_col, pair_max)
+    right_bottom = numpy.where(lone_top, pair_max, lone_col)
+    # Triangles joined by crossing edges make up one quadrilateral
+    order = numpy.lexsort((left_top + left_bottom, strip))
+    strip = strip[order]
+    left_top, left_bottom = left_top[order], left_bottom[order]
+    right_top, right_bottom = right_top[order], right_bottom[order]
+    new = numpy.ones(len(order), dtype=bool)
+    new[1:] = (
+        (strip[1:] != strip[:-1])
+        | (left_top[1:] != right_top[:-1])
+        | (left_bottom[1:] != right_bottom[:-1])
+    )
+    starts = numpy.flatnonzero(new)
+    ends = numpy.append(starts[1:], len(order)) - 1
+    quads = numpy.stack(
+        [
+            strip[starts],
+            left_top[starts],
+            right_top[ends],
+            strip[starts] + 1,
+            left_bottom[starts],
+            right_bottom[ends],
+        ],
+        axis=1,
+    )
+    inside = (quads[:, 0] >= strips[0]) & (quads[:, 0] < strips[1])
+    nearby = (quads[:, 0] == strips[0] - 1) | (quads[:, 0] == strips[1])
+    neighbours = quads[nearby]
+    quads = quads[inside]
+    if not len(quads):
+        return quads, neighbours
+    # Join each quadrilateral to the one below if it shares its whole bottom
+    # edge and both sides carry straight on, with nothing else touching the
+    # corners where they meet
+    corner_keys = numpy.concatenate(
+        [
+            vertex_keys(quads[:, 0], quads[:, 1], 0),
+            vertex_keys(quads[:, 0], quads[:, 2], 0),
+            vertex_keys(quads[:, 3], quads[:, 4], 0),
+            vertex_keys(quads[:, 3], quads[:, 5], 0),
+            vertex_keys(neighbours[:, 0], neighbours[:, 1], 0),
+            vertex_keys(neighbours[:, 0], neighbours[:, 2], 0),
+            vertex_keys(neighbours[:, 3], neighbours[:, 4], 0),
+            vertex_keys(neighbours[:, 3], neighbours[:, 5], 0),
+        ]
+    )
+    unique_keys, counts = numpy.unique(corner_keys, return_counts=True)
+
+    def corner_count(row, col):
+        return counts[numpy.searchsorted(unique_keys, vertex_keys(row, col, 0))]
+
+    top_keys = vertex_keys(quads[:, 0], quads[:, 1], quads[:, 2])
+    bottom_keys = vertex_keys(quads[:, 3], quads[:, 4], quads[:, 5])
+    order = numpy.argsort(top_keys)
+    position = numpy.searchsorted(top_keys[order], bottom_keys)
+    below = order[position.clip(0, len(order) - 1)]
+    joined = (
+        (top_keys[below] == bottom_keys)
+        & (quads[:, 3] < strips[1])
+        & (quads[:, 4] < quads[:, 5])
+        & (quads[:, 4] - quads[:, 1] == quads[below, 4] - quads[below, 1])
+        & (quads[:, 5] - quads[:, 2] == quads[below, 5] - quads[below, 2])
+        & (corner_count(quads[:, 3], quads[:, 4]) == 2)
+        & (corner_count(quads[:, 3], quads[:, 5]) == 2)
+    )
+    # Follow each chain of joined quadrilaterals to its last one
+    last = numpy.where(joined, below, numpy.arange(len(quads)))
+    while True:
+        further = last[last]
+        if (further == last).all():
+            break
+        last = further
+    first = numpy.ones(len(quads), dtype=bool)
+    first[below[joined]] = False
+    trapezoids = numpy.concatenate(
+        [quads[first][:, :3], quads[last[first]][:, 3:]], axis=1
+    )
+    return trapezoids, neighbours
+
+
+def _corner_points(trapezoids):
+    """
+    Returns the sorted, unique vertex keys of all trapezoid corners.
+    """
+    return numpy.unique(
+        numpy.concatenate(
+            [
+                vertex_keys(trapezoids[:, 0], trapezoids[:, 1], 0),
+                vertex_keys(trapezoids[:, 0], trapezoids[:, 2], 0),
+                vertex_keys(trapezoids[:, 3], trapezoids[:, 4], 0),
+                vertex_keys(trapezoids[:, 3], trapezoids[:, 5], 0),
+            ]
+        )
+    )
+
+
+def _base_triangles(trapezoids, corners):
+    """
+    Triangulates the base under each trapezoid, zipping together every
+    corner point along its top and bottom edges so the base meets the walls
+    and its neighbours without any T-junctions.
+    """
+    edges = []
+    for row, left, right in ((0, 1, 2), (3, 4, 5)):
+        start = numpy.searchsorted(
+            corners, vertex_keys(trapezoids[:, row], trapezoids[:, left], 0)
+        )
+        end = numpy.searchsorted(
+            corners,
+            vertex_keys(trapezoids[:, row], trapezoids[:, right], 0),
+            side="right",
+        )
+        edges.append((start, end - start))
+    (top_start, top_count), (bottom_start, bottom_count) = edges
+    # Each step moves along one edge by a point, making a triangle with the
+    # current point on the other edge. Steps are taken in order of how far
+    # along their edge they get.
+    steps = []
+    for start, count, left, right in (
+        (top_start, top_count, 1, 2),
+        (bottom_start, bottom_count, 4, 5),
+    ):
+        trapezoid = numpy.repeat(numpy.arange(len(trapezoids)), count - 1)
+        offset = numpy.arange(len(trapezoid)) - numpy.repeat(
+            numpy.cumsum(count - 1) - (count - 1), count - 1
+        )
+        middle = (
+            (corners[start[trapezoid] + offset] & ((1 << 21) - 1))
+            + (corners[start[trapezoid] + offset + 1] & ((1 << 21) - 1))
+        ) / 2
+        width = trapezoids[trapezoid, right] - trapezoids[trapezoid, left]
+        progress = (middle - trapezoids[trapezoid, left]) / numpy.maximum(width, 1)
+        steps.append((trapezoid, offset, progress))
+    trapezoid, offset, progress = [
+        numpy.concatenate([top, bottom]) for top, bottom in zip(*steps)
+    ]
+    along_top = numpy.arange(len(trapezoid)) < len(steps[0][0])
+    order = numpy.lexsort((progress, trapezoid))
+    trapezoid, offset, along_top = trapezoid[order], offset[order], along_top[order]
+    # How many steps along the other edge came before each one
+    first_step = numpy.searchsorted(trapezoid, trapezoid)
+    top_before = numpy.cumsum(along_top) - along_top
+    top_before -= top_before[first_step]
+    bottom_before = numpy.arange(len(trapezoid)) - first_step - top_before
+    other = numpy.where(along_top, bottom_before, top_before)
+    own_start = numpy.where(along_top, top_start[trapezoid], bottom_start[trapezoid])
+    other_start = numpy.where(along_top, bottom_start[trapezoid], top_start[trapezoid])
+    keys = numpy.stack(
+        [
+            corners[own_start + offset],
+            corners[own_start + offset + 1],
+            corners[other_start + other],
+        ],
+        axis=1,
+    )
+    triangles = numpy.stack(
+        [keys >> 21 & ((1 << 21) - 1), keys & ((1 << 21) - 1)], axis=2
+    )
+    # Wind them clockwise, so they face down
+    first = triangles[:, 1] - triangles[:, 0]
+    second = triangles[:, 2] - triangles[:, 0]
+    anticlockwise = first[:, 0] * second[:, 1] - first[:, 1] * second[:, 0] > 0
+    triangles[anticlockwise] = triangles[anticlockwise][:, [0, 2, 1]]
+    layer = numpy.full(triangles.shape[:2] + (1,), BOTTOM, dtype=numpy.int64)
+    return numpy.concatenate([triangles, layer], axis=2)
+
+
+# Families of straight lines a grid outline can run along, as the direction
+# along them, and how to get each line's number and a point's position on it
+LINE_FAMILIES = [
+    ((1, 0), lambda r, c: c, lambda r, c: r),
+    ((0, 1), lambda r, c: r, lambda r, c: c),
+    ((1, 1), lambda r, c: c - r, lambda r, c: r),
+    ((1, -1), lambda r, c: c + r, lambda r, c: r),
+]
+
+
+def _wall_triangles(surface, owned, corners, heights, bottom):
+    """
+    Makes walls down from the open edges of the owned surface triangles.
+    Each straight run of open edges between two corner points becomes one
+    wall, whose bottom is a single edge between those corners.
+    """
+    # Find the open edges, directed with the surface on their left
+    open_edges = _open_edges(surface) & numpy.repeat(owned, 3)
+    start_points = surface.reshape((-1, 2))[open_edges]
+    end_points = surface[:, [1, 2, 0]].reshape((-1, 2))[open_edges]
+    direction = end_points - start_points
+    # Work out which line each edge is on, and the corner its run starts at
+    corner_rows = corners >> 21 & ((1 << 21) - 1)
+    corner_cols = corners & ((1 << 21) - 1)
+    runs = numpy.empty((len(direction), 4), dtype=numpy.int64)
+    position = numpy.empty(len(direction), dtype=numpy.int64)
+    for index, (along, line, place) in enumerate(LINE_FAMILIES):
+        corner_lines = line(corner_rows, corner_cols)
+        corner_places = place(corner_rows, corner_cols)
+        order = numpy.lexsort((corner_places, corner_lines))
+        corner_places = corner_places[order]
+        corner_keys = _line_keys(corner_lines[order], corner_places)
+        for way in (1, -1):
+            mask = (direction[:, 0] == along[0] * way) & (
+                direction[:, 1] == along[1] * way
+            )
+            rows, cols = start_points[mask, 0], start_points[mask, 1]
+            position[mask] = place(rows, cols) * way
+            edge_keys = _line_keys(line(rows, cols), place(rows, cols))
+            if way == 1:
+                found = numpy.searchsorted(corner_keys, edge_keys, side="right") - 1
+            else:
+                found = numpy.searchsorted(corner_keys, edge_keys)
+            runs[mask, 0] = index
+            runs[mask, 1] = way
+            runs[mask, 2] = line(rows, cols)
+            runs[mask, 3] = corner_places[found]
+    # Group the edges into runs, each in order along the run
+    order = numpy.lexsort((position, runs[:, 3], runs[:, 2], runs[:, 1], runs[:, 0]))
+    start_points, end_points = start_points[order], end_points[order]
+    runs = runs[order]
+    new = numpy.ones(len(order), dtype=bool)
+    new[1:] = (runs[1:] != runs[:-1]).any(axis=1)
+    run_starts = numpy.flatnonzero(new)
+    run_lengths = numpy.diff(numpy.append(run_starts, len(order)))
+    # Single-edge runs are just a quad
+    single = run_starts[run_lengths == 1]
+    walls = [_wall_quads(start_points[single], end_points[single])]
+    # Two-edge runs are common enough around holes to be worth doing in bulk
+    double = run_starts[run_lengths == 2]
+    walls.append(
+        _wall_pairs(
+            numpy.stack(
+                [start_points[double], end_points[double], end_points[double + 1]],
+                axis=1,
+            ),
+            heights,
+            bottom,
+        )
+    )
+    # Longer ones have their top edge zipped down onto the bottom edge
+    for run_start, length in zip(
+        run_starts[run_lengths > 2], run_lengths[run_lengths > 2]
+    ):
+        chain = numpy.concatenate(
+            [
+                start_points[run_start : run_start + 1],
+                end_points[run_start : run_start + length],
+            ]
+        )
+        walls.append(_wall_run(chain, heights[chain[:, 0], chain[:, 1]], bottom))
+    return numpy.concatenate(walls)
+
+
+def _line_keys(lines, places):
+    """
+    Packs line numbers and positions along them into sortable int64 keys
+    """
+    return ((lines + (1 << 22)) << 22) | places
+
+
+def _wall_quads(start_points, end_points):
+    """
+    Makes outward-facing wall quads down from single (row, column) edges
+    """
+    layers = numpy.full((len(start_points), 1), TOP)
+    top_starts = numpy.concatenate([start_points, layers], axis=1)
+    top_ends = numpy.concatenate([end_points, layers], axis=1)
+    bottom_starts = top_starts.copy()
+    bottom_starts[:, 2] = BOTTOM
+    bottom_ends = top_ends.copy()
+    bottom_ends[:, 2] = BOTTOM
+    return numpy.concatenate(
+        [
+            numpy.stack([top_ends, top_starts, bottom_starts], axis=1),
+            numpy.stack([top_ends, bottom_starts, bottom_ends], axis=1),
+        ]
+    ).astype(numpy.int64)
+
+
+def _wall_pairs(chains, heights, bottom):
+    """
+    Triangulates the walls under many straight chains of three (row, column)
+    top points at once, the same way _wall_run would.
+    """
+    z = heights[chains[..., 0], chains[..., 1]]
+    # Each wall's points, as top points 0-2 then the bottom ends 3 and 4
+    points = numpy.concatenate(
+        [
+            numpy.concatenate(
+                [chains, numpy.full(chains.shape[:2] + (1,), TOP)], axis=2
+            ),
+            numpy.concatenate(
+                [chains[:, [0, 2]], numpy.full((len(chains), 2, 1), BOTTOM)], axis=2
+            ),
+        ],
+        axis=1,
+    )
+    places = numpy.stack(
+        [
+            numpy.broadcast_to([0, 1, 2, 0, 2], z.shape[:1] + (5,)),
+            numpy.concatenate([z, numpy.full((len(z), 2), bottom)], axis=1),
+        ],
+        axis=2,
+    )
+    # The middle point either gets cut off against the start of the bottom
+    # edge, or the end of the bottom edge fans across to it
+    cut = (z[:, 1] - bottom) * 2 > z[:, 2] - bottom
+    triangles = numpy.where(
+        cut[:, None, None],
+        numpy.array([[3, 0, 1], [3, 1, 2], [3, 2, 4]]),
+        numpy.array([[3, 0, 1], [3, 1, 4], [1, 2, 4]]),
+    )
+    rows = numpy.arange(len(chains))[:, None, None]
+    positions = places[rows, triangles]
+    first = positions[:, :, 1] - positions[:, :, 0]
+    second = positions[:, :, 2] - positions[:, :, 0]
+    clockwise = first[..., 0] * second[..., 1] - first[..., 1] * second[..., 0] < 0
+    triangles[clockwise] = triangles[clockwise][:, [0, 2, 1]]
+    return points[rows, triangles].reshape((-1, 3, 3)).astype(numpy.int64)
+
+
+def _wall_run(chain, z, bottom):
+    """
+    Triangulates the wall under a straight chain of (row, column) top points,
+    down to a single bottom edge between its ends.
+
+    Works along the chain keeping a stack of points that dip below the line
+    between their neighbours; whenever a new point lets one be cut off, it
+    is, and whatever is left at the end is fanned down to the last bottom
+    point.
+    """
+    last = len(chain) - 1
+    # Positions along the wall; the bottom ends are -1 and -2
+    places = {-1: (0, bottom), -2: (last, bottom)}
+    places.update((i, (i, z[i])) for i in range(len(chain)))
+
+    def above(first, middle, end):
+        (x1, z1), (x2, z2), (x3, z3) = places[first], places[middle], places[end]
+        return (z2 - z1) * (x3 - x1) > (z3 - z1) * (x2 - x1)
+
+    triangles = []
+    stack = [-1, 0]
+    for point in range(1, len(chain)):
+        while len(stack) >= 2 and above(stack[-2], stack[-1], point):
+            triangles.append((stack[-2], stack[-1], point))
+            stack.pop()
+        stack.append(point)
+    for first, second in zip(stack, stack[1:]):
+        triangles.append((first, second, -2))
+    triangles = numpy.array(triangles)
+    # Wind them to face outwards, which is anticlockwise along the wall
+    positions = numpy.array([places[i] for i in triangles.reshape(-1)])
+    positions = positions.reshape((-1, 3, 2))
+    first = positions[:, 1] - positions[:, 0]
+    second = positions[:, 2] - positions[:, 0]
+    clockwise = first[:, 0] * second[:, 1] - first[:, 1] * second[:, 0] < 0
+    triangles[clockwise] = triangles[clockwise][:, [0, 2, 1]]
+    # Turn them into grid points; negative indexes pick the bottom ends
+    points = numpy.concatenate(
+        [
+            numpy.concatenate([chain, numpy.full((len(chain), 1), TOP)], axis=1),
+            [
+                [chain[-1][0], chain[-1][1], BOTTOM],
+                [chain[0][0], chain[0][1], BOTTOM],
+            ],
+        ]
+    )
+    return points[triangles].astype(numpy.int64)
+
+
+def grid_points(triangles, heights, bottom, thin=False):
+    """
+    Turns (row, column, layer) triangle corners into (x, y, z) points.
+
+    The bottom layer sits at `bottom`, or `bottom` below the surface for thin
+    models.
+    """
+    rows = triangles[..., 0]
+    cols = triangles[..., 1]
+    z = heights[rows, cols]
+    if thin:
+        z = numpy.where(triangles[..., 2] == TOP, z, z - bottom)
+    else:
+        z = numpy.where(triangles[..., 2] == TOP, z, bottom)
+    return numpy.stack([rows, cols, z], axis=-1).astype(numpy.float64)
+
+
+def vertex_keys(rows, cols, layers):
+    """
+    Packs integer (row, column, layer) grid positions into single int64 keys
+    used to deduplicate vertices.
+    """
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    cols = numpy.asarray(cols, dtype=numpy.int64)
+    layers = numpy.asarray(layers, dtype=numpy.int64)
+    return (layers << 42) | (rows << 21) | cols
+
+
+class Mesh:
+    """
+    Represents a mesh of the geography.
+
+    Vertices and faces are kept in growable NumPy arrays. Vertices are
+    deduplicated by an integer key (normally from vertex_keys) and store their
+    unscaled grid position; scaling is only applied when the mesh is exported.
+    """
+
+    def __init__(self, scale, z_reduction=1):
+        self.scale = scale or (1, 1, 1)
+        self.z_reduction = z_reduction
+        self.num_vertices = 0
+        self.num_faces = 0
+        self._keys = numpy.empty(0, dtype=numpy.int64)
+        self._points = numpy.empty((0, 3), dtype=numpy.float64)
+        self._faces = numpy.empty((0, 3), dtype=numpy.int64)
+        # Sorted copy of the keys and the vertex index for each, for lookups
+        self._sorted_keys = numpy.empty(0, dtype=numpy.int64)
+        self._sorted_indices = numpy.empty(0, dtype=numpy.int64)
+        # Single triangles waiting to be added in bulk
+        self._pending_keys = []
+        self._pending_points = []
+
+    @property
+    def vertices(self):
+        """
+        (N, 3) array of unscaled vertex positions
+        """
+        self._flush()
+        return self._points[: self.num_vertices]
+
+    @property
+    def keys(self):
+        self._flush()
+        return self._keys[: self.num_vertices]
+
+    @property
+    def faces(self):
+        """
+        (N, 3) array of vertex indices for each face
+        """
+        self._flush()
+        return self._faces[: self.num_faces]
+
+    def scaled_vertices(self):
+        """
+        Returns vertex positions with the X/Y/Z scale and Z reduction applied
+        """
+        vertices = self.vertices
+        z_units = vertices[:, 2] / 100.0
+        z_scale = self.scale[2] * (self.z_reduction**z_units)
+        return numpy.stack(
+            [
+                vertices[:, 0] * self.scale[0],
+                vertices[:, 1] * self.scale[1],
+                vertices[:, 2] * z_scale,
+            ],
+            axis=1,
+        )
+
+    def face_normals(self):
+        """
+        Returns unit normals for each face (clockwise), from unscaled positions
+        """
+        points = self.vertices[self.faces]
+        normals = numpy.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+        magnitudes = numpy.linalg.norm(normals, axis=1)
+        magnitudes[magnitudes == 0] = 1
+        return normals / magnitudes[:, None]
+
+    def vertex_indices(self, keys, points):
+        """
+        Returns the index of each vertex key, adding new ones with the given
+        positions. Negative keys are never deduplicated.
+        """
+        keys = numpy.asarray(keys, dtype=numpy.int64).reshape(-1)
+        points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 3))
+        indices = numpy.empty(len(keys), dtype=numpy.int64)
+        # Keys without deduplication always get new vertices
+        loose = keys < 0
+        if loose.any():
+            indices[loose] = self._append_vertices(keys[loose], points[loose])
+        keys = keys[~loose]
+        points = points[~loose]
+        unique, first, inverse = numpy.unique(
+            keys, return_index=True, return_inverse=True
+        )
+        unique_indices = numpy.empty(len(unique), dtype=numpy.int64)
+        # Look up keys we already have
+        position = numpy.searchsorted(self._sorted_keys, unique)
+        position[position == len(self._sorted_keys)] = 0
+        found = (
+            self._sorted_keys[position] == unique
+            if len(self._sorted_keys)
+            else numpy.zeros(len(unique), dtype=bool)
+        )
+        unique_indices[found] = self._sorted_indices[position[found]]
+        # Add the rest, in order of first appearance
+        new = numpy.flatnonzero(~found)
+        new = new[numpy.argsort(first[new])]
+        unique_indices[new] = self._append_vertices(unique[new], points[first[new]])
+        if len(new):
+            merged_keys = numpy.concatenate([self._sorted_keys, unique[new]])
+            merged_indices = numpy.concatenate(
+                [self._sorted_indices, unique_indices[new]]
+            )
+            order = numpy.argsort(merged_keys, kind="stable")
+            self._sorted_keys = merged_keys[order]
+            self._sorted_indices = merged_indices[order]
+        indices[~loose] = unique_indices[inverse.reshape(-1)]
+        return indices
+
+    def _append_vertices(self, keys, points):
+        """
+        Appends vertices without any deduplication, returning their indices.
+        """
+        start = self.num_vertices
+        end = start + len(keys)
+        if end > len(self._keys):
+            capacity = max(end, len(self._keys) * 2)
+            self._keys = _grow(self._keys, capacity)
+            self._points = _grow(self._points, capacity)
+        self._keys[start:end] = keys
+        self._points[start:end] = points
+        self.num_vertices = end
+        return numpy.arange(start, end, dtype=numpy.int64)
+
+    def add_faces(self, faces):
+        """
+        Adds faces as an (N, 3) array of existing vertex indices
+        """
+        faces = numpy.asarray(faces, dtype=numpy.int64).reshape((-1, 3))
+        start = self.num_faces
+        end = start + len(faces)
+        if end > len(self._faces):
+            self._faces = _grow(self._faces, max(end, len(self._faces) * 2))
+        self._faces[start:end] = faces
+        self.num_faces = end
+
+    def add_triangles(self, keys, points):
+        """
+        Adds many triangles at once, from (N, 3) vertex keys and their
+        (N, 3, 3) unscaled positions.
+        """
+        self._flush()
+        self._add_triangles(keys, points)
+
+    def _add_triangles(self, keys, points):
+        if not len(keys):
+            return
+        self.add_faces(self.vertex_indices(keys, points).reshape((-1, 3)))
+
+    def _flush(self):
+        """
+        Adds any single triangles that are waiting in bulk
+        """
+        if self._pending_keys:
+            keys = numpy.array(self._pending_keys, dtype=numpy.int64)
+            points = numpy.array(self._pending_points, dtype=numpy.float64)
+            self._pending_keys = []
+            self._pending_points = []
+            self._add_triangles(keys, points)
+
+    def set_arrays(self, keys, points, faces):
+        """
+        Replaces the mesh contents wholesale
+        """
+        self._pending_keys = []
+        self._pending_points = []
+        self._keys = numpy.ascontiguousarray(keys, dtype=numpy.int64)
+        self._points = numpy.ascontiguousarray(points, dtype=numpy.float64)
+        self._faces = numpy.ascontiguousarray(faces, dtype=numpy.int64)
+        self.num_vertices = len(self._keys)
+        self.num_faces = len(self._faces)
+        dedupe = numpy.flatnonzero(self._keys >= 0)
+        order = numpy.argsort(self._keys[dedupe], kind="stable")
+        self._sorted_keys = self._keys[dedupe][order]
+        self._sorted_indices = dedupe[order]
+
+    def add_grid(
+        self, heights, bottom, thin=False, first_row=0, rows=None, max_error=None
+    ):
+        """
+        Triangulates a grid of heights (NaN for no data) onto the mesh.
+
+        Models with a flat base get a compact one (see compact_triangles). If
+        max_error is given, the top surface only uses as many triangles as it
+        needs to stay within that many height units of the grid.
+
+        first_row is the row number of the grid's first row, for grids that
+        are bands out of a larger one. If rows is given as (start, end), only
+        faces whose lowest row is in that range are added, so neighbouring
+        bands that overlap can be meshed without repeating any faces.
+        """
+        owned = None
+        if max_error is not None:
+            triangles = closed_triangles(rtin_triangles(heights, max_error))
+        elif thin:
+            triangles = grid_triangles(heights, thin=thin)
+        else:
+            # Solid models get a compact base, which already knows which
+            # faces belong to this band
+            if rows is not None:
+                owned = (rows[0] - first_row, rows[1] - first_row)
+            surface = grid_triangles(heights, closed=False)[..., :2]
+            triangles = compact_triangles(surface, heights, bottom, strips=owned)
+        points = grid_points(triangles, heights, bottom, thin=thin)
+        triangles[..., 0] += first_row
+        points[..., 0] += first_row
+        if rows is not None and owned is None:
+            lowest = triangles[:, :, 0].min(axis=1)
+            owned = (lowest >= rows[0]) & (lowest < rows[1])
+            triangles = triangles[owned]
+            points = points[owned]
+        self.add_triangles(
+            vertex_keys(triangles[..., 0], triangles[..., 1], triangles[..., 2]),
+            points,
+        )
+
+    def add_triangle(self, point1, point2, point3, layers=(TOP, TOP, TOP)):
+        """
+        Adds a single triangle of (row, column, z) points, on the given layers
+        """
+        points = (point1, point2, point3)
+        self._pending_keys.append(
+            [
+                (layer << 42) | (int(point[0]) << 21) | int(point[1])
+                for point, layer in zip(points, layers)
+            ]
+        )
+        self._pending_points.append([tuple(point) for point in points])
+
+    def add_quad(self, point1, point2, point3, point4, layers=(TOP, TOP, TOP, TOP)):
+        """
+        Adds a quad to the file, made out of two facets. Pass vertices in
+        clockwise order.
+        """
+        self.add_triangle(point1, point2, point4, (layers[0], layers[1], layers[3]))
+        self.add_triangle(point2, point3, point4, (layers[1], layers[2], layers[3]))
+
+    def add_surface(self, point1, point2, point3, bottom, thin=False):
+        """
+        Adds a facet with a matching flat bottom polygon.
+        Points should be clockwise looking from the top.
+        """
+        self.add_triangle(
+            (point1[0], point1[1], point1[2]),
+            (point2[0], point2[1], point2[2]),
+            (point3[0], point3[1], point3[2]),
+        )
+        if thin:
+            self.add_triangle(
+                (point1[0], point1[1], point1[2] - bottom),
+                (point3[0], point3[1], point3[2] - bottom),
+                (point2[0], point2[1], point2[2] - bottom),
+                (BOTTOM, BOTTOM, BOTTOM),
+            )
+        else:
+            self.add_triangle(
+                (point1[0], point1[1], bottom),
+                (point2[0], point2[1], bottom),
+                (point3[0], point3[1], bottom),
+                (BOTTOM, BOTTOM, BOTTOM),
+            )
+
+    def add_edge(self, point1, point2, bottom, thin=False):
+        """
+        Adds a quad to form an edge between the two vertices.
+        Vertices should be left, right looking from the outside of the model.
+        """
+        if thin:
+            self.add_quad(
+                (point1[0], point1[1], point1[2]),
+                (point2[0], point2[1], point2[2]),
+                (point2[0], point2[1], point2[2] - bottom),
+                (point1[0], point1[1], point1[2] - bottom),
+                (TOP, TOP, BOTTOM, BOTTOM),
+            )
+        else:
+            self.add_quad(
+                (point1[0], point1[1], point1[2]),
+                (point2[0], point2[1], point2[2]),
+                (point2[0], point2[1], bottom),
+                (point1[0], point1[1], bottom),
+                (TOP, TOP, BOTTOM, BOTTOM),
+            )
+
+    def simplify(self, tolerance=1e-6, locked=None):
+        """
+        Simplifies the mesh by collapsing flat vertices - those where all the
+        attached faces share a normal, to within tolerance - into a neighbour.
+
+        Each pass works out every safe collapse across the whole mesh at once,
+        and passes repeat until they stop making meaningful progress. locked
+        is an optional boolean array of vertices that must be kept.
+        Returns the number of vertices removed.
+        """
+        random = numpy.random.RandomState(0)
+        points = self.scaled_vertices()
+        # Only vertices near the last pass's changes can have become flat
+        active = numpy.ones(self.num_vertices, dtype=bool)
+        removed = 0
+        while True:
+            merge_from, merge_to, active = self._flat_collapses(
+                points, tolerance, locked, active, random
+            )
+            if not len(merge_from):
+                return removed
+            keep = self.collapse(merge_from, merge_to)
+            points = points[keep]
+            active = active[keep]
+            if locked is not None:
+                locked = locked[keep]
+            removed += len(merge_from)
+            # Stop once passes are only picking off stragglers
+            if len(merge_from) * 1000 < self.num_vertices:
+                return removed
+
+    def _flat_collapses(self, points, tolerance, locked, active, random):
+        """
+        Finds active flat vertices that can all be collapsed into neighbours at
+        once without flipping or flattening any face.
+
+        Returns arrays of the vertices to remove and where each one goes, and
+        the vertices worth looking at on the next pass.
+        """
+        num_vertices = self.num_vertices
+        # Work on just the faces around active vertices
+        faces = self.faces
+        faces = faces[active[faces].any(axis=1)]
+        num_faces = len(faces)
+        # Face normals
+        corners = points[faces]
+        normals = numpy.cross(
+            corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]
+        )
+        lengths = numpy.linalg.norm(normals, axis=1)
+        lengths[lengths == 0] = 1
+        normals /= lengths[:, None]
+        # Vertex-face incidence, with each vertex's faces grouped together
+        incidence = scipy.sparse.csr_matrix(
+            (
+                numpy.ones(num_faces * 3),
+                (faces.reshape(-1), numpy.repeat(numpy.arange(num_faces), 3)),
+            ),
+            shape=(num_vertices, num_faces),
+        )
+        counts = numpy.diff(incidence.indptr)
+        vertex_faces = incidence.indices
+        owners = numpy.repeat(numpy.arange(num_vertices), counts)
+        # A vertex is flat if every attached face is close to their mean normal
+        mean_normals = incidence @ normals
+        magnitudes = numpy.linalg.norm(mean_normals, axis=1)
+        magnitudes[magnitudes == 0] = 1
+        mean_normals /= magnitudes[:, None]
+        dots = numpy.einsum("ij,ij->i", normals[vertex_faces], mean_normals[owners])
+        has_faces = counts > 0
+        min_dots = numpy.full(num_vertices, -numpy.inf)
+        min_dots[has_faces] = numpy.minimum.reduceat(
+            dots, incidence.indptr[:-1][has_faces]
+        )
+        flat = active & has_faces & (min_dots >= 1 - tolerance)
+        # Never move vertices on open edges, or ones we were told to keep
+        edges = faces[:, [0, 1, 1, 2, 2, 0]].reshape((-1, 2))
+        edge_ids, edge_counts = numpy.unique(
+            edges.min(axis=1) * num_vertices + edges.max(axis=1), return_counts=True
+        )
+        edges = numpy.stack([edge_ids // num_vertices, edge_ids % num_vertices], axis=1)
+        flat[edges[edge_counts != 2].reshape(-1)] = False
+        if locked is not None:
+            flat &= ~locked
+        # Keep an independent set of the flat vertices, along with all the
+        # others, and move every other flat vertex onto a kept neighbour
+        starts, ends = edges[:, 0], edges[:, 1]
+        staying = ~flat
+        undecided = flat.copy()
+        priority = random.permutation(num_vertices)
+        while undecided.any():
+            both = undecided[starts] & undecided[ends]
+            losers = numpy.where(priority[starts] < priority[ends], starts, ends)
+            winners = undecided.copy()
+            winners[losers[both]] = False
+            staying |= winners
+            undecided &= ~winners
+            undecided[ends[winners[starts]]] = False
+            undecided[starts[winners[ends]]] = False
+        # Each moving vertex goes to its highest-priority staying neighbour
+        best = numpy.full(num_vertices, -1)
+        for source, neighbour in ((starts, ends), (ends, starts)):
+            usable = ~staying[source] & staying[neighbour]
+            numpy.maximum.at(best, source[usable], priority[neighbour[usable]])
+        moving = numpy.flatnonzero(best >= 0)
+        target = numpy.arange(num_vertices)
+        target[moving] = numpy.argsort(priority)[best[moving]]
+        # Back out any move that would flip a face or squash it flat, until
+        # what's left is clean
+        moved = numpy.zeros(num_vertices, dtype=bool)
+        moved[moving] = True
+        affected = numpy.flatnonzero(moved[faces].any(axis=1))
+        checking = affected
+        while len(checking):
+            new_faces = target[faces[checking]]
+            collapsed = (
+                (new_faces[:, 0] == new_faces[:, 1])
+                | (new_faces[:, 1] == new_faces[:, 2])
+                | (new_faces[:, 2] == new_faces[:, 0])
+            )
+            corners = points[new_faces]
+            new_normals = numpy.cross(
+                corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]
+            )
+            new_lengths = numpy.linalg.norm(new_normals, axis=1)
+            alignment = numpy.einsum("ij,ij->i", new_normals, normals[checking])
+            bad = ~collapsed & (
+                (new_lengths <= 1e-12) | (alignment < (1 - tolerance) * new_lengths)
+            )
+            if not bad.any():
+                break
+            backed_out = numpy.zeros(num_vertices, dtype=bool)
+            backed_out[faces[checking[bad]].reshape(-1)] = True
+            backed_out &= moved
+            moved[backed_out] = False
+            target[backed_out] = numpy.flatnonzero(backed_out)
+            # Only faces around the vertices we backed out can have changed
+            affected = affected[moved[faces[affected]].any(axis=1)]
+            checking = affected[backed_out[faces[affected]].any(axis=1)]
+        # Next time, look at flat vertices that stayed and the faces we changed
+        next_active = flat & ~moved
+        next_active[faces[affected].reshape(-1)] = True
+        merge_from = numpy.flatnonzero(moved)
+        return merge_from, target[merge_from], next_active
+
+    def decimate(self, target_faces=None, max_deviation=None, locked=None):
+        """
+        Reduces the top surface with quadric error decimation, down to
+        target_faces faces or until it would move more than max_deviation
+        (in output units), whichever comes first. The base, walls and any
+        locked vertices are kept as they are.
+        Returns the number of vertices removed.
+        """
+        merge_from, merge_to = qem_collapses(
+            self.scaled_vertices(),
+            self.faces,
+            target_faces=target_faces,
+            max_deviation=max_deviation,
+            locked=locked,
+        )
+        self.collapse(merge_from, merge_to)
+        return len(merge_from)
+
+    def collapse(self, merge_from, merge_to):
+        """
+        Merges each vertex in merge_from into the matching one in merge_to,
+        removing faces that become zero-sized and compacting the arrays.
+        Returns a boolean array of which old vertices were kept.
+        """
+        # Follow merges through to a vertex that is kept
+        forward = numpy.arange(self.num_vertices)
+        forward[merge_from] = merge_to
+        while True:
+            followed = forward[forward]
+            if numpy.array_equal(followed, forward):
+                break
+            forward = followed
+        # Work out the new index of each old vertex
+        keep = numpy.ones(self.num_vertices, dtype=bool)
+        keep[merge_from] = False
+        vertex_map = (numpy.cumsum(keep) - 1)[forward]
+        # Rewrite faces, removing those that are now zero size
+        faces = vertex_map[self.faces]
+        faces = faces[
+            (faces[:, 0] != faces[:, 1])
+            & (faces[:, 1] != faces[:, 2])
+            & (faces[:, 2] != faces[:, 0])
+        ]
+        self.set_arrays(self.keys[keep], self.vertices[keep], faces)
+        return keep
+
+    def save(self, path):
+        """
+        Saves the mesh as a binary STL file
+        """
+        write_stl(path, self.scaled_vertices(), self.faces)
+
+
+def _grow(array, capacity):
+    """
+    Returns a copy of array with room for capacity rows
+    """
+    grown = numpy.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
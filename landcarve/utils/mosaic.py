@@ -0,0 +1,76 @@
+import os
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+import numpy
+from osgeo import gdal
+
+from landcarve.constants import NODATA
+from landcarve.utils.io import copy_to_geotiff
+
+
+def write_mosaic(input_paths, output_path, blend="last", bounds=None):
+    """
+    Mosaics the input rasters together, as build_mosaic does. A .vrt output
+    is left as a virtual mosaic; anything else is copied out of one a block
+    at a time.
+    """
+    if output_path.lower().endswith(".vrt"):
+        build_mosaic(input_paths, output_path, blend, bounds)
+        return
+    with tempfile.TemporaryDirectory(prefix="landcarve-") as tmpdir:
+        vrt_path = os.path.join(tmpdir, "mosaic.vrt")
+        build_mosaic(input_paths, vrt_path, blend, bounds)
+        copy_to_geotiff(vrt_path, output_path)
+
+
+def build_mosaic(input_paths, output_path, blend="last", bounds=None):
+    """
+    Writes a VRT mosaic of the input rasters to output_path. Nothing is
+    copied; reading a window of it only reads the parts of the inputs under
+    that window. Where inputs overlap, blend says which valid (non-NODATA)
+    value wins: the last input's, the first input's, or the highest. If
+    bounds (min x, min y, max x, max y) are given, the mosaic only covers
+    them, rather than all the inputs.
+    """
+    if blend == "first":
+        # Later sources are drawn over earlier ones
+        input_paths = list(reversed(input_paths))
+    # Absolute paths, so the mosaic still works wherever it's read from
+    vrt = gdal.BuildVRT(
+        output_path,
+        [os.path.abspath(path) for path in input_paths],
+        VRTNodata=NODATA,
+        outputBounds=bounds,
+    )
+    if vrt is None:
+        raise ValueError("Cannot build a mosaic of %s" % ", ".join(input_paths))
+    # Closing it writes it out
+    vrt = None
+    if blend == "max":
+        use_pixel_function(output_path, "max_pixels")
+
+
+def use_pixel_function(vrt_path, name):
+    """
+    Changes a VRT's band to combine its sources with one of the pixel
+    functions in this module, rather than drawing them over each other.
+    """
+    tree = ElementTree.parse(vrt_path)
+    band = tree.getroot().find("VRTRasterBand")
+    band.set("subClass", "VRTDerivedRasterBand")
+    ElementTree.SubElement(band, "PixelFunctionType").text = __name__ + "." + name
+    ElementTree.SubElement(band, "PixelFunctionLanguage").text = "Python"
+    tree.write(vrt_path)
+
+
+def max_pixels(in_ar, out_ar, *args, **kwargs):
+    """
+    VRT pixel function giving the highest valid value of each cell across
+    the sources. Cells a source doesn't cover come in as NODATA.
+    """
+    stack = numpy.stack(in_ar).astype(numpy.float64)
+    stack[stack == NODATA] = -numpy.inf
+    highest = stack.max(axis=0)
+    highest[highest == -numpy.inf] = NODATA
+    out_ar[:] = highest
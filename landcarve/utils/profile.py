@@ -0,0 +1,152 @@
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from landcarve.utils.io import raster_shape_and_type
+
+
+@contextlib.contextmanager
+def profile_step(records, input_path, step):
+    """
+    Times a pipeline step run in this process, yielding a record for the
+    caller to add shapes and byte counts to. The record is appended to records
+    once the step finishes; if records is None, nothing is kept.
+    """
+    record = {"input": input_path, "step": step}
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    yield record
+    record["wall_time"] = time.perf_counter() - wall_start
+    record["cpu_time"] = time.process_time() - cpu_start
+    record["peak_rss"] = peak_rss()
+    if records is not None:
+        records.append(record)
+
+
+def run_command(command, capture):
+    """
+    Runs a subcommand, returning its return code, its output (if capture is
+    set, otherwise None), and its own CPU time and peak RSS where the
+    platform can tell us them (otherwise None).
+    """
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE if capture else None,
+        stderr=subprocess.STDOUT if capture else None,
+    )
+    output = process.stdout.read() if capture else None
+    if not hasattr(os, "wait4"):
+        process.wait()
+        if capture:
+            process.stdout.close()
+        return process.returncode, output, None, None
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if capture:
+        process.stdout.close()
+    return (
+        process.returncode,
+        output,
+        usage.ru_utime + usage.ru_stime,
+        _rss_bytes(usage.ru_maxrss),
+    )
+
+
+def peak_rss():
+    """
+    Returns the peak resident memory of this process so far, in bytes, or
+    None if the platform can't tell us.
+    """
+    if resource is None:
+        return None
+    return _rss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _rss_bytes(maxrss):
+    # macOS gives bytes, everything else kilobytes
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def array_details(prefix, arr):
+    """
+    Returns the shape, data type and size of an array as record fields.
+    """
+    return {
+        prefix + "_shape": list(arr.shape),
+        prefix + "_dtype": arr.dtype.name,
+        "bytes_" + ("read" if prefix == "input" else "written"): arr.nbytes,
+    }
+
+
+def file_details(prefix, path):
+    """
+    Returns the shape, data type and size of a file as record fields; shape
+    and data type are None if it isn't a raster, and everything is None if
+    it doesn't exist (like the output of a fan-out step).
+    """
+    if not os.path.exists(path):
+        return {
+            prefix + "_shape": None,
+            prefix + "_dtype": None,
+            "bytes_" + ("read" if prefix == "input" else "written"): None,
+        }
+    shape, data_type = raster_shape_and_type(path)
+    return {
+        prefix + "_shape": list(shape) if shape else None,
+        prefix + "_dtype": data_type,
+        "bytes_" + ("read" if prefix == "input" else "written"): os.path.getsize(path),
+    }
+
+
+def write_records(records, path):
+    """
+    Writes profiling records out as JSON lines.
+    """
+    with open(path, "w") as fh:
+        for record in records:
+            fh.write(json.dumps(record) + "\n")
+
+
+def summary_table(records):
+    """
+    Sums up profiling records by step, in pipeline order, returning the lines
+    of a table.
+    """
+    steps = {}
+    for record in records:
+        total = steps.setdefault(
+            record["step"],
+            {"runs": 0, "wall": 0, "cpu": 0, "rss": None, "read": 0, "written": 0},
+        )
+        total["runs"] += 1
+        total["wall"] += record["wall_time"]
+        total["cpu"] += record["cpu_time"] or 0
+        if record["peak_rss"] is not None:
+            total["rss"] = max(total["rss"] or 0, record["peak_rss"])
+        total["read"] += record["bytes_read"] or 0
+        total["written"] += record["bytes_written"] or 0
+    header = "{:>5} {:>9} {:>9} {:>9} {:>9} {:>9}  {}".format(
+        "Runs", "Wall s", "CPU s", "RSS MB", "Read MB", "Write MB", "Step"
+    )
+    lines = [header]
+    for step, total in steps.items():
+        lines.append(
+            "{:>5} {:>9.2f} {:>9.2f} {:>9} {:>9.1f} {:>9.1f}  {}".format(
+                total["runs"],
+                total["wall"],
+                total["cpu"],
+                "-" if total["rss"] is None else "%.1f" % (total["rss"] / 1024**2),
+                total["read"] / 1024**2,
+                total["written"] / 1024**2,
+                step,
+            )
+        )
+    return lines
@@ -0,0 +1,272 @@
+import numpy
+
+
+def rtin_errors(heights):
+    """
+    Works out the approximation error of every possible split point in a
+    right-triangulated irregular network (RTIN) covering a grid of heights
+    (NaN for no data).
+
+    The grid is padded out to a square of 2^k + 1 points by repeating its
+    last row and column, so triangles over its real edges can stay big and be
+    clipped to it afterwards. Each entry is the furthest any grid point is
+    from the surface of the two triangles whose long edge has its middle
+    there, or of any of their smaller children. Triangles that cover both
+    data and no data are always split, so the edges of any NODATA areas end
+    up at full resolution.
+    """
+    rows, cols = heights.shape
+    size = 2
+    while size < max(rows, cols) - 1:
+        size *= 2
+    padding = ((0, size + 1 - rows), (0, size + 1 - cols))
+    missing = numpy.pad(numpy.isnan(heights), padding, mode="constant")
+    values = numpy.pad(
+        numpy.where(numpy.isnan(heights), 0, heights).astype(numpy.float64),
+        padding,
+        mode="edge",
+    )
+    errors = numpy.zeros((size + 1, size + 1), dtype=numpy.float64)
+    # Work up from the smallest triangles to the biggest
+    step = 2
+    while step <= size:
+        half = step // 2
+        # Long edges along the grid lines: each square is cut into quarters
+        # by its diagonals, and each quarter's long edge is a side
+        below, above, left, right = _triangle_errors(
+            values,
+            missing,
+            step,
+            [
+                ((0, 0), (0, step), (half, half)),
+                ((step, 0), (step, step), (half, half)),
+                ((0, 0), (step, 0), (half, half)),
+                ((0, step), (step, step), (half, half)),
+            ],
+        )
+        blocks = size // step
+        edges = numpy.zeros((blocks + 1, blocks), dtype=numpy.float64)
+        edges[:-1] = below
+        edges[1:] = numpy.maximum(edges[1:], above)
+        quarter = half // 2
+        children = [
+            (quarter * sr, quarter * sc) for sr in (-1, 1) for sc in (-1, 1) if quarter
+        ]
+        _set_errors(errors, edges, 0, half, step, children)
+        edges = numpy.zeros((blocks, blocks + 1), dtype=numpy.float64)
+        edges[:, :-1] = left
+        edges[:, 1:] = numpy.maximum(edges[:, 1:], right)
+        _set_errors(errors, edges, half, 0, step, children)
+        # Long edges along square diagonals, which alternate direction
+        main = numpy.maximum(
+            *_triangle_errors(
+                values,
+                missing,
+                step,
+                [
+                    ((0, 0), (step, 0), (step, step)),
+                    ((0, 0), (0, step), (step, step)),
+                ],
+            )
+        )
+        anti = numpy.maximum(
+            *_triangle_errors(
+                values,
+                missing,
+                step,
+                [
+                    ((0, 0), (step, 0), (0, step)),
+                    ((step, step), (step, 0), (0, step)),
+                ],
+            )
+        )
+        index = numpy.arange(blocks)
+        even = (index[:, None] + index[None, :]) % 2 == 0
+        _set_errors(
+            errors,
+            numpy.where(even, main, anti),
+            half,
+            half,
+            step,
+            [(-half, 0), (half, 0), (0, -half), (0, half)],
+        )
+        step *= 2
+    return errors
+
+
+def _set_errors(errors, own, row, col, step, children):
+    """
+    Stores the errors for a regular lattice of split points, starting at
+    (row, col) and step apart, making sure each is at least as big as those
+    of its children (given as offsets from each point).
+    """
+    size = errors.shape[0] - 1
+    rows = numpy.arange(row, size + 1, step)[:, None]
+    cols = numpy.arange(col, size + 1, step)[None, :]
+    for child_row, child_col in children:
+        child_rows = rows + child_row
+        child_cols = cols + child_col
+        inside = (
+            (child_rows >= 0)
+            & (child_rows <= size)
+            & (child_cols >= 0)
+            & (child_cols <= size)
+        )
+        child_errors = errors[child_rows.clip(0, size), child_cols.clip(0, size)]
+        own = numpy.maximum(own, numpy.where(inside, child_errors, 0))
+    errors[rows, cols] = own
+
+
+def _triangle_errors(values, missing, step, triangles, chunk=1 << 22):
+    """
+    For every step-sized square of the grid, works out how far the grid points
+    inside each of the given triangles (as corners relative to the square)
+    are from the flat triangle through its corners. Triangles covering some
+    missing points are given an infinite error, unless they are all missing.
+
+    Returns one (blocks, blocks) array per triangle.
+    """
+    size = values.shape[0] - 1
+    blocks = size // step
+    # Squares as overlapping views, so each includes its edges
+    strides = values.strides
+    view_shape = (blocks, blocks, step + 1, step + 1)
+    view_strides = (strides[0] * step, strides[1] * step) + strides
+    value_blocks = numpy.lib.stride_tricks.as_strided(
+        values, view_shape, view_strides, writeable=False
+    )
+    strides = missing.strides
+    missing_blocks = numpy.lib.stride_tricks.as_strided(
+        missing,
+        view_shape,
+        (strides[0] * step, strides[1] * step) + strides,
+        writeable=False,
+    )
+    local = numpy.arange(step + 1, dtype=numpy.float64)
+    u, v = numpy.meshgrid(local, local, indexing="ij")
+    results = []
+    for corners in triangles:
+        # Barycentric weights of each point in the square for this triangle
+        (r0, c0), (r1, c1), (r2, c2) = corners
+        area = (r1 - r0) * (c2 - c0) - (r2 - r0) * (c1 - c0)
+        w1 = ((u - r0) * (c2 - c0) - (r2 - r0) * (v - c0)) / area
+        w2 = ((r1 - r0) * (v - c0) - (u - r0) * (c1 - c0)) / area
+        w0 = 1 - w1 - w2
+        inside = (w0 >= -1e-9) & (w1 >= -1e-9) & (w2 >= -1e-9)
+        points = numpy.nonzero(inside)
+        weights = numpy.stack([w0[points], w1[points], w2[points]])
+        error = numpy.empty((blocks, blocks), dtype=numpy.float64)
+        # Do a few rows of squares at a time to keep memory down
+        per_chunk = max(1, chunk // max(1, blocks * len(points[0])))
+        for start in range(0, blocks, per_chunk):
+            block_values = value_blocks[start : start + per_chunk]
+            block_missing = missing_blocks[start : start + per_chunk]
+            heights = block_values[:, :, points[0], points[1]]
+            corner_heights = numpy.stack(
+                [block_values[:, :, r, c] for r, c in corners], axis=-1
+            )
+            flat = corner_heights @ weights
+            deviation = numpy.abs(flat - heights).max(axis=2)
+            gaps = block_missing[:, :, points[0], points[1]]
+            mixed = gaps.any(axis=2) & ~gaps.all(axis=2)
+            error[start : start + per_chunk] = numpy.where(mixed, numpy.inf, deviation)
+        results.append(error)
+    return results
+
+
+def rtin_triangles(heights, max_error):
+    """
+    Triangulates the surface of a grid of heights (NaN for no data) with as
+    few triangles as the RTIN needs to stay within max_error (in height units)
+    of every grid point.
+
+    Returns an (N, 3, 2) integer array of (row, column) triangle corners,
+    wound anticlockwise so they face upwards.
+    """
+    errors = rtin_errors(heights)
+    size = errors.shape[0] - 1
+    rows, cols = heights.shape
+    # Start with the two halves of the square; a and b are the ends of the
+    # long edge and c is the right-angled corner
+    a = numpy.array([[0, 0], [size, size]])
+    b = numpy.array([[size, size], [0, 0]])
+    c = numpy.array([[size, 0], [0, size]])
+    result = []
+    while len(a):
+        # Only the smallest triangles, across one grid cell, can't be split
+        middle = (a + b) // 2
+        split = numpy.zeros(len(a), dtype=bool)
+        if abs(a[0] - b[0]).max() > 1:
+            split = errors[middle[:, 0], middle[:, 1]] > max_error
+        result.append(numpy.stack([a[~split], b[~split], c[~split]], axis=1))
+        # Split the rest in two about the middle of their long edge
+        a, b, c, middle = a[split], b[split], c[split], middle[split]
+        a, b, c = (
+            numpy.concatenate([c, b]),
+            numpy.concatenate([a, c]),
+            numpy.concatenate([middle, middle]),
+        )
+    triangles = _clip_triangles(numpy.concatenate(result), rows - 1, cols - 1)
+    # Keep the triangles that have data at every corner
+    present = ~numpy.isnan(heights)
+    triangles = triangles[present[triangles[..., 0], triangles[..., 1]].all(axis=1)]
+    # Wind them all anticlockwise
+    first = triangles[:, 1] - triangles[:, 0]
+    second = triangles[:, 2] - triangles[:, 0]
+    clockwise = first[:, 0] * second[:, 1] - first[:, 1] * second[:, 0] < 0
+    triangles[clockwise] = triangles[clockwise][:, [0, 2, 1]]
+    return triangles
+
+
+def _clip_triangles(triangles, max_row, max_col):
+    """
+    Clips (N, 3, 2) triangles to the grid's real extent, dropping those
+    outside it and cutting those across its edges into smaller ones. RTIN
+    triangle edges all run along grid lines or diagonals, so the cuts always
+    land on grid points.
+    """
+    inside = (triangles[..., 0] <= max_row).all(axis=1) & (
+        triangles[..., 1] <= max_col
+    ).all(axis=1)
+    outside = (triangles[..., 0] >= max_row).all(axis=1) | (
+        triangles[..., 1] >= max_col
+    ).all(axis=1)
+    clipped = [triangles[inside]]
+    for triangle in triangles[~inside & ~outside]:
+        polygon = [tuple(corner) for corner in triangle]
+        for axis, limit in ((0, max_row), (1, max_col)):
+            polygon = _clip_polygon(polygon, axis, limit)
+        # Fan the clipped polygon out from its first corner
+        for second, third in zip(polygon[1:-1], polygon[2:]):
+            first = polygon[0]
+            area = (second[0] - first[0]) * (third[1] - first[1]) - (
+                second[1] - first[1]
+            ) * (third[0] - first[0])
+            if area:
+                clipped.append(numpy.array([[first, second, third]]))
+    return numpy.concatenate(clipped)
+
+
+def _clip_polygon(polygon, axis, limit):
+    """
+    Cuts a convex polygon, as a list of (row, column) corners, down to the
+    part where the given axis is at most limit.
+    """
+    result = []
+    for start, end in zip(polygon, polygon[1:] + polygon[:1]):
+        if start[axis] <= limit:
+            result.append(start)
+        if min(start[axis], end[axis]) < limit < max(start[axis], end[axis]):
+            # Edges are straight or diagonal, so this divides exactly
+            other = 1 - axis
+            offset = (limit - start[axis]) * (end[other] - start[other])
+            crossing = [0, 0]
+            crossing[axis] = limit
+            crossing[other] = start[other] + offset // (end[axis] - start[axis])
+            result.append(tuple(crossing))
+    # Drop repeated corners
+    return [
+        corner
+        for i, corner in enumerate(result)
+        if corner != result[i - 1] or len(result) == 1
+    ]
@@ -0,0 +1,56 @@
+# Functions that run a command directly on an in-memory array, by command name
+array_steps = {}
+
+# Commands that read their input at the (smaller) size they need, by name
+sized_steps = set()
+
+
+def array_step(name, sink=False, sized=False):
+    """
+    Registers a function as the way to run the named command on an array,
+    so pipelines can run it without going through files.
+
+    The function is called with the array and then the command's options as
+    keyword arguments (everything but the input and output paths), and
+    returns the new array. Sinks instead also get the output path after the
+    array, write their own output, and must be the last step. Sized steps
+    read just what they need of a file (using its overviews, if it has any),
+    so when one is first, pipelines run it on the input file instead.
+    """
+
+    def decorator(function):
+        array_steps[name] = (function, sink)
+        if sized:
+            sized_steps.add(name)
+        return function
+
+    return decorator
+
+
+# Commands that pipelines can fuse into a single pass, by command name
+fusable_steps = {}
+
+
+def fusable_step(name, when=None):
+    """
+    Registers a function describing the named command as a fusable step:
+    one that only picks out some of its input's cells and/or changes each
+    value on its own. Runs of these can be done in a single pass.
+
+    The function is called with its input's (rows, columns) shape, a scan
+    function and the command's options as keyword arguments. It returns
+    (rows, columns, kernel): index arrays picking the output's rows and
+    columns out of its input (None to keep them all), and a function to apply
+    to blocks of values (None to leave them be). scan(function) calls function
+    on each block of the step's input in turn and returns a list of the
+    results, for steps that need to look over all their input first.
+
+    If when is given, it's called with the command's options, and the step
+    is only fused if it returns True.
+    """
+
+    def decorator(function):
+        fusable_steps[name] = (function, when)
+        return function
+
+    return decorator
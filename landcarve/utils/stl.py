@@ -0,0 +1,87 @@
+import shutil
+import struct
+import sys
+import tempfile
+
+import numpy
+
+# One binary STL facet record
+FACET_DTYPE = numpy.dtype(
+    [
+        ("normal", "<f4", (3,)),
+        ("vertices", "<f4", (3, 3)),
+        ("attributes", "<u2"),
+    ]
+)
+
+
+class StlWriter:
+    """
+    Writes a binary STL file, taking facets in as many batches as you like.
+
+    The facet count in the header is filled in when the writer is closed. If
+    the output can't be seeked back to (like stdout), facets are spooled to a
+    temporary file first and copied out at the end.
+    """
+
+    def __init__(self, path, chunk_size=262144):
+        self.chunk_size = chunk_size
+        self.num_facets = 0
+        self.output = None
+        if path == "-":
+            self.output = sys.stdout.buffer
+            self.fh = tempfile.TemporaryFile()
+        else:
+            self.fh = open(path, "wb")
+        # Textual header, then a placeholder for the number of facets
+        self.fh.write(b"landcarve".ljust(80))
+        self.fh.write(struct.pack(b"<L", 0))
+
+    def write(self, vertices, faces):
+        """
+        Writes out facets from an (N, 3) array of vertex positions and an
+        (M, 3) array of vertex indices, one chunk at a time.
+        """
+        for start in range(0, len(faces), self.chunk_size):
+            self.write_triangles(vertices[faces[start : start + self.chunk_size]])
+
+    def write_triangles(self, triangles):
+        """
+        Writes out facets from an (N, 3, 3) array of corner positions
+        """
+        records = numpy.zeros(len(triangles), dtype=FACET_DTYPE)
+        records["vertices"] = triangles
+        normals = numpy.cross(
+            triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+        )
+        magnitudes = numpy.linalg.norm(normals, axis=1)
+        magnitudes[magnitudes == 0] = 1
+        records["normal"] = normals / magnitudes[:, None]
+        self.fh.write(records.tobytes())
+        self.num_facets += len(records)
+
+    def close(self):
+        """
+        Fills in the facet count and finishes the file
+        """
+        self.fh.seek(80)
+        self.fh.write(struct.pack(b"<L", self.num_facets))
+        if self.output is not None:
+            self.fh.seek(0)
+            shutil.copyfileobj(self.fh, self.output)
+            self.output.flush()
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_stl(path, vertices, faces):
+    """
+    Writes a mesh out as a binary STL file
+    """
+    with StlWriter(path) as writer:
+        writer.write(vertices, faces)
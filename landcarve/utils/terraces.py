@@ -0,0 +1,349 @@
+import numpy
+
+from landcarve.utils.mesh import vertex_keys
+
+
+def terrace_triangles(heights, bottom):
+    """
+    Meshes a grid of heights (NaN for no data) as flat-topped columns, one
+    per grid point, sitting on a flat base at `bottom`. Meant for stepped,
+    piecewise-constant DEMs: each flat terrace is covered by as few rectangles
+    as a greedy merge finds, with vertical risers between terraces.
+
+    Columns are a grid cell wide, centred on their grid point, and clipped to
+    the grid so the model is the same size as other meshing modes.
+
+    Returns (N, 3) vertex keys and (N, 3, 3) unscaled points, ready for
+    Mesh.add_triangles.
+    """
+    rows, cols = heights.shape
+    present = ~numpy.isnan(heights)
+    # Number the distinct heights, including the base
+    levels = numpy.unique(numpy.append(heights[present], bottom))
+    base_level = numpy.searchsorted(levels, bottom)
+    labels = numpy.full(heights.shape, -1, dtype=numpy.int64)
+    labels[present] = numpy.searchsorted(levels, heights[present])
+    # Corner positions, clipped to the grid
+    row_places = numpy.clip(numpy.arange(rows + 1) - 0.5, 0, rows - 1)
+    col_places = numpy.clip(numpy.arange(cols + 1) - 0.5, 0, cols - 1)
+    labels, row_places, col_places = _notch_diagonals(
+        labels, base_level, row_places, col_places
+    )
+    present = labels >= 0
+    # Flat faces, as [row corner, col corner, level] corners
+    faces = []
+    normals = []
+    for (start_row, end_row, start_col, end_col, label), level, up in (
+        (_rectangles(labels), None, 1),
+        (_rectangles(numpy.where(present, 0, -1)), base_level, -1),
+    ):
+        level = label if level is None else numpy.full(len(label), level)
+        faces.append(
+            numpy.stack(
+                [
+                    numpy.stack([start_row, start_col, level], axis=1),
+                    numpy.stack([end_row, start_col, level], axis=1),
+                    numpy.stack([end_row, end_col, level], axis=1),
+                    numpy.stack([start_row, end_col, level], axis=1),
+                ],
+                axis=1,
+            )
+        )
+        normals.append(numpy.tile([0, 0, up], (len(label), 1)))
+    # Risers, along each line between columns
+    for axis in (0, 1):
+        grid = labels if axis == 0 else labels.T
+        there = present if axis == 0 else present.T
+        line, start, end, low, high, facing = _risers(grid, there, base_level)
+        corners = [
+            numpy.stack([line, start, low], axis=1),
+            numpy.stack([line, end, low], axis=1),
+            numpy.stack([line, end, high], axis=1),
+            numpy.stack([line, start, high], axis=1),
+        ]
+        if axis == 1:
+            corners = [corner[:, [1, 0, 2]] for corner in corners]
+        faces.append(numpy.stack(corners, axis=1))
+        normal = numpy.zeros((len(line), 3), dtype=numpy.int64)
+        normal[:, axis] = facing
+        normals.append(normal)
+    faces = numpy.concatenate(faces)
+    normals = numpy.concatenate(normals)
+    polygons, sizes = _split_edges(faces)
+    return _triangulate(polygons, sizes, normals, row_places, col_places, levels)
+
+
+def _notch_diagonals(labels, base_level, row_places, col_places, size=0.01):
+    """
+    Finds columns that only touch each other diagonally - where four risers
+    would meet on one vertical edge - and cuts a notch `size` cells square
+    out of one of them, down to the level of the taller of the other two, so
+    the model is manifold by position and not just by vertex.
+
+    The notches go in thin copies of the rows and columns either side of
+    each corner line they're on, so the column labels stay a grid. Returns
+    the new labels, and the row and column corner positions to go with them.
+    """
+    heights = numpy.where(labels >= 0, labels, base_level)
+    padded = numpy.pad(heights, 1, constant_values=base_level)
+    padded_labels = numpy.pad(labels, 1, constant_values=-1)
+    top_left, top_right = padded[:-1, :-1], padded[:-1, 1:]
+    bottom_left, bottom_right = padded[1:, :-1], padded[1:, 1:]
+    falling = numpy.minimum(top_left, bottom_right) > numpy.maximum(
+        top_right, bottom_left
+    )
+    rising = numpy.minimum(top_right, bottom_left) > numpy.maximum(
+        top_left, bottom_right
+    )
+    corner_rows, corner_cols = numpy.nonzero(falling | rising)
+    if not len(corner_rows):
+        return labels, row_places, col_places
+    row_sources, row_places, row_firsts = _thin_strips(
+        labels.shape[0], row_places, corner_rows, size
+    )
+    col_sources, col_places, col_firsts = _thin_strips(
+        labels.shape[1], col_places, corner_cols, size
+    )
+    notched = labels[row_sources][:, col_sources]
+    # Notch the column below the corner; the notch takes on whichever of
+    # the other two columns (in padded coordinates) is taller
+    falls = falling[corner_rows, corner_cols].astype(numpy.int64)
+    other_rows = numpy.stack([corner_rows, corner_rows + 1], axis=1)
+    other_cols = numpy.stack([corner_cols + falls, corner_cols + 1 - falls], axis=1)
+    taller = numpy.arange(len(falls)), padded[other_rows, other_cols].argmax(axis=1)
+    notched[row_firsts[corner_rows] + 1, col_firsts[corner_cols] + falls] = (
+        padded_labels[other_rows[taller], other_cols[taller]]
+    )
+    return notched, row_places, col_places
+
+
+def _thin_strips(count, places, lines, size):
+    """
+    Adds two thin strips at each of the given corner lines along an axis of
+    `count` cells: a copy of the cell before the line just before it, and a
+    copy of the one after just after it, each `size` cells wide.
+
+    Returns which old cell each new one copies, the new corner positions,
+    and where each old line's first new cell is.
+    """
+    extra = numpy.zeros(count + 1, dtype=bool)
+    extra[lines] = True
+    repeats = 1 + 2 * extra[:-1]
+    firsts = numpy.cumsum(repeats) - repeats
+    old = numpy.repeat(numpy.arange(count), repeats)
+    offset = numpy.arange(len(old)) - firsts[old]
+    sources = numpy.where(offset == 0, old - extra[old], old)
+    starts = places[old] + numpy.where(extra[old], offset - 1, 0) * size
+    return sources, numpy.append(starts, places[-1]), firsts
+
+
+def _rectangles(labels):
+    """
+    Greedily covers each run of equal labels in a grid (-1 for nothing) with
+    rectangles, first along each row and then joining identical runs in the
+    rows below.
+
+    Returns start row, end row, start column, end column (as corner indexes,
+    so one past the last cell) and label arrays.
+    """
+    cols = labels.shape[1]
+    # Runs along each row
+    new = numpy.ones(labels.shape, dtype=bool)
+    new[:, 1:] = labels[:, 1:] != labels[:, :-1]
+    run_row, run_start = numpy.nonzero(new)
+    run_end = numpy.append(run_start[1:], cols)
+    run_end[numpy.append(run_row[1:] != run_row[:-1], True)] = cols
+    run_label = labels[run_row, run_start]
+    keep = run_label >= 0
+    run_row, run_start, run_end = run_row[keep], run_start[keep], run_end[keep]
+    run_label = run_label[keep]
+    if not len(run_row):
+        return run_row, run_row, run_start, run_end, run_label
+    # Join each run to an identical one in the row below
+    keys = vertex_keys(run_row, run_start, 0)
+    below = numpy.searchsorted(keys, vertex_keys(run_row + 1, run_start, 0))
+    below = below.clip(0, len(keys) - 1)
+    joined = (
+        (keys[below] == vertex_keys(run_row + 1, run_start, 0))
+        & (run_end[below] == run_end)
+        & (run_label[below] == run_label)
+    )
+    last = numpy.where(joined, below, numpy.arange(len(keys)))
+    while True:
+        further = last[last]
+        if (further == last).all():
+            break
+        last = further
+    first = numpy.ones(len(keys), dtype=bool)
+    first[below[joined]] = False
+    return (
+        run_row[first],
+        run_row[last[first]] + 1,
+        run_start[first],
+        run_end[first],
+        run_label[first],
+    )
+
+
+def _risers(columns, present, base_level):
+    """
+    Finds the vertical faces between neighbouring columns along the first
+    axis of a grid of column top levels, merging runs of identical ones.
+    Where there's no data, or off the edge of the grid, columns stop at the
+    base.
+
+    Returns the corner line each is on, its start and end corners along
+    that line, its bottom and top levels, and which way along the first axis
+    it faces.
+    """
+    cols = columns.shape[1]
+    # Levels either side of each line between rows
+    padded = numpy.where(present, columns, base_level)
+    padded = numpy.pad(padded, ((1, 1), (0, 0)), constant_values=base_level)
+    before = padded[:-1]
+    after = padded[1:]
+    low = numpy.minimum(before, after)
+    high = numpy.maximum(before, after)
+    facing = numpy.sign(before - after)
+    # Runs along each line with the same riser
+    new = numpy.ones(low.shape, dtype=bool)
+    new[:, 1:] = (
+        (low[:, 1:] != low[:, :-1])
+        | (high[:, 1:] != high[:, :-1])
+        | (facing[:, 1:] != facing[:, :-1])
+    )
+    line, start = numpy.nonzero(new)
+    end = numpy.append(start[1:], cols)
+    end[numpy.append(line[1:] != line[:-1], True)] = cols
+    keep = facing[line, start] != 0
+    line, start, end = line[keep], start[keep], end[keep]
+    return (
+        line,
+        start,
+        end,
+        low[line, start],
+        high[line, start],
+        facing[line, start],
+    )
+
+
+def _split_edges(faces):
+    """
+    Takes (N, 4, 3) rectangles given by their [row corner, col corner, level]
+    corners, and adds every other face's corner that lies along each edge
+    into it, so the faces meet without any T-junctions.
+
+    Returns the (M, 3) points of all the polygons one after the other, and
+    how many points each has.
+    """
+    ends = numpy.roll(faces, -1, axis=1)
+    # Which of the three coordinates each edge runs along
+    along = (ends != faces).argmax(axis=2).reshape(-1)
+    starts = faces.reshape((-1, 3))
+    ends = ends.reshape((-1, 3))
+    edge = numpy.arange(len(starts))
+    # The line each edge is on, given by its direction and the other two
+    # coordinates, and where along it the edge starts and ends
+    others = numpy.array([[1, 2], [0, 2], [0, 1]])[along]
+    line_keys = (
+        (along << 44) | (starts[edge, others[:, 0]] << 22) | starts[edge, others[:, 1]]
+    )
+    _, line_ids = numpy.unique(line_keys, return_inverse=True)
+    line_ids = line_ids.reshape(-1)
+    start_places = starts[edge, along]
+    end_places = ends[edge, along]
+    # Every point that any edge starts or ends at on each line
+    registry = numpy.unique(
+        numpy.concatenate(
+            [(line_ids << 22) | start_places, (line_ids << 22) | end_places]
+        )
+    )
+    low = numpy.searchsorted(
+        registry, (line_ids << 22) | numpy.minimum(start_places, end_places)
+    )
+    high = numpy.searchsorted(
+        registry,
+        (line_ids << 22) | numpy.maximum(start_places, end_places),
+        side="right",
+    )
+    # Each edge gives all the points along it except the one it ends at
+    counts = high - low - 1
+    offsets = numpy.arange(counts.sum()) - numpy.repeat(
+        numpy.cumsum(counts) - counts, counts
+    )
+    edges = numpy.repeat(edge, counts)
+    forwards = end_places[edges] > start_places[edges]
+    index = numpy.where(forwards, low[edges] + offsets, high[edges] - 1 - offsets)
+    points = numpy.repeat(starts, counts, axis=0)
+    points[numpy.arange(len(points)), along[edges]] = registry[index] & ((1 << 22) - 1)
+    sizes = counts.reshape((-1, 4)).sum(axis=1)
+    return points, sizes
+
+
+def _triangulate(polygons, sizes, normals, row_places, col_places, levels):
+    """
+    Triangulates flat, convex polygons given as consecutive runs of
+    [row corner, col corner, level] points. Plain rectangles become two
+    triangles; ones with extra points along their edges are fanned out from
+    a new point in their middle. Triangles are wound to face along the given
+    normals.
+    """
+    starts = numpy.cumsum(sizes) - sizes
+    keys = vertex_keys(polygons[:, 0], polygons[:, 1], polygons[:, 2])
+    points = numpy.stack(
+        [
+            row_places[polygons[:, 0]],
+            col_places[polygons[:, 1]],
+            levels[polygons[:, 2]],
+        ],
+        axis=1,
+    )
+    # Rectangles
+    plain = numpy.flatnonzero(sizes == 4)
+    corners = starts[plain][:, None, None] + numpy.array([[0, 1, 2], [0, 2, 3]])
+    corners = corners.reshape((-1, 3))
+    plain_keys = keys[corners]
+    plain_points = points[corners]
+    plain_normals = numpy.repeat(normals[plain], 2, axis=0)
+    # Fans around a middle point, keyed on a layer above all the levels
+    fanned = numpy.flatnonzero(sizes > 4)
+    polygon = numpy.repeat(fanned, sizes[fanned])
+    first = numpy.repeat(starts[fanned], sizes[fanned])
+    offset = numpy.arange(len(polygon)) - numpy.repeat(
+        numpy.cumsum(sizes[fanned]) - sizes[fanned], sizes[fanned]
+    )
+    this = first + offset
+    following = first + (offset + 1) % sizes[polygon]
+    middles = _polygon_middles(points, starts, sizes)[fanned]
+    fan_keys = numpy.stack(
+        [
+            vertex_keys(0, 0, len(levels)) + polygon,
+            keys[this],
+            keys[following],
+        ],
+        axis=1,
+    )
+    fan_points = numpy.stack(
+        [numpy.repeat(middles, sizes[fanned], axis=0), points[this], points[following]],
+        axis=1,
+    )
+    fan_normals = normals[polygon]
+    keys = numpy.concatenate([plain_keys, fan_keys])
+    points = numpy.concatenate([plain_points, fan_points])
+    normals = numpy.concatenate([plain_normals, fan_normals])
+    # Wind them all to face the right way
+    facing = numpy.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+    backwards = numpy.einsum("ij,ij->i", facing, normals) < 0
+    keys[backwards] = keys[backwards][:, [0, 2, 1]]
+    points[backwards] = points[backwards][:, [0, 2, 1]]
+    return keys, points
+
+
+def _polygon_middles(points, starts, sizes):
+    """
+    Returns the average position of each run of polygon points
+    """
+    if not len(starts):
+        return numpy.empty((0, 3))
+    totals = numpy.add.reduceat(points, starts, axis=0)
+    return totals / sizes[:, None]
@@ -24,11 +24,10 @@ setup(
         "click~=7.0",
         "svgwrite~=1.4",
         "scikit-image~=0.16",
+        "scipy~=1.3",
         "requests~=2.18",
         "simplification~=0.5",
         "laspy[lazrs]~=2.5.0",
-        "trimesh~=4.4.1",
-        "manifold3d~=2.5.1",
     ],
     entry_points={"console_scripts": ["landcarve = landcarve.cli:main"]},
 )
@@ -0,0 +1,48 @@
+import os
+
+from landcarve.utils.cache import StepCache
+from landcarve.utils.io import set_geotiff_options
+
+
+def write_bytes(size):
+    def write(path):
+        with open(path, "wb") as fh:
+            fh.write(b"\0" * size)
+
+    return write
+
+
+def test_oversized_entry_keeps_cache(tmp_path):
+    cache = StepCache(str(tmp_path), 100)
+    cache.put("small", ".npz", write_bytes(50), 50)
+    cache.put("large", ".npz", write_bytes(200), 200)
+    assert cache.get("small", ".npz")
+    assert not cache.get("large", ".npz")
+
+
+def test_sidecars_are_kept_with_entries(tmp_path):
+    def write(path):
+        write_bytes(40)(path)
+        write_bytes(10)(path + ".json")
+
+    cache = StepCache(str(tmp_path), 100)
+    cache.put("first", ".npy", write, 50)
+    os.utime(os.path.join(tmp_path, "first.npy"), (0, 0))
+    cache.put("second", ".npy", write, 50)
+    cache.put("third", ".npy", write, 50)
+    assert sorted(os.listdir(tmp_path)) == [
+        "second.npy",
+        "second.npy.json",
+        "third.npy",
+        "third.npy.json",
+    ]
+
+
+def test_key_depends_on_raster_options():
+    before = StepCache.key("hash", ["zfit"])
+    set_geotiff_options(compress="zstd")
+    try:
+        assert StepCache.key("hash", ["zfit"]) != before
+    finally:
+        set_geotiff_options(compress=None)
+    assert StepCache.key("hash", ["zfit"]) == before
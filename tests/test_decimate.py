@@ -0,0 +1,18 @@
+import pytest
+
+from landcarve.utils.mesh import Mesh
+from tests.test_realise import hills
+from tests.utils import is_closed_manifold, stl_round_trip
+
+
+@pytest.mark.parametrize("target_faces", [100, 500])
+def test_decimate_reaches_target(target_faces):
+    """
+    Decimation keeps going along the walls once the top surface runs out, so
+    it reaches the target and the mesh stays watertight.
+    """
+    mesh = Mesh(scale=(1, 1, 1))
+    mesh.add_grid(hills(60, 60), -1)
+    mesh.decimate(target_faces=target_faces)
+    assert mesh.num_faces <= target_faces
+    assert is_closed_manifold(stl_round_trip(mesh))
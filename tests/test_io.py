@@ -0,0 +1,23 @@
+import numpy
+import pytest
+
+from landcarve.utils.io import Raster, array_to_raster, map_raster
+
+
+@pytest.mark.parametrize("suffix", [".tif", ".npy"])
+def test_map_raster_keeps_georeferencing(tmp_path, suffix):
+    input_path = str(tmp_path / "input.tif")
+    output_path = str(tmp_path / ("output" + suffix))
+    arr = numpy.arange(12, dtype=numpy.float32).reshape((3, 4))
+    array_to_raster(arr, input_path, offset_and_pixel=(100, 200, 10, 1))
+    map_raster(input_path, output_path, lambda arr: arr)
+    before = Raster(input_path)
+    after = Raster(output_path)
+    assert after.geotransform is not None
+    # Each cell's value stays in the same place
+    for raster in (before, after):
+        x, x_col, _, y, _, y_row = raster.geotransform
+        data = raster.read()
+        row = int((202.5 - y) // y_row)
+        col = int((125 - x) // x_col)
+        assert data[row, col] == arr[2, 2]
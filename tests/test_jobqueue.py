@@ -0,0 +1,27 @@
+import os
+
+from landcarve.utils.jobqueue import JobQueue
+
+
+def test_stale_worker_cannot_finish_reclaimed_job(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.add("input.tif")
+    stale_claim, stale_job = queue.claim()
+    # The first worker goes quiet, so its job is reclaimed and claimed again
+    os.utime(queue.path("running", stale_claim), (0, 0))
+    assert queue.reclaim(stale_after=60, retries=2) == 1
+    claim, job = queue.claim()
+    assert claim != stale_claim
+    # The first worker coming back mustn't move the new claim's job on
+    queue.finish(stale_claim, stale_job, False, retries=2)
+    assert queue.counts() == {"pending": 0, "running": 1, "done": 0, "failed": 0}
+    assert queue.finish(claim, job, True, retries=2) == "done"
+    assert queue.counts() == {"pending": 0, "running": 0, "done": 1, "failed": 0}
+    assert queue.read("done", claim.split(".")[0])["attempts"] == 1
+
+
+def test_add_skips_running_jobs(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    assert queue.add("input.tif")
+    queue.claim()
+    assert not queue.add("input.tif")
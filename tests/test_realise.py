@@ -0,0 +1,42 @@
+import numpy
+import pytest
+
+from landcarve.commands.realise import slice_layers
+from landcarve.utils.mesh import Mesh
+from landcarve.utils.terraces import terrace_triangles
+from tests.utils import is_closed_manifold, stl_round_trip, volume
+
+
+def hills(rows=20, cols=24):
+    """
+    Smooth, bumpy heights from 0 to 20
+    """
+    row, col = numpy.indices((rows, cols)) / 3.0
+    heights = numpy.sin(row) * numpy.cos(col * 0.7) + numpy.sin(row * 0.4 + col * 0.3)
+    heights -= heights.min()
+    return heights / heights.max() * 20
+
+
+def mesh_stl(heights, bottom, engine):
+    mesh = Mesh(scale=(1, 1, 1))
+    if engine == "terraces":
+        mesh.add_triangles(*terrace_triangles(heights, bottom))
+    else:
+        mesh.add_grid(heights, bottom)
+    return stl_round_trip(mesh)
+
+
+@pytest.mark.parametrize("engine", ["grid", "terraces"])
+def test_slices_add_up_to_the_model(engine):
+    heights = hills()
+    if engine == "terraces":
+        heights = numpy.round(heights)
+    whole = volume(mesh_stl(heights, -1, engine))
+    total = 0
+    for layer_heights, layer_bottom in slice_layers(
+        heights, [4, 9, 13.5, 9999], -1, terraces=engine == "terraces", lift=0.001
+    ):
+        layer = mesh_stl(layer_heights, layer_bottom, engine)
+        assert is_closed_manifold(layer)
+        total += volume(layer)
+    assert abs(total - whole) < 1e-4 * whole
@@ -0,0 +1,31 @@
+import numpy
+
+from landcarve.utils.mesh import Mesh
+from landcarve.utils.terraces import terrace_triangles
+from tests.utils import is_closed_manifold, stl_round_trip, volume
+
+
+def terrace_stl(heights):
+    mesh = Mesh(scale=(1, 1, 1))
+    mesh.add_triangles(*terrace_triangles(heights, 0))
+    return stl_round_trip(mesh)
+
+
+def test_checkerboard_is_manifold():
+    heights = (numpy.indices((4, 5)).sum(axis=0) % 2 + 1).astype(float)
+    assert is_closed_manifold(terrace_stl(heights))
+
+
+def test_checkerboard_with_gaps_is_manifold():
+    heights = (numpy.indices((4, 5)).sum(axis=0) % 2 + 1).astype(float)
+    heights[heights == 1] = numpy.nan
+    assert is_closed_manifold(terrace_stl(heights))
+
+
+def test_notches_barely_change_volume():
+    heights = (numpy.indices((4, 5)).sum(axis=0) % 2 + 1).astype(float)
+    # Columns at the edge of the grid are clipped to half a cell
+    rows = numpy.diff(numpy.clip(numpy.arange(5) - 0.5, 0, 3))
+    cols = numpy.diff(numpy.clip(numpy.arange(6) - 0.5, 0, 4))
+    expected = (rows[:, None] * cols[None, :] * heights).sum()
+    assert abs(volume(terrace_stl(heights)) - expected) < 1e-3 * expected
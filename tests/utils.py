@@ -0,0 +1,51 @@
+import collections
+import os
+import tempfile
+
+import numpy
+
+from landcarve.utils.stl import FACET_DTYPE
+
+
+def stl_round_trip(mesh):
+    """
+    Saves a mesh as an STL and reads its triangles back, as an (N, 3, 3)
+    array of corner positions
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "mesh.stl")
+        mesh.save(path)
+        return numpy.fromfile(path, dtype=FACET_DTYPE, offset=84)["vertices"]
+
+
+def is_closed_manifold(triangles):
+    """
+    Checks that triangles, joined up by the positions of their corners as an
+    STL reader would, are closed and consistently wound: every edge is used
+    exactly once each way round.
+    """
+    _, ids = numpy.unique(triangles.reshape((-1, 3)), axis=0, return_inverse=True)
+    ids = ids.reshape((-1, 3))
+    if (ids == numpy.roll(ids, 1, axis=1)).any():
+        return False
+    edges = collections.Counter(
+        (start, end)
+        for triangle in ids
+        for start, end in zip(triangle, numpy.roll(triangle, -1))
+    )
+    return all(
+        count == 1 and edges[end, start] == 1 for (start, end), count in edges.items()
+    )
+
+
+def volume(triangles):
+    """
+    Returns the volume enclosed by closed, outward-facing triangles
+    """
+    triangles = triangles.astype(numpy.float64)
+    return (
+        numpy.einsum(
+            "ij,ij->i", triangles[:, 0], numpy.cross(triangles[:, 1], triangles[:, 2])
+        ).sum()
+        / 6
+    )